@@ -317,6 +317,49 @@ class TestLoginWithPassword(object):
         theuser = user.User(uid)
         assert theuser.email == email
 
+    def test_user_index(self):
+        """
+        checks the lookups in the user profile index
+        """
+        self.createUser(u"__TestUser3__", u"ekERErwerwerh", email="__TestUser3__@moinhost")
+        uid = self.user.id
+        assert user.getUserId(u"__TestUser3__") == uid
+        assert user.getUserId(u"__testuser3__") is None
+        assert [u.id for u in user.get_by_filter('name', u"__TestUser3", prefix=True)] == [uid]
+        assert [u.id for u in user.get_by_filter('name', u"__testuser3", prefix=True)] == []
+        assert user.get_by_email_address("__TestUser3__@moinhost").id == uid
+        # the index is updated on save
+        self.user.name = u"__TestUser4__"
+        self.user.save()
+        assert user.getUserId(u"__TestUser3__") is None
+        assert user.getUserId(u"__TestUser4__") == uid
+        # and can be rebuilt from the user profiles
+        index = user.get_user_index()
+        index.rebuild([])
+        assert user.getUserId(u"__TestUser4__") is None
+        user.rebuild_user_index()
+        assert user.getUserId(u"__TestUser4__") == uid
+
+    def test_profile_cache(self):
+        """
+        checks that user profiles are loaded from the cache while they did not change
+        """
+        self.createUser(u"__TestUser5__", u"ekERErwerwerh", email="__TestUser5__@moinhost")
+        uid = self.user.id
+        assert user.User(uid).email == "__TestUser5__@moinhost"
+        backend = user.get_user_backend()
+        get_item = backend.get_item
+        try:
+            backend.get_item = None # loading the profile would fail now
+            assert user.User(uid).email == "__TestUser5__@moinhost"
+        finally:
+            backend.get_item = get_item
+        # saving the profile invalidates the cached data
+        theuser = user.User(uid)
+        theuser.email = "__TestUser6__@moinhost"
+        theuser.save()
+        assert user.User(uid).email == "__TestUser6__@moinhost"
+
     # Helpers ---------------------------------------------------------
 
     def createUser(self, name, password, pwencoded=False, email=None):
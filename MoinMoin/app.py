@@ -116,10 +116,14 @@ def create_app_ext(flask_config_file=None, flask_config_dict=None,
     clock.start('create_app init backends')
     app.unprotected_storage, app.storage = init_backends(app)
     clock.stop('create_app init backends')
-    clock.start('create_app index rebuild')
-    if app.cfg.index_rebuild:
-        app.unprotected_storage.index_rebuild() # XXX run this from a script
-    clock.stop('create_app index rebuild')
+    # worker pool for concurrent conversion of transcluded items
+    app.include_pool = app.cfg.include_pool and app.cfg.include_pool()
+    clock.start('create_app index update')
+    if app.cfg.index_rebuild or app.unprotected_storage.index_outdated:
+        app.unprotected_storage.index_rebuild()
+    elif app.cfg.index_update:
+        app.unprotected_storage.index_update()
+    clock.stop('create_app index update')
     clock.start('create_app load/save xml')
     import_export_xml(app)
     clock.stop('create_app load/save xml')
@@ -168,11 +172,17 @@ def init_backends(app):
     index_uri = app.cfg.router_index_uri
     # Just initialize with unprotected backends.
     unprotected_mapping = [(ns, backend) for ns, backend, acls in ns_mapping]
-    unprotected_storage = router.RouterBackend(unprotected_mapping, index_uri=index_uri)
-    # Protect each backend with the acls provided for it in the mapping at position 2
+    unprotected_storage = router.RouterBackend(unprotected_mapping, index_uri=index_uri,
+                                               group_re=app.cfg.cache.item_group_regexact)
+    # Protect each backend with the acls provided for it in the mapping at position 2,
+    # the item acls are looked up in the index
     amw = acl.AclWrapperBackend
-    protected_mapping = [(ns, amw(app.cfg, backend, **acls)) for ns, backend, acls in ns_mapping]
-    storage = router.RouterBackend(protected_mapping, index_uri=index_uri)
+    index = unprotected_storage._index
+    protected_mapping = [(ns, amw(app.cfg, backend, index=index, mountpoint=ns, **acls))
+                         for ns, backend, acls in ns_mapping]
+    # both routers see the same items, so they share the index (also needed
+    # for in-memory indexes, which can't be shared via the index_uri)
+    storage = router.RouterBackend(protected_mapping, index=index)
     return unprotected_storage, storage
 
 
@@ -6,6 +6,11 @@
     @license: GNU GPL, see COPYING for details.
 """
 
+import time
+
+from MoinMoin._tests import become_trusted, update_item
+from MoinMoin.items import COMMENT
+
 class TestFeeds(object):
     def test_global_atom(self):
         with self.app.test_client() as c:
@@ -16,3 +21,24 @@ class TestFeeds(object):
             assert '<feed xmlns="http://www.w3.org/2005/Atom">' in rv.data
             assert '</feed>' in rv.data
 
+
+    def test_item_atom(self):
+        become_trusted()
+        update_item(u'FeedItem', 0, {COMMENT: u'first revision'}, 'some content')
+        update_item(u'FeedItem', 1, {COMMENT: u'second revision'}, 'changed content')
+        with self.app.test_client() as c:
+            rv = c.get('/+feed/atom/FeedItem')
+            assert rv.status == '200 OK'
+            assert rv.data.count('<entry') == 2
+            assert 'second revision' in rv.data
+            rv = c.get('/+feed/atom/FeedItem?count=1')
+            assert rv.data.count('<entry') == 1
+            assert 'first revision' not in rv.data
+        update_item(u'FeedItem', 2, {COMMENT: u'third revision'}, 'new content')
+        with self.app.test_client() as c:
+            # the commit invalidated the cached feed
+            rv = c.get('/+feed/atom/FeedItem?count=1')
+            assert rv.data.count('<entry') == 1
+            assert 'third revision' in rv.data
+            rv = c.get('/+feed/atom/FeedItem?since=%d' % (time.time() + 3600))
+            assert rv.data.count('<entry') == 0
@@ -22,54 +22,92 @@ from MoinMoin import log
 logging = log.getLogger(__name__)
 
 from MoinMoin import wikiutil
-from MoinMoin.i18n import _, L_, N_
+from MoinMoin.i18n import _, L_, N_, get_locale
 from MoinMoin.apps.feed import feed
 from MoinMoin.items import NAME, ACL, MIMETYPE, ACTION, ADDRESS, HOSTNAME, USERID, COMMENT
 from MoinMoin.themes import get_editor_info
 from MoinMoin.items import Item
 
+def _atom_entry(rev):
+    """
+    Render the feed entry for revision <rev> (see AtomFeed.add).
+
+    The entry itself is not cached, as the rendered content depends on the
+    user (ACLs of included items), language and url root - but the expensive
+    parts are: the diff text is cached by the data hashes (see
+    Text._cached_diff), the full rendering by _render_data (its cache key
+    contains user, language and url root).
+
+    @return: dict of AtomFeed.add keyword arguments
+    """
+    this_rev = rev
+    this_revno = rev.revno
+    item = rev.item
+    name = rev[NAME]
+    try:
+        hl_item = Item.create(rev.item_name, rev_no=this_revno)
+        previous_revno = this_revno - 1
+        if previous_revno >= 0:
+            # simple text diff for changes
+            previous_rev = item.get_revision(previous_revno)
+            content = hl_item._render_data_diff_text(previous_rev, this_rev)
+            content = '<div><pre>%s</pre></div>' % content
+        else:
+            # full html rendering for new items
+            content = hl_item._render_data()
+        content_type = 'xhtml'
+    except Exception, e:
+        logging.exception("content rendering crashed")
+        content = _(u'MoinMoin feels unhappy.')
+        content_type = 'text'
+    return dict(title=name, title_type='text',
+                summary=rev.get(COMMENT, ''), summary_type='text',
+                content=content, content_type=content_type,
+                author=get_editor_info(rev, external=True),
+                url=url_for('frontend.show_item', item_name=name, rev=this_revno, _external=True),
+                updated=datetime.utcfromtimestamp(rev.timestamp),
+               )
+
+
 @feed.route('/atom/<itemname:item_name>')
 @feed.route('/atom', defaults=dict(item_name=''))
 def atom(item_name):
+    """
+    Atom feed of the latest changes of <item_name> (or of all items, if it
+    is empty). The 'count' query string parameter gives the maximum number
+    of entries (see app.cfg.history_count for default and maximum), 'since'
+    (UNIX timestamp) excludes older revisions.
+    """
     # maybe we need different modes:
     # - diffs in html don't look great without stylesheet
     # - full item in html is nice
     # - diffs in textmode are OK, but look very simple
     # - full-item content in textmode is OK, but looks very simple
-    cid = wikiutil.cache_key(usage="atom", item_name=item_name)
+    default_count, max_count = app.cfg.history_count
+    count = min(request.values.get('count', default_count, type=int), max_count)
+    if count < 1:
+        count = default_count
+    since = request.values.get('since', 0, type=int)
+    revs = [rev for rev in flaskg.storage.history(item_name=item_name, limit=count)
+            if rev.timestamp >= since]
+    # a new revision changes the key, so the cached feed is used until the
+    # next commit. ACLs filter the revisions and the rendered content, so the
+    # user is part of the key, as well as language and url root (used in the
+    # entries).
+    u = flaskg.user
+    if u.valid:
+        user_key = u.name, u.auth_method in app.cfg.auth_methods_trusted
+    else:
+        user_key = None
+    cid = wikiutil.cache_key(usage="atom", item_name=item_name, count=count, since=since,
+                             latest=revs and revs[0].history_key or None,
+                             user=user_key, locale=get_locale(), url_root=request.url_root)
     content = app.cache.get(cid)
     if content is None:
         title = app.cfg.sitename
         feed = AtomFeed(title=title, feed_url=request.url, url=request.host_url)
-        for rev in flaskg.storage.history(item_name=item_name):
-            this_rev = rev
-            this_revno = rev.revno
-            item = rev.item
-            name = rev[NAME]
-            try:
-                hl_item = Item.create(name, rev_no=this_revno)
-                previous_revno = this_revno - 1
-                if previous_revno >= 0:
-                    # simple text diff for changes
-                    previous_rev = item.get_revision(previous_revno)
-                    content = hl_item._render_data_diff_text(previous_rev, this_rev)
-                    content = '<div><pre>%s</pre></div>' % content
-                else:
-                    # full html rendering for new items
-                    content = hl_item._render_data()
-                content_type = 'xhtml'
-            except Exception, e:
-                logging.exception("content rendering crashed")
-                content = _(u'MoinMoin feels unhappy.')
-                content_type = 'text'
-            feed.add(title=name, title_type='text',
-                     summary=rev.get(COMMENT, ''), summary_type='text',
-                     content=content, content_type=content_type,
-                     author=get_editor_info(rev, external=True),
-                     url=url_for('frontend.show_item', item_name=name, rev=this_revno, _external=True),
-                     updated=datetime.utcfromtimestamp(rev.timestamp),
-                    )
+        for rev in revs:
+            feed.add(**_atom_entry(rev))
         content = feed.to_string()
         app.cache.set(cid, content)
     return Response(content, content_type='application/atom+xml')
-
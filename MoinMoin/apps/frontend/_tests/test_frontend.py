@@ -5,10 +5,14 @@
     @copyright: 2010 MoinMoin:ThomasWaldmann
     @license: GNU GPL, see COPYING for details.
 """
+import re
+
 from MoinMoin.apps.frontend import views
 from werkzeug import ImmutableMultiDict
-from flask import flaskg
+from flask import flaskg, json
 from MoinMoin import user
+from MoinMoin.items import Item, ITEMLINKS, ITEMTRANSCLUSIONS, TAGS
+from MoinMoin._tests import become_trusted
 
 class TestFrontend(object):
     def test_root(self):
@@ -38,6 +42,50 @@ class TestFrontend(object):
             assert '<html>' in rv.data
             assert '</html>' in rv.data
 
+    def test_global_history(self):
+        with self.app.test_client() as c:
+            for qs in ['', '?count=2', '?count=-1&after=garbage', ]:
+                rv = c.get('/+history' + qs)
+                assert rv.status == '200 OK'
+                assert rv.headers['Content-Type'] == 'text/html; charset=utf-8'
+                assert '</html>' in rv.data
+
+    def test_history_paging(self):
+        become_trusted()
+        for text in ['first', 'second', 'third']:
+            Item.create(u'PagedItem')._save({}, text, mimetype='text/plain')
+        with self.app.test_client() as c:
+            for url in ['/+history?count=1', '/+history/PagedItem?count=1', ]:
+                rv = c.get(url)
+                assert rv.status == '200 OK'
+                # the next page has the same size
+                assert 'count=1' in rv.data
+                assert 'after=' in rv.data
+
+    def test_search(self):
+        with self.app.test_client() as c:
+            for qs in ['', '?value=foo', '?value=foo&titlesearch=1&count=1&start=1', '?value=(foo', '?value=language:en', ]:
+                rv = c.get('/+search' + qs)
+                assert rv.status == '200 OK'
+                assert rv.headers['Content-Type'] == 'text/html; charset=utf-8'
+                assert '</html>' in rv.data
+
+    def test_search_paging(self):
+        become_trusted()
+        for name in [u'PagedSearch1', u'PagedSearch2', ]:
+            Item.create(name)._save({}, 'pagedsearch text', mimetype='text/plain')
+        def next_url(qs):
+            rv = c.get('/+search' + qs)
+            return re.search(r'<a href="([^"]*)">More results</a>', rv.data).group(1)
+        with self.app.test_client() as c:
+            url = next_url('?value=pagedsearch&count=1')
+            assert 'count=1' in url
+            assert 'start=1' in url
+            assert 'titlesearch' not in url
+            url = next_url('?value=PagedSearch&titlesearch=1&count=1')
+            assert 'count=1' in url
+            assert 'titlesearch=1' in url
+
     def test_global_index(self):
         with self.app.test_client() as c:
             rv = c.get('/+index')
@@ -158,61 +206,73 @@ class TestViews(object):
     """
     Tester class for +backrefs, +orphans and +wanted views
     """
-    class DummyItem(object):
-        """
-        Fake storage object, simulating the page item object from the storage
-        """
-        def __init__(self, name, revision):
-            self.latest_revision = revision
-            self.name = name
-
-        def get_revision(self, *args, **kw):
-            return self.latest_revision
-
-    class DummyRevision(object):
-        """
-        Fake revision object, used for retrieving ITEMTRANSCLUSIONS and ITEMLINKS meta
-        """
-        def __init__(self, links, transclusions):
-            self.links = links
-            self.transclusions = transclusions
-
-        def get(self, meta_name, *args, **kw):
-            if meta_name == 'itemlinks':
-                return self.links
-            if meta_name == 'itemtransclusions':
-                return self.transclusions
-
-    def setup_class(self):
+    def setup_method(self, method):
         # list of tuples
         # (page_name, links, transclusions)
-        items = [('page1', ['page2', 'page3'], ['page2']),
-                 ('page2',  ['page1', 'page3'], []),
-                 ('page3', ['page5'], ['page1']),
-                 ('page4', [], ['page5'])
+        items = [(u'page1', [u'page2', u'page3'], [u'page2']),
+                 (u'page2', [u'page1', u'page3'], []),
+                 (u'page3', [u'page5'], [u'page1']),
+                 (u'page4', [], [u'page5'])
                 ]
-        # we create the list of items
-        self.items = []
-        for item in items:
-            revision = self.DummyRevision(item[1], item[2])
-            page = self.DummyItem(item[0], revision)
-            self.items.append(page)
+        # we create the items in the storage
+        for name, links, transclusions in items:
+            item = flaskg.storage.create_item(name)
+            rev = item.create_revision(0)
+            rev[ITEMLINKS] = links
+            rev[ITEMTRANSCLUSIONS] = transclusions
+            item.commit()
+        # an item without revisions is never an orphan
+        item = flaskg.storage.create_item(u'page6')
+        item.change_metadata()
+        item.publish_metadata()
 
     def test_orphans(self):
-        expected_orphans = sorted(['page4'])
-        result_orphans = sorted(views._orphans(self.items))
+        expected_orphans = sorted([u'page4'])
+        result_orphans = sorted(views._orphans(flaskg.storage))
 
         assert result_orphans == expected_orphans
 
     def test_wanteds(self):
-        expected_wanteds = {'page5': ['page3', 'page4']}
-        result_wanteds = views._wanteds(self.items)
+        expected_wanteds = {u'page5': [u'page3', u'page4']}
+        result_wanteds = views._wanteds(flaskg.storage)
 
         assert result_wanteds == expected_wanteds
 
     def test_backrefs(self):
-        expected_backrefs = sorted(['page1', 'page2'])
-        result_backrefs = sorted(views._backrefs(self.items, 'page3'))
+        expected_backrefs = sorted([u'page1', u'page2'])
+        result_backrefs = sorted(views._backrefs(flaskg.storage, u'page3'))
 
         assert result_backrefs == expected_backrefs
 
+    def test_links_updated(self):
+        item = flaskg.storage.get_item(u'page4')
+        rev = item.create_revision(1)
+        rev[ITEMLINKS] = [u'page3']
+        item.commit()
+        assert views._wanteds(flaskg.storage) == {u'page5': [u'page3']}
+        assert sorted(views._backrefs(flaskg.storage, u'page3')) == [u'page1', u'page2', u'page4']
+        flaskg.unprotected_storage.get_item(u'page1').destroy()
+        assert views._backrefs(flaskg.storage, u'page2') == []
+        assert sorted(views._orphans(flaskg.storage)) == [u'page2', u'page4']
+
+    def test_find_matches(self):
+        item = flaskg.storage.create_item(u'page1/sub')
+        item.create_revision(0)
+        item.commit()
+        start, end, matches = views.findMatches(u'page1')
+        # page6 has no revisions, page1 is the item itself
+        assert matches == {u'page1/sub': 4, u'page2': 8, u'page3': 8, u'page4': 8}
+
+    def test_tag_completion(self):
+        item = flaskg.storage.create_item(u'tagged')
+        rev = item.create_revision(0)
+        rev[TAGS] = [u'fruit', u'food']
+        item.commit()
+        with self.app.test_client() as c:
+            rv = c.get('/+tagcompletion?prefix=fr')
+            assert rv.headers['Content-Type'] == 'application/json'
+            assert json.loads(rv.data) == dict(tags=[u'fruit'])
+            rv = c.get('/+tags')
+            assert 'fruit' in rv.data
+            rv = c.get('/+tags/food')
+            assert 'tagged' in rv.data
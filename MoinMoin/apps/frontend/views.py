@@ -13,9 +13,10 @@
 import re
 import difflib
 import time
-from itertools import chain
+from datetime import datetime
+from itertools import chain, islice
 
-from flask import request, url_for, flash, Response, redirect, session, abort
+from flask import request, url_for, flash, Response, redirect, session, abort, jsonify
 from flask import flaskg
 from flask import current_app as app
 from flaskext.themes import get_themes_list
@@ -34,13 +35,14 @@ logging = log.getLogger(__name__)
 from MoinMoin.i18n import _, L_, N_
 from MoinMoin.themes import render_template
 from MoinMoin.apps.frontend import frontend
-from MoinMoin.items import Item, NonExistent, MIMETYPE, ITEMLINKS, ITEMTRANSCLUSIONS
+from MoinMoin.items import Item, NonExistent, MIMETYPE, ITEMLINKS
 from MoinMoin.items import ROWS_META, COLS, ROWS_DATA
 from MoinMoin import config, user, wikiutil
 from MoinMoin.util.forms import make_generator
 from MoinMoin.security.textcha import TextCha, TextChaizedForm, TextChaValid
-from MoinMoin.storage.error import NoSuchItemError, NoSuchRevisionError, AccessDeniedError
+from MoinMoin.storage.error import NoSuchItemError, AccessDeniedError
 from MoinMoin.signalling import item_displayed, item_modified
+from MoinMoin.search.queryparser import QueryParser, QueryError
 
 
 @frontend.route('/+dispatch', methods=['GET', ])
@@ -72,6 +74,7 @@ Disallow: /+revert/
 Disallow: /+index/
 Disallow: /+sitemap/
 Disallow: /+similar_names/
+Disallow: /+tagcompletion
 Disallow: /+quicklink/
 Disallow: /+subscribe/
 Disallow: /+backrefs/
@@ -489,7 +492,7 @@ def backrefs(item_name):
     @type item_name: unicode
     @return: a page with all the items which link or transclude item_name
     """
-    refs_here = _backrefs(flaskg.storage.iteritems(), item_name)
+    refs_here = _backrefs(flaskg.storage, item_name)
     return render_template('item_link_list.html',
                            item_name=item_name,
                            headline=_(u'Refers Here'),
@@ -497,57 +500,128 @@ def backrefs(item_name):
                           )
 
 
-def _backrefs(items, item_name):
+def _backrefs(storage, item_name):
     """
     Returns a list with all names of items which ref item_name
 
-    @param items: all the items
-    @type items: iteratable sequence
+    @param storage: the (indexed) storage
     @param item_name: the name of the item transcluded or linked
     @type item_name: unicode
     @return: the list of all items which ref item_name
     """
-    refs_here = []
-    for item in items:
-        current_item = item.name
-        try:
-            current_revision = item.get_revision(-1)
-        except NoSuchRevisionError:
-            continue
-        links = current_revision.get(ITEMLINKS, [])
-        transclusions = current_revision.get(ITEMTRANSCLUSIONS, [])
-
-        refs = set(links + transclusions)
-        if item_name in refs:
-            refs_here.append(current_item)
-    return refs_here
+    may_read = flaskg.user.may.read
+    return [name for name in storage.backrefs(item_name) if may_read(name)]
 
 
 @frontend.route('/+search')
 def search():
-    return _search()
+    """
+    Full text (or title, if the 'titlesearch' parameter is given) search for
+    the query given by the 'value' parameter, results are paged by the 'start'
+    and 'count' parameters.
+    """
+    query = request.values.get('value', u'').strip()
+    titlesearch = 'titlesearch' in request.values
+    results, start, next_start, count, error = _search(query, titlesearch=titlesearch)
+    return render_template('search.html',
+                           item_name=u'', # XXX no item here
+                           query=query,
+                           titlesearch=titlesearch,
+                           results=results,
+                           start=start,
+                           next_start=next_start,
+                           count=count,
+                           error=error,
+                          )
 
 
-def _search(**args):
-    return "searching for %r not implemented yet" % args
+def _search(query, titlesearch=False):
+    """
+    Returns one page of the results of searching the index for query.
+
+    @param query: the query (search query parser syntax)
+    @param titlesearch: only search in the item names
+    @return: tuple (results, start, next_start, count, error) - results is a
+             list of (item name, score) tuples, next_start the 'start' parameter
+             value for the next page (None if there is no next page), count the
+             page size used and error the query error message (None if there
+             was no error)
+    """
+    default_count, max_count = app.cfg.search_count
+    count = min(request.values.get('count', default_count, type=int), max_count)
+    if count < 1:
+        count = default_count
+    if not query:
+        return [], 0, None, count, None
+    start = max(request.values.get('start', 0, type=int), 0)
+    try:
+        expr = QueryParser(titlesearch=titlesearch).parse_query(query)
+        results = list(islice(flaskg.storage.search_text(expr), start, start + count + 1))
+    except QueryError, err:
+        return [], 0, None, count, unicode(err)
+    if len(results) > count:
+        results = results[:count]
+        next_start = start + count
+    else:
+        next_start = None
+    return results, start, next_start, count, None
+
+
+HISTORY_KEY_DATETIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+def _history_page(item_name):
+    """
+    Returns one page of the history of item_name (or of the global history,
+    if item_name is empty), starting after the revision given by the 'after'
+    query string parameter. The page size is given by the 'count' query string
+    parameter (see app.cfg.history_count for default and maximum).
+
+    @return: tuple (revisions, after, count) - after is the 'after' parameter
+             value for the next page or None if there is no next page, count
+             the page size used
+    """
+    after = request.values.get('after')
+    if after:
+        try:
+            after_datetime, after_id = after.split('-')
+            after = datetime.strptime(after_datetime, HISTORY_KEY_DATETIME_FORMAT), int(after_id)
+        except ValueError:
+            after = None
+    default_count, max_count = app.cfg.history_count
+    count = min(request.values.get('count', default_count, type=int), max_count)
+    if count < 1:
+        count = default_count
+    # one more than count, so we know whether there is a next page
+    revs = list(flaskg.storage.history(item_name=item_name, limit=count + 1, after=after))
+    if len(revs) > count:
+        revs = revs[:count]
+        rev_datetime, rev_id = revs[-1].history_key
+        after = '%s-%d' % (rev_datetime.strftime(HISTORY_KEY_DATETIME_FORMAT), rev_id)
+    else:
+        after = None
+    return revs, after, count
 
 
 @frontend.route('/+history/<itemname:item_name>')
 def history(item_name):
-    history = flaskg.storage.history(item_name=item_name)
+    history, after, count = _history_page(item_name)
     return render_template('history.html',
                            item_name=item_name, # XXX no item here
                            history=history,
+                           after=after,
+                           count=count,
                           )
 
 
 @frontend.route('/+history')
 def global_history():
-    history = flaskg.storage.history(item_name='')
+    history, after, count = _history_page('')
     item_name = request.values.get('item_name', '') # actions menu puts it into qs
     return render_template('global_history.html',
                            item_name=item_name, # XXX no item
                            history=history,
+                           after=after,
+                           count=count,
                           )
 
 @frontend.route('/+wanteds')
@@ -555,7 +629,7 @@ def wanted_items():
     """ Returns a page with the list of non-existing items, which are wanted items and the
         items they are linked or transcluded to helps show what items still need
         to be written and shows whether there are any broken links. """
-    wanteds = _wanteds(flaskg.storage.iteritems())
+    wanteds = _wanteds(flaskg.storage)
     item_name = request.values.get('item_name', '') # actions menu puts it into qs
     return render_template('wanteds.html',
                            headline=_(u'Wanted Items'),
@@ -563,37 +637,20 @@ def wanted_items():
                            wanteds=wanteds)
 
 
-def _wanteds(items):
+def _wanteds(storage):
     """
     Returns a dict with all the names of non-existing items which are refed by
     other items and the items which are refed by
 
-    @param items: all the items
-    @type items: iteratable sequence
+    @param storage: the (indexed) storage
     @return: a dict with all the wanted items and the items which are beign refed by
     """
-    all_items = set()
+    may_read = flaskg.user.may.read
     wanteds = {}
-    for item in items:
-        current_item = item.name
-        all_items.add(current_item)
-        try:
-            current_rev = item.get_revision(-1)
-        except NoSuchRevisionError:
-            continue
-        # converting to sets so we can get the union
-        outgoing_links = current_rev.get(ITEMLINKS, [])
-        outgoing_transclusions = current_rev.get(ITEMTRANSCLUSIONS, [])
-        outgoing_refs = set(outgoing_transclusions + outgoing_links)
-        for refed_item in outgoing_refs:
-            if refed_item not in all_items:
-                if refed_item not in wanteds:
-                    wanteds[refed_item] = []
-                wanteds[refed_item].append(current_item)
-        if current_item in wanteds:
-            # if a previously wanted item has been found in the items storage, remove it
-            del wanteds[current_item]
-
+    for wanted_name, names in storage.wanteds().items():
+        names = [name for name in names if may_read(name)]
+        if names:
+            wanteds[wanted_name] = names
     return wanteds
 
 
@@ -602,7 +659,7 @@ def orphaned_items():
     """ Return a page with the list of items not being linked or transcluded
         by any other items, that makes
         them sometimes not discoverable. """
-    orphan = _orphans(flaskg.storage.iteritems())
+    orphan = _orphans(flaskg.storage)
     item_name = request.values.get('item_name', '') # actions menu puts it into qs
     return render_template('item_link_list.html',
                            item_name=item_name,
@@ -610,30 +667,17 @@ def orphaned_items():
                            item_names=orphan)
 
 
-def _orphans(items):
+def _orphans(storage):
     """
     Returns a list with the names of all existing items not being refed by any other item
 
-    @param items: the list of all items
-    @type items: iteratable sequence
+    Items without revisions are ignored.
+
+    @param storage: the (indexed) storage
     @return: the list of all orphaned items
     """
-    linked_items = set()
-    transcluded_items = set()
-    all_items = set()
-    norev_items = set()
-    for item in items:
-        all_items.add(item.name)
-        try:
-            current_rev = item.get_revision(-1)
-        except NoSuchRevisionError:
-            norev_items.add(item.name)
-        else:
-            linked_items.update(current_rev.get(ITEMLINKS, []))
-            transcluded_items.update(current_rev.get(ITEMTRANSCLUSIONS, []))
-    orphans = all_items - linked_items - transcluded_items - norev_items
-    logging.info("_orphans: Ignored %d item(s) that have no revisions" % len(norev_items))
-    return list(orphans)
+    may_read = flaskg.user.may.read
+    return [name for name in storage.orphans() if may_read(name)]
 
 
 @frontend.route('/+quicklink/<itemname:item_name>')
@@ -1396,16 +1440,14 @@ def findMatches(item_name, s_re=None, e_re=None):
     @rtype: tuple
     @return: start word, end word, matches dict
     """
-    item_names = [item.name for item in flaskg.storage.iteritems()]
-    if item_name in item_names:
-        item_names.remove(item_name)
     # Get matches using wiki way, start and end of word
-    start, end, matches = wikiMatches(item_name, item_names, start_re=s_re, end_re=e_re)
+    start, end, matches = wikiMatches(item_name, start_re=s_re, end_re=e_re)
+    matches.pop(item_name, None)
     # Get the best 10 close matches
     close_matches = {}
     found = 0
-    for name in closeMatches(item_name, item_names):
-        if name not in matches:
+    for name in closeMatches(item_name):
+        if name != item_name and name not in matches:
             # Skip names already in matches
             close_matches[name] = 8
             found += 1
@@ -1417,7 +1459,7 @@ def findMatches(item_name, s_re=None, e_re=None):
     return start, end, matches
 
 
-def wikiMatches(item_name, item_names, start_re=None, end_re=None):
+def wikiMatches(item_name, item_names=None, start_re=None, end_re=None):
     """
     Get item names that starts or ends with same word as this item name.
 
@@ -1428,7 +1470,8 @@ def wikiMatches(item_name, item_names, start_re=None, end_re=None):
         1 - match start
 
     @param item_name: item name to match
-    @param item_names: list of item names
+    @param item_names: list of item names (default: the item names the
+                       name index finds for the start / end words)
     @param start_re: start word re (compile regex)
     @param end_re: end word re (compile regex)
     @rtype: tuple
@@ -1458,6 +1501,11 @@ def wikiMatches(item_name, item_names, start_re=None, end_re=None):
 
     matches = {}
     subitem = item_name + '/'
+    if item_names is None:
+        storage = flaskg.storage
+        item_names = set(storage.names_starting_with(subitem))
+        item_names.update(storage.names_starting_with(start))
+        item_names.update(storage.names_ending_with(end))
 
     # Find any matching item names and rank by type of match
     for name in item_names:
@@ -1472,16 +1520,18 @@ def wikiMatches(item_name, item_names, start_re=None, end_re=None):
     return start, end, matches
 
 
-def closeMatches(item_name, item_names):
+def closeMatches(item_name, item_names=None):
     """ Get close matches.
 
     Return all matching item names with rank above cutoff value.
 
     @param item_name: item name to match
-    @param item_names: list of item names
+    @param item_names: list of item names (default: use the name index)
     @rtype: list
     @return: list of matching item names, sorted by rank
     """
+    if item_names is None:
+        return flaskg.storage.similar_names(item_name)
     # Match using case insensitive matching
     # Make mapping from lower item names to item names.
     lower = {}
@@ -1561,13 +1611,13 @@ def global_tags():
     """
     show a list or tag cloud of all tags in this wiki
     """
-    counts_tags_names = flaskg.storage.all_tags()
+    counts_tags = flaskg.storage.tag_counts()
     item_name = request.values.get('item_name', '') # actions menu puts it into qs
-    if counts_tags_names:
+    if counts_tags:
         # sort by tag name
-        counts_tags_names = sorted(counts_tags_names, key=lambda e: e[1])
+        counts_tags = sorted(counts_tags, key=lambda e: e[1])
         # this is a simple linear scaling
-        counts = [e[0] for e in counts_tags_names]
+        counts = [e[0] for e in counts_tags]
         count_min = min(counts)
         count_max = max(counts)
         weight_max = 9.99
@@ -1579,7 +1629,7 @@ def global_tags():
             # return the css class for this tag
             weight = scale * (count - count_min)
             return "weight%d" % int(weight)  # weight0, ..., weight9
-        tags = [(cls(count, tag), tag) for count, tag, names in counts_tags_names]
+        tags = [(cls(count, tag), tag) for count, tag in counts_tags]
     else:
         tags = []
     return render_template("global_tags.html",
@@ -1588,6 +1638,17 @@ def global_tags():
                            tags=tags)
 
 
+@frontend.route('/+tagcompletion')
+def tag_completion():
+    """
+    JSON list of the tags starting with the 'prefix' query string parameter
+    (most used tags first), for completion in the tag editor
+    """
+    prefix = request.values.get('prefix', u'')
+    tags = [tag for tag, count in flaskg.storage.tags_starting_with(prefix, limit=20)]
+    return jsonify(tags=tags)
+
+
 @frontend.route('/+tags/<itemname:tag>')
 def tagged_items(tag):
     """
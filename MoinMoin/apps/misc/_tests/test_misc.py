@@ -6,6 +6,10 @@
     @license: GNU GPL, see COPYING for details.
 """
 
+from MoinMoin._tests import become_trusted, update_item
+from MoinMoin.apps.misc import views
+
+
 class TestMisc(object):
     def test_global_sitemap(self):
         with self.app.test_client() as c:
@@ -21,3 +25,43 @@ class TestMisc(object):
             rv = c.get('/+misc/urls_names')
             assert rv.status == '200 OK'
             assert rv.headers['Content-Type'] == 'text/plain; charset=utf-8'
+
+    def test_sitemap_chunks(self):
+        become_trusted()
+        for name in [u'SitemapA', u'SitemapB', u'SitemapC', ]:
+            update_item(name, 0, {}, 'content')
+        saved_chunk_size = views.SITEMAP_CHUNK_SIZE
+        views.SITEMAP_CHUNK_SIZE = 2
+        try:
+            with self.app.test_client() as c:
+                rv = c.get('/+misc/sitemap')
+                assert '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">' in rv.data
+                assert '/+misc/sitemap/0</loc>' in rv.data
+                assert '/+misc/sitemap/1</loc>' in rv.data
+                locs = []
+                chunk = 0
+                while True:
+                    rv = c.get('/+misc/sitemap/%d' % chunk)
+                    if rv.status_code == 404:
+                        break
+                    assert '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">' in rv.data
+                    chunk_locs = rv.data.count('<loc>')
+                    assert chunk_locs <= views.SITEMAP_CHUNK_SIZE
+                    locs.append(rv.data)
+                    chunk += 1
+                assert chunk > 1
+                data = ''.join(locs)
+                # every item is in exactly one chunk, ordered by name
+                for name in ['SitemapA', 'SitemapB', 'SitemapC', ]:
+                    assert data.count('/%s</loc>' % name) == 1
+                assert data.index('/SitemapA<') < data.index('/SitemapB<') < data.index('/SitemapC<')
+        finally:
+            views.SITEMAP_CHUNK_SIZE = saved_chunk_size
+
+    def test_urls_names_items(self):
+        become_trusted()
+        update_item(u'UrlsNamesB', 0, {}, 'content')
+        update_item(u'UrlsNamesA', 0, {}, 'content')
+        with self.app.test_client() as c:
+            rv = c.get('/+misc/urls_names')
+            assert rv.data.index(' UrlsNamesA\n') < rv.data.index(' UrlsNamesB\n')
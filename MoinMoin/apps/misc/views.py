@@ -12,34 +12,76 @@ import time
 
 from flask import Response
 from flask import flaskg
+from flask import _request_ctx_stack
+from werkzeug.exceptions import NotFound
 
 from flask import current_app as app
 
 from MoinMoin.apps.misc import misc
 
-from MoinMoin.themes import render_template
-from MoinMoin import wikiutil
 from MoinMoin.storage.error import NoSuchRevisionError, NoSuchItemError
 
 SITEMAP_HAS_SYSTEM_ITEMS = True
 
-@misc.route('/sitemap')
-def sitemap():
+# max. number of URLs in a sitemap (see sitemap protocol), if there are more
+# items, /sitemap is a sitemap index of sitemaps with that many URLs.
+SITEMAP_CHUNK_SIZE = 50000
+
+LASTMOD_FORMAT = "%Y-%m-%dT%H:%M:%S+00:00"
+
+
+def stream_template(template, **context):
     """
-    Google (and others) XML sitemap
+    Render <template> as an iterator of unicode chunks, to be used as a
+    streamed response body.
+
+    The response body is consumed after the view returned (and the request
+    context was popped), so the current request context is pushed again while
+    rendering - the template and the generators in <context> may use
+    url_for, flaskg, etc.
     """
-    def format_timestamp(ts):
-        return time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(ts))
+    ctx = _request_ctx_stack.top
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template).stream(context)
+    stream.enable_buffering(100)
 
-    sitemap = []
-    for item in flaskg.storage.iteritems():
+    def generate():
+        ctx.push()
+        try:
+            for chunk in stream:
+                yield chunk
+        finally:
+            ctx.pop()
+    return generate()
+
+
+def sitemap_chunks():
+    """
+    number of sitemaps needed for all items (the first one also contains the
+    root url)
+    """
+    return (flaskg.storage.count_current_items() + SITEMAP_CHUNK_SIZE) // SITEMAP_CHUNK_SIZE
+
+
+def sitemap_entries(chunk):
+    """
+    Yield the (item_name, lastmod, changefreq, priority) entries of sitemap
+    <chunk>, ordered by item name.
+    """
+    start, count = chunk * SITEMAP_CHUNK_SIZE, SITEMAP_CHUNK_SIZE
+    if chunk == 0:
+        # add an entry for root url
+        count -= 1
         try:
+            item = flaskg.storage.get_item(app.cfg.item_root)
             rev = item.get_revision(-1)
-        except NoSuchRevisionError:
-            # XXX we currently also get user items, they have no revisions -
-            # but in the end, they should not be readable by the user anyways
-            continue
-        if wikiutil.isSystemItem(item.name):
+            yield (u'', time.strftime(LASTMOD_FORMAT, time.gmtime(rev.timestamp)), "hourly", "1.0")
+        except (NoSuchItemError, NoSuchRevisionError):
+            pass
+    else:
+        start -= 1
+    for name, rev_datetime, sysitem in flaskg.storage.current_items(offset=start, limit=count):
+        if sysitem:
             if not SITEMAP_HAS_SYSTEM_ITEMS:
                 continue
             # system items are rather boring
@@ -49,16 +91,33 @@ def sitemap():
             # these are the content items:
             changefreq = "daily"
             priority = "0.5"
-        sitemap.append((item.name, format_timestamp(rev.timestamp), changefreq, priority))
-    # add an entry for root url
-    try:
-        item = flaskg.storage.get_item(app.cfg.item_root)
-        rev = item.get_revision(-1)
-        sitemap.append((u'', format_timestamp(rev.timestamp), "hourly", "1.0"))
-    except NoSuchItemError:
-        pass
-    sitemap.sort()
-    content = render_template('misc/sitemap.xml', sitemap=sitemap)
+        yield (name, rev_datetime.strftime(LASTMOD_FORMAT), changefreq, priority)
+
+
+@misc.route('/sitemap')
+def sitemap():
+    """
+    Google (and others) XML sitemap
+
+    If there are too many items for one sitemap, this is a sitemap index,
+    referring to the sitemap chunks.
+    """
+    chunks = sitemap_chunks()
+    if chunks > 1:
+        content = stream_template('misc/sitemapindex.xml', chunks=range(chunks))
+    else:
+        content = stream_template('misc/sitemap.xml', sitemap=sitemap_entries(0))
+    return Response(content, mimetype='text/xml')
+
+
+@misc.route('/sitemap/<int:chunk>')
+def sitemap_chunk(chunk):
+    """
+    XML sitemap with the items of chunk <chunk> (see sitemap index)
+    """
+    if chunk >= sitemap_chunks():
+        raise NotFound
+    content = stream_template('misc/sitemap.xml', sitemap=sitemap_entries(chunk))
     return Response(content, mimetype='text/xml')
 
 
@@ -71,9 +130,6 @@ def urls_names():
     can implement SisterWiki functionality easily.
     See: http://usemod.com/cgi-bin/mb.pl?SisterSitesImplementationGuide
     """
-    # XXX we currently also get user items, fix this
-    item_names = [item.name for item in flaskg.storage.iteritems()]
-    item_names.sort()
-    content = render_template('misc/urls_names.txt', item_names=item_names)
+    item_names = (name for name, rev_datetime, sysitem in flaskg.storage.current_items())
+    content = stream_template('misc/urls_names.txt', item_names=item_names)
     return Response(content, mimetype='text/plain')
-
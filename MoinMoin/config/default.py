@@ -376,6 +376,7 @@ options_no_group_name = {
     ('edit_bar', ['Show', 'Highlight', 'Meta', 'Modify', 'Comments', 'Download', 'History', 'Subscribe', 'Quicklink', 'Index', 'Supplementation', 'ActionsMenu'],
      'list of edit bar entries'),
     ('history_count', (100, 200), "number of revisions shown for info/history action (default_count_shown, max_count_shown)"),
+    ('search_count', (25, 100), "number of search results shown per page (default_count_shown, max_count_shown)"),
 
     ('show_hosts', True,
      "if True, show host names and IPs. Set to False to hide them."),
@@ -406,8 +407,10 @@ options_no_group_name = {
     ('namespace_mapping', None,
     "This needs to point to a (correctly ordered!) list of tuples, each tuple containing: Namespace identifier, backend, acl protection to be applied to that backend. " + \
     "E.g.: [('/', FSBackend('wiki/data'), dict(default='All:read,write,create')), ]. Please see HelpOnStorageConfiguration for further reference."),
-    ('index_rebuild', True,
-     'rebuild item index from scratch (you may set this to False to speedup startup once you have an index)'),
+    ('index_rebuild', False,
+     'rebuild item index from scratch at startup (you can also do that with "moin index_build --mode=rebuild"), this is done anyway if the index was created by an older version'),
+    ('index_update', True,
+     'incrementally update the item index at startup (only indexes revisions added since the last update)'),
     ('load_xml', None,
      'If this points to an xml file, the file is loaded into the storage backend(s) upon first request.'),
     ('save_xml', None,
@@ -470,6 +473,9 @@ options_no_group_name = {
     ('log_reverse_dns_lookups', True,
      "if True, do a reverse DNS lookup on page SAVE. If your DNS is broken, set this to False to speed up SAVE."),
 
+    ('include_pool', None,
+     "function f(cfg) that returns a worker pool (an object with a map(function, iterable) method, e.g. multiprocessing.pool.ThreadPool(4)) used to fetch and convert transcluded items concurrently. Only use this with thread safe storage backends and a non-memory index. None: convert them one after the other."),
+
     # some dangerous mimetypes (we don't use "content-disposition: inline" for them when a user
     # downloads such data, because the browser might execute e.g. Javascript contained
     # in the HTML and steal your moin session cookie or do other nasty stuff)
@@ -12,17 +12,20 @@ Expands include elements in a internal Moin document.
 from __future__ import absolute_import
 
 from emeraldtree import ElementTree as ET
-import re
+import re, copy
 
 from MoinMoin import log
 logging = log.getLogger(__name__)
 
-from flask import flaskg
+from flask import current_app as app
+from flask import flaskg, _request_ctx_stack
+from flask.ctx import _RequestGlobals
 
 from MoinMoin import wikiutil
 from MoinMoin.items import Item
 from MoinMoin.util.mime import type_moin_document
 from MoinMoin.util.iri import Iri
+from MoinMoin.util.clock import Clock
 from MoinMoin.util.tree import html, moin_page, xinclude, xlink
 
 from MoinMoin.converter.html_out import wrap_object_with_overlay
@@ -106,6 +109,93 @@ class Converter(object):
         if includes == 'expandall':
             return cls()
 
+    def _include_path(self, href, page_href):
+        """
+        Return the path of the item an include of <href> (an Iri) refers to,
+        relative <href>s are resolved relative to <page_href>.
+        """
+        if href.scheme == 'wiki':
+            if href.authority:
+                raise ValueError("can't handle xinclude for non-local authority")
+            else:
+                path = href.path[1:]
+        elif href.scheme == 'wiki.local':
+            page = page_href
+            path = href.path
+            if path[0] == '':
+                # /subitem
+                tmp = page.path[1:]
+                tmp.extend(path[1:])
+                path = tmp
+            elif path[0] == '..':
+                # ../sisteritem
+                path = page.path[1:] + path[1:]
+        else:
+            raise ValueError("can't handle xinclude for schemes other than wiki or wiki.local")
+        return path
+
+    # flaskg attributes the prefetching workers get from the request
+    worker_globals = ['user', 'storage', 'unprotected_storage', 'dicts', 'groups',
+                      'content_lang', 'current_lang', ]
+
+    def _prefetch(self, names):
+        """
+        Fetch and convert the items <names> concurrently using the worker pool
+        (if there is one), recurse() then takes the results from self.prefetched.
+        """
+        if self.pool is None:
+            return
+        names = [name for name in set(names)
+                 if name not in self.prefetched and flaskg.user.may.read(name)]
+        if len(names) < 2:
+            return # nothing to gain
+        ctx = _request_ctx_stack.top
+        # parse the form data now, the workers share the request (read-only)
+        ctx.request.values
+        g = ctx.g
+        def convert(name):
+            # every worker gets its own request context and flaskg (with the
+            # same user and storage, but e.g. an own clock and acl cache), as
+            # the per-request state is not thread-safe
+            worker_ctx = copy.copy(ctx)
+            worker_ctx.g = _RequestGlobals()
+            for attr in self.worker_globals:
+                if hasattr(g, attr):
+                    setattr(worker_ctx.g, attr, getattr(g, attr))
+            worker_ctx.g.clock = Clock()
+            worker_ctx.push()
+            try:
+                return Item.create(name).internal_representation()
+            except Exception:
+                # we'll try again (and fail visibly) in the request thread
+                logging.exception("converting %r for inclusion failed" % name)
+            finally:
+                worker_ctx.pop()
+        for name, doc in zip(names, self.pool.map(convert, names)):
+            if doc is not None:
+                self.prefetched[name] = doc
+
+    def _prefetch_includes(self, elem, page_href):
+        """
+        Prefetch the items included (by a href) in the document <elem>.
+        """
+        if self.pool is None:
+            return
+        page_href_new = elem.get(self.tag_page_href)
+        if page_href_new:
+            page_href = Iri(page_href_new)
+        names = []
+        for e in elem.iter(self.tag_xi_include):
+            if isinstance(e, ET.Element) and e.tag == self.tag_xi_include:
+                href = e.get(self.tag_xi_href)
+                if href:
+                    try:
+                        path = self._include_path(Iri(href), page_href)
+                    except (ValueError, AttributeError, IndexError):
+                        continue # recurse() will complain
+                    names.append(unicode(path))
+        self._prefetch(names)
+
     def recurse(self, elem, page_href):
         # Check if we reached a new page
         page_href_new = elem.get(self.tag_page_href)
@@ -168,27 +258,8 @@ class Converter(object):
 
                 if href:
                     # We have a single page to include
-                    href = Iri(href)
+                    path = self._include_path(Iri(href), page_href)
                     link = Iri(scheme='wiki', authority='')
-                    if href.scheme == 'wiki':
-                        if href.authority:
-                            raise ValueError("can't handle xinclude for non-local authority")
-                        else:
-                            path = href.path[1:]
-                    elif href.scheme == 'wiki.local':
-                        page = page_href
-                        path = href.path
-                        if path[0] == '':
-                            # /subitem
-                            tmp = page.path[1:]
-                            tmp.extend(path[1:])
-                            path = tmp
-                        elif path[0] == '..':
-                            # ../sisteritem
-                            path = page.path[1:] + path[1:]
-                    else:
-                        raise ValueError("can't handle xinclude for schemes other than wiki or wiki.local")
-
                     link.path = path
 
                     page = Item.create(unicode(path))
@@ -196,6 +267,8 @@ class Converter(object):
 
                 elif xp_include_pages:
                     # We have a regex of pages to include
+                    # (we don't track which items might match it)
+                    self.cacheable = False
                     from MoinMoin.search.term import NameFn
                     inc_match = re.compile(xp_include_pages)
                     root_item = Item(name=u'')
@@ -208,10 +281,12 @@ class Converter(object):
                     if xp_include_items is not None:
                         pagelist = pagelist[xp_include_items + 1:]
 
+                    self._prefetch(pagelist)
                     pages = ((Item.create(p), Iri(scheme='wiki', authority='', path='/' + p)) for p in pagelist)
 
                 included_elements = []
                 for page, page_href in pages:
+                    self.included_names.add(page.name)
                     if page_href in self.stack:
                         w = ('<p xmlns="%s"><strong class="error">Recursive include of "%s" forbidden</strong></p>'
                                 % (html.namespace, page.name))
@@ -229,8 +304,11 @@ class Converter(object):
                         elem_h = ET.Element(self.tag_h, attrib, children=(elem_a, ))
                         div.append(elem_h)
 
-                    page_doc = page.internal_representation()
+                    page_doc = self.prefetched.pop(page.name, None)
+                    if page_doc is None:
+                        page_doc = page.internal_representation()
                     # page_doc.tag = self.tag_div # XXX why did we have this?
+                    self._prefetch_includes(page_doc, page_href)
                     self.recurse(page_doc, page_href)
                     # Wrap the page with the overlay, but only if it's a "page", or "a".
                     # The href needs to be an absolute URI, without the prefix "wiki://"
@@ -260,7 +338,14 @@ class Converter(object):
             self.stack.pop()
 
     def __call__(self, tree):
+        self.pool = getattr(app, 'include_pool', None)
+        self.prefetched = {} # item name -> internal representation
+        self._prefetch_includes(tree, None)
         self.stack = []
+        # names of all (also indirectly) included items:
+        self.included_names = set()
+        # False, if the result depends on more than the included items
+        self.cacheable = True
 
         self.recurse(tree, None)
 
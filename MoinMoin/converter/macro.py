@@ -64,6 +64,8 @@ class Converter(object):
         elem_error = moin_page.error()
 
         cls = plugins.importPlugin(app.cfg, 'macro', name, function='Macro')
+        if not cls.immutable:
+            self.cacheable = False
 
         try:
             macro = cls() # XXX refactor all macros so they are OK without "request"
@@ -76,6 +78,7 @@ class Converter(object):
             # thus, in case of exceptions, we just log the problem and return
             # some standard text.
             logger.exception("Macro %s raised an exception:" % name)
+            self.cacheable = False
             elem_error.append(_('<<%(macro_name)s: execution failed [%(error_msg)s] (see also the log)>>',
                     macro_name=name,
                     error_msg=unicode(e),
@@ -100,6 +103,8 @@ class Converter(object):
                     yield i
 
     def __call__(self, tree):
+        # False, if some macro output might change without the document changing
+        self.cacheable = True
         for elem, page in self.recurse(tree, None):
             self.handle_macro(elem, page)
 
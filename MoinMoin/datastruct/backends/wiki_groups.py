@@ -15,40 +15,104 @@ HelpOnConfiguration.
 @license: GPL, see COPYING for details
 """
 from flask import flaskg
-from MoinMoin.items import USERGROUP
-from MoinMoin.datastruct.backends import GreedyGroup, BaseGroupsBackend, GroupDoesNotExistError
+from MoinMoin.datastruct.backends import BaseGroup, BaseGroupsBackend, GroupDoesNotExistError
 
 
-class WikiGroup(GreedyGroup):
+class WikiGroup(BaseGroup):
+    """
+    A wiki group, its (direct and indirect) members are looked up in the
+    group index (see MoinMoin.storage.backends.indexing.GroupIndex).
 
-    def _load_group(self):
-        group_name = self.name
-        if flaskg.unprotected_storage.has_item(group_name):
-            members, member_groups = super(WikiGroup, self)._load_group()
-            return members, member_groups
-        else:
-            raise GroupDoesNotExistError(group_name)
+    Members of nested wiki groups are already included there, only group
+    names which are no wiki groups (e.g. groups of other group backends)
+    need to be expanded using flaskg.groups.
+    """
+
+    def __init__(self, name, backend):
+        super(WikiGroup, self).__init__(name, backend)
+        if name not in backend:
+            raise GroupDoesNotExistError(name)
+
+    def __contains__(self, member, processed_groups=None):
+        if processed_groups is None:
+            processed_groups = set()
+
+        processed_groups.add(self.name)
+
+        group_index = self._backend.group_index
+        if group_index.has_member(self.name, member):
+            return True
+
+        groups = flaskg.groups
+        for group_name in group_index.other_groups(self.name):
+            if group_name not in processed_groups and group_name in groups and groups[group_name].__contains__(member, processed_groups):
+                return True
+
+        return False
+
+    def __iter__(self, yielded_members=None, processed_groups=None):
+        if processed_groups is None:
+            processed_groups = set()
+
+        if yielded_members is None:
+            yielded_members = set()
+
+        processed_groups.add(self.name)
+
+        members, wiki_groups, other_groups = self._backend.group_index.members(self.name)
+        processed_groups.update(wiki_groups)
+
+        for member in members:
+            if member not in yielded_members:
+                yielded_members.add(member)
+                yield member
+
+        groups = flaskg.groups
+        for group_name in other_groups:
+            if group_name not in processed_groups:
+                if group_name in groups:
+                    for member in groups[group_name].__iter__(yielded_members, processed_groups):
+                        yield member
+                elif group_name not in yielded_members:
+                    yielded_members.add(group_name)
+                    yield group_name
+
+    def __repr__(self):
+        return "<%s name=%s>" % (self.__class__, self.name)
 
 
 class WikiGroups(BaseGroupsBackend):
 
+    @property
+    def group_index(self):
+        return flaskg.unprotected_storage.group_index
+
     def __contains__(self, group_name):
-        return self.is_group_name(group_name) and flaskg.unprotected_storage.has_item(group_name)
+        return self.is_group_name(group_name) and self.group_index.has_group(group_name)
 
     def __iter__(self):
         """
         To find group pages, app.cfg.cache.item_group_regexact pattern is used.
         """
-        all_items = flaskg.unprotected_storage.iteritems()
-        item_list = [item.name for item in all_items
-                     if self.item_group_regex.search(item.name)]
-        return iter(item_list)
+        return iter([group_name for group_name in self.group_index.group_names()
+                     if self.is_group_name(group_name)])
 
     def __getitem__(self, group_name):
         return WikiGroup(name=group_name, backend=self)
 
-    def _retrieve_members(self, group_name):
-        item = flaskg.unprotected_storage.get_item(group_name)
-        rev = item.get_revision(-1)
-        usergroup = rev.get(USERGROUP, [])
-        return usergroup
+    def groups_with_member(self, member):
+        """
+        List all group names of groups containing <member>.
+
+        @param member: member name [unicode]
+        @return: list of group names [unicode]
+        """
+        group_index = self.group_index
+        group_names = set(group_index.groups_with_member(member))
+        # groups containing a group of another backend that contains member
+        groups = flaskg.groups
+        for group_name in group_index.other_group_names():
+            if group_name in groups and member in groups[group_name]:
+                group_names.update(group_index.groups_with_member(group_name))
+        return iter(sorted(group_name for group_name in group_names
+                           if self.is_group_name(group_name)))
@@ -45,13 +45,13 @@ from flask import request, url_for, Response, abort, escape
 from werkzeug import is_resource_modified
 from jinja2 import Markup
 
-from MoinMoin.i18n import _, L_, N_
+from MoinMoin.i18n import _, L_, N_, get_locale
 from MoinMoin.themes import render_template
 from MoinMoin import wikiutil, config, user
 from MoinMoin.util.send_file import send_file
 from MoinMoin.storage.error import NoSuchItemError, NoSuchRevisionError, AccessDeniedError, \
                                    StorageError
-from MoinMoin.storage import HASH_ALGORITHM
+from MoinMoin.storage import HASH_ALGORITHM, MIMETYPE
 
 COLS = 80
 ROWS_DATA = 20
@@ -78,7 +78,6 @@ USERGROUP = "usergroup"
 # needs more precise name / use case:
 SOMEDICT = "somedict"
 
-MIMETYPE = "mimetype"
 SIZE = "size"
 LANGUAGE = "language"
 ITEMLINKS = "itemlinks"
@@ -93,6 +92,20 @@ EXTRA = "extra"
 COMMENT = "comment"
 
 
+def include_state(name):
+    """
+    Return the state of item <name> as far as it is relevant for rendering
+    items that include it: its current revision (number and data hash) and
+    whether the current user may read it.
+    """
+    try:
+        rev = flaskg.unprotected_storage.get_item(name).get_revision(-1)
+        state = rev.revno, rev.get(HASH_ALGORITHM)
+    except (NoSuchItemError, NoSuchRevisionError):
+        state = None
+    return state, flaskg.user.may.read(name)
+
+
 class DummyRev(dict):
     """ if we have no stored Revision, we use this dummy """
     def __init__(self, item, mimetype):
@@ -238,11 +251,18 @@ class Item(object):
         flaskg.clock.stop('conv_in_dom')
         return doc
 
-    def _expand_document(self, doc):
+    def _expand_document(self, doc, include_conv=None, macro_conv=None):
+        """
+        Expand the includes and macros in document <doc>.
+
+        The converters can be given, e.g. to look at what they did afterwards.
+        """
         from MoinMoin.converter import default_registry as reg
         from MoinMoin.util.mime import type_moin_document
-        include_conv = reg.get(type_moin_document, type_moin_document, includes='expandall')
-        macro_conv = reg.get(type_moin_document, type_moin_document, macros='expandall')
+        if include_conv is None:
+            include_conv = reg.get(type_moin_document, type_moin_document, includes='expandall')
+        if macro_conv is None:
+            macro_conv = reg.get(type_moin_document, type_moin_document, macros='expandall')
         flaskg.clock.start('conv_include')
         doc = include_conv(doc)
         flaskg.clock.stop('conv_include')
@@ -251,16 +271,50 @@ class Item(object):
         flaskg.clock.stop('conv_macro')
         return doc
 
+    def _render_data_cache_key(self):
+        """
+        Return the cache key for the rendered data of this item revision (or
+        None, if it can't be cached).
+
+        Besides the revision data, the rendered data depends on the language
+        and the user (as the user's rights determine what gets included).
+        """
+        hash_name = HASH_ALGORITHM
+        hash_hexdigest = self.rev.get(hash_name)
+        if not hash_hexdigest:
+            # likely a non-existing item
+            return None
+        u = flaskg.user
+        if u.valid:
+            user_key = u.name, u.auth_method in app.cfg.auth_methods_trusted
+        else:
+            user_key = None
+        return wikiutil.cache_key(usage="render_data",
+                                  name=self.name,
+                                  mimetype=self.mimetype,
+                                  hash_name=hash_name,
+                                  hash_hexdigest=hash_hexdigest,
+                                  url_root=request.url_root,
+                                  locale=get_locale(),
+                                  user=user_key)
+
     def _render_data(self):
         from MoinMoin.converter import default_registry as reg
         from MoinMoin.util.mime import Type, type_moin_document
         from MoinMoin.util.tree import html
+        cid = self._render_data_cache_key()
+        if cid:
+            cached = app.cache.get(cid)
+            if cached is not None:
+                out, dependencies = cached
+                if all(include_state(name) == state for name, state in dependencies.items()):
+                    return out
         include_conv = reg.get(type_moin_document, type_moin_document, includes='expandall')
         macro_conv = reg.get(type_moin_document, type_moin_document, macros='expandall')
         # TODO: Real output format
         html_conv = reg.get(type_moin_document, Type('application/x-xhtml-moin-page'))
         doc = self.internal_representation()
-        doc = self._expand_document(doc)
+        doc = self._expand_document(doc, include_conv, macro_conv)
         flaskg.clock.start('conv_dom_html')
         doc = html_conv(doc)
         flaskg.clock.stop('conv_dom_html')
@@ -271,6 +325,11 @@ class Item(object):
         doc.write(out.fromunicode, namespaces={html.namespace: ''}, method='xml')
         out = out.tounicode()
         flaskg.clock.stop('conv_serialize')
+        if cid and include_conv.cacheable and macro_conv.cacheable:
+            # remember the state of the included items, if one of them
+            # changes, we must render again
+            dependencies = dict((name, include_state(name)) for name in include_conv.included_names)
+            app.cache.set(cid, (out, dependencies))
         return out
 
     def _render_data_xml(self, converters):
@@ -675,6 +734,7 @@ There is no help, you're doomed!
 
     def _do_get(self, hash, member=None):
         filename = None
+        local_path = None
         if member: # content = file contained within a archive item revision
             path, filename = os.path.split(member)
             mt = wikiutil.MimeType(filename=filename)
@@ -693,15 +753,21 @@ There is no help, you're doomed!
             content_type = mt.content_type()
             content_length = rev.size
             file_to_send = rev
+            # if the backend keeps the data in a plain file, send that one,
+            # so it can be sent by file_wrapper / X-Sendfile.
+            local_path = getattr(rev, 'local_path', None)
+            if local_path is not None:
+                file_to_send = None
 
         # TODO: handle content_disposition is not None
         # Important: empty filename keeps flask from trying to autodetect filename,
         # as this would not work for us, because our file's are not necessarily fs files.
-        return send_file(file=file_to_send,
+        return send_file(filename=local_path, file=file_to_send,
                          mimetype=content_type,
                          as_attachment=False, attachment_filename=filename,
                          cache_timeout=10, # wiki data can change rapidly
-                         add_etags=True, etag=hash, conditional=True)
+                         add_etags=True, etag=hash, conditional=True,
+                         content_length=content_length)
 
 
 class RenderableBinary(Binary):
@@ -1021,13 +1087,34 @@ class Text(Binary):
     def feed_input_conv(self):
         return self.data_storage_to_internal(self.data).split(u'\n')
 
-    def _render_data_diff(self, oldrev, newrev):
-        from MoinMoin.util.diff_html import diff
+    def _cached_diff(self, oldrev, newrev, format, diff):
+        """
+        return diff(old_text, new_text) for the data of revisions <oldrev>
+        and <newrev>. The result is cached, keyed by the data hashes of the
+        revisions and <format>, so the same diff is computed only once (no
+        matter which revisions / items have that data).
+        """
+        old_hash = oldrev.get(HASH_ALGORITHM)
+        new_hash = newrev.get(HASH_ALGORITHM)
+        cid = None
+        if old_hash and new_hash:
+            cid = wikiutil.cache_key(usage="diff", old_hash=old_hash, new_hash=new_hash, format=format)
+            result = app.cache.get(cid)
+            if result is not None:
+                return result
         old_text = self.data_storage_to_internal(oldrev.read())
         new_text = self.data_storage_to_internal(newrev.read())
+        result = diff(old_text, new_text)
+        if cid is not None:
+            app.cache.set(cid, result)
+        return result
+
+    def _render_data_diff(self, oldrev, newrev):
+        from MoinMoin.util.diff_html import diff
         storage_item = flaskg.storage.get_item(self.name)
         revs = storage_item.list_revisions()
-        diffs = [(d[0], Markup(d[1]), d[2], Markup(d[3])) for d in diff(old_text, new_text)]
+        diffs = [(d[0], Markup(d[1]), d[2], Markup(d[3]))
+                 for d in self._cached_diff(oldrev, newrev, 'html', diff)]
         return Markup(render_template('diff_text.html',
                                       item_name=self.name,
                                       oldrev=oldrev,
@@ -1039,10 +1126,10 @@ class Text(Binary):
 
     def _render_data_diff_text(self, oldrev, newrev):
         from MoinMoin.util import diff_text
-        oldlines = self.data_storage_to_internal(oldrev.read()).split('\n')
-        newlines = self.data_storage_to_internal(newrev.read()).split('\n')
-        difflines = diff_text.diff(oldlines, newlines)
-        return '\n'.join(difflines)
+        def diff(old_text, new_text):
+            difflines = diff_text.diff(old_text.split('\n'), new_text.split('\n'))
+            return '\n'.join(difflines)
+        return self._cached_diff(oldrev, newrev, 'text', diff)
 
     def do_modify(self, template_name):
         form = TextChaizedForm.from_defaults()
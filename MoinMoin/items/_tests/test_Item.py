@@ -6,6 +6,9 @@
     @license: GNU GPL, see COPYING for details.
 """
 
+import threading
+from multiprocessing.pool import ThreadPool
+
 import py
 
 from flask import flaskg
@@ -99,6 +102,117 @@ class TestItem(object):
                              ]
 
 
+class TestRenderDataCache(object):
+    def setup_method(self, method):
+        from werkzeug.contrib.cache import SimpleCache
+        self.app.cache.cache = SimpleCache()
+
+    def _render(self, name):
+        item = Item.create(name)
+        return item._render_data(), item._render_data_cache_key()
+
+    def testIncludeChanged(self):
+        become_trusted()
+        Item.create(u'Included')._save({}, 'included text', mimetype='text/x.moin.wiki')
+        Item.create(u'Includer')._save({}, 'includer text\n\n{{Included}}\n', mimetype='text/x.moin.wiki')
+        out, cid = self._render(u'Includer')
+        assert 'included text' in out
+        cached_out, dependencies = self.app.cache.get(cid)
+        assert cached_out == out
+        assert dependencies.keys() == [u'Included']
+        # a changed included item invalidates the includer's rendered data
+        Item.create(u'Included')._save({}, 'changed text', mimetype='text/x.moin.wiki')
+        out, cid = self._render(u'Includer')
+        assert 'changed text' in out
+        assert 'included text' not in out
+
+
+class TestDiffCache(object):
+    def setup_method(self, method):
+        from werkzeug.contrib.cache import SimpleCache
+        self.app.cache.cache = SimpleCache()
+
+    def testCachedDiff(self):
+        become_trusted()
+        Item.create(u'DiffItem')._save({}, 'first line\nsecond line\n', mimetype='text/plain')
+        Item.create(u'DiffItem')._save({}, 'first line\nchanged line\n', mimetype='text/plain')
+        item = Item.create(u'DiffItem')
+        storage_item = item.rev.item
+        oldrev, newrev = storage_item.get_revision(0), storage_item.get_revision(1)
+        calls = []
+        def diff(old_text, new_text):
+            calls.append((old_text, new_text))
+            return u'diff'
+        assert item._cached_diff(oldrev, newrev, 'test', diff) == u'diff'
+        assert item._cached_diff(oldrev, newrev, 'test', diff) == u'diff'
+        assert calls == [(u'first line\nsecond line\n', u'first line\nchanged line\n')]
+        oldrev, newrev = storage_item.get_revision(0), storage_item.get_revision(1)
+        text = item._render_data_diff_text(oldrev, newrev)
+        assert '- second line' in text
+        assert '+ changed line' in text
+
+
+class RecordingPool(object):
+    """
+    worker pool doing the work serially, but recording what it was asked for
+    """
+    def __init__(self):
+        self.names = []
+
+    def map(self, function, names):
+        self.names.extend(names)
+        return map(function, names)
+
+
+class TestIncludePool(object):
+    def setup_method(self, method):
+        self.app.include_pool = RecordingPool()
+
+    def teardown_method(self, method):
+        self.app.include_pool = None
+
+    def testPrefetch(self):
+        become_trusted()
+        Item.create(u'Included1')._save({}, 'first included text', mimetype='text/x.moin.wiki')
+        Item.create(u'Included2')._save({}, 'second included text\n\n{{Included1}}\n', mimetype='text/x.moin.wiki')
+        Item.create(u'Includer')._save({}, '{{Included1}}\n\n{{Included2}}\n', mimetype='text/x.moin.wiki')
+        out = Item.create(u'Includer')._render_data()
+        assert sorted(self.app.include_pool.names) == [u'Included1', u'Included2']
+        assert out.count('first included text') == 2
+        assert 'second included text' in out
+
+    def testThreadPool(self):
+        become_trusted()
+        Item.create(u'ThreadIncluded1')._save({}, 'first included text', mimetype='text/x.moin.wiki')
+        Item.create(u'ThreadIncluded2')._save({}, 'second included text\n\n{{ThreadIncluded1}}\n', mimetype='text/x.moin.wiki')
+        Item.create(u'ThreadIncluder')._save({}, '{{ThreadIncluded1}}\n\n{{ThreadIncluded2}}\n', mimetype='text/x.moin.wiki')
+        self.app.include_pool = None
+        expected = Item.create(u'ThreadIncluder')._render_data()
+        # record the flaskg used by the items created in the worker threads
+        worker_globals = []
+        create = Item.create
+        def recording_create(name, *args, **kw):
+            if threading.current_thread().name != request_thread:
+                worker_globals.append(flaskg._get_current_object())
+            return create(name, *args, **kw)
+        request_thread = threading.current_thread().name
+        pool = ThreadPool(2)
+        try:
+            self.app.include_pool = pool
+            Item.create = staticmethod(recording_create)
+            out = create(u'ThreadIncluder')._render_data()
+        finally:
+            Item.create = create
+            pool.close()
+            pool.join()
+        assert out == expected
+        assert out.count('first included text') == 2
+        # every worker had its own flaskg
+        assert len(worker_globals) == 2
+        assert len(set(id(g) for g in worker_globals)) == 2
+        assert flaskg._get_current_object() not in worker_globals
+
+
 class TestTarItems(object):
     """
     tests for the container items
@@ -10,6 +10,8 @@ from MoinMoin.util.tree import moin_page
 from MoinMoin.macro._base import MacroInlineBase
 
 class Macro(MacroInlineBase):
+    immutable = True
+
     def macro(self, anchor=unicode):
         if not anchor:
             raise ValueError("Anchor: you need to specify an anchor name.")
@@ -20,6 +20,8 @@ from MoinMoin.converter._table import TableMixin
 
 
 class Macro(TableMixin, MacroBlockBase):
+    immutable = True
+
     def macro(self, content, arguments, page_url, alternative):
         request = self.request
         column_titles = [_('Lexer description'),
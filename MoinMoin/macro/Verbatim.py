@@ -9,6 +9,8 @@
 from MoinMoin.macro._base import MacroInlineBase
 
 class Macro(MacroInlineBase):
+    immutable = True
+
     def macro(self, text=u''):
         return text
 
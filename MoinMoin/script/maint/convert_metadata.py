@@ -0,0 +1,26 @@
+# -*- coding: iso-8859-1 -*-
+"""
+MoinMoin - convert the metadata stored by older versions
+
+Converts the item and revision metadata stored as pickles by older versions
+of the fs backend to the current metadata format (see
+MoinMoin.storage.backends.fs.FSBackend.convert_metadata). The wiki may be
+running while doing this.
+
+@copyright: 2011 MoinMoin:ThomasWaldmann
+@license: GNU GPL, see COPYING for details.
+"""
+
+from flask import current_app as app
+from flaskext.script import Command
+
+
+class Convert_Metadata(Command):
+    description = 'This command converts old (pickled) metadata of fs backends to the current format.'
+
+    def run(self):
+        storage = app.unprotected_storage
+        for mountpoint, backend in getattr(storage, 'mapping', [(u'', storage)]):
+            convert = getattr(backend, 'convert_metadata', None)
+            if convert is not None:
+                print "%r: converted %d metadata files." % (mountpoint, convert())
@@ -0,0 +1,75 @@
+# -*- coding: iso-8859-1 -*-
+"""
+MoinMoin - pre-render recently changed items
+
+Renders the recently changed items, so their internal representation (DOM)
+and rendered html get into the cache before the first real request needs them.
+Run this e.g. from cron (this only makes sense with a configured cache, see
+CACHE_TYPE in the flask configuration).
+
+@copyright: 2011 MoinMoin:ThomasWaldmann
+@license: GNU GPL, see COPYING for details.
+"""
+
+from flask import flaskg
+from flask import current_app as app
+from flaskext.script import Command, Option
+
+from MoinMoin import log
+logging = log.getLogger(__name__)
+
+from MoinMoin.app import before_wiki, after_wiki
+from MoinMoin.items import Item
+
+
+def recently_changed(count):
+    """
+    return the names of the (at most) <count> most recently changed items
+    """
+    names = []
+    for rev in flaskg.storage.history():
+        if rev.item_name not in names:
+            names.append(rev.item_name)
+            if len(names) == count:
+                break
+    return names
+
+
+def prerender(names):
+    """
+    render the items <names> (with the current request context / user)
+
+    @return: number of items rendered
+    """
+    rendered = 0
+    for name in names:
+        try:
+            Item.create(name)._render_data()
+        except Exception:
+            # e.g. items that can't be rendered by the converters
+            logging.exception("pre-rendering %r failed" % name)
+        else:
+            rendered += 1
+    return rendered
+
+
+class Prerender_Items(Command):
+    description = 'This command renders the recently changed items to get them into the cache.'
+    option_list = (
+        Option('--count', '-c', required=False, dest='count', type=int, default=100,
+               help='Render the COUNT most recently changed items (default: 100).'),
+        Option('--url-root', '-u', required=False, dest='url_root', default=None,
+               help='URL root of the wiki, e.g. http://wiki.example.org/ (the rendered html '
+                    'contains links, so it is cached separately for every url root).'),
+        )
+
+    def run(self, count, url_root):
+        # we render as the anonymous user, as most requests are done by it
+        with app.test_request_context(base_url=url_root):
+            before_wiki()
+            try:
+                names = recently_changed(count)
+                rendered = prerender(names)
+            finally:
+                after_wiki(None)
+        print "rendered %d of %d items." % (rendered, len(names))
@@ -7,6 +7,9 @@
     @license: GNU GPL, see COPYING for details.
 """
 
-from MoinMoin.search.Xapian.indexing import XapianIndex, Query, MoinSearchConnection, MoinIndexerConnection, XapianDatabaseLockError
+try:
+    from MoinMoin.search.Xapian.indexing import XapianIndex, Query, MoinSearchConnection, MoinIndexerConnection, XapianDatabaseLockError
+except ImportError:
+    pass # python-xapian is not installed, we can still use the analyzer
 from MoinMoin.search.Xapian.tokenizer import WikiAnalyzer
 
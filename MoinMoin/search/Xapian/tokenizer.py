@@ -8,11 +8,13 @@
 """
 
 import re
-import xapian
+try:
+    import xapian # only needed for stemming
+except ImportError:
+    xapian = None
 
 from flask import current_app as app
 
-from MoinMoin.parser.text_moin_wiki import Parser as WikiParser
 from MoinMoin import config
 
 
@@ -20,7 +22,7 @@ class WikiAnalyzer(object):
     """ A text analyzer for wiki syntax
 
     The purpose of this class is to analyze texts/pages in wiki syntax
-    and yield single terms to feed into the xapian database.
+    and yield single terms to feed into a search index.
     """
 
     singleword = r"[%(u)s][%(l)s]+" % {
@@ -28,8 +30,14 @@ class WikiAnalyzer(object):
                      'l': config.chars_lower,
                  }
 
+    # at least 2 upper>lower transitions make CamelCase
+    wikiword = r"(?:[%(u)s][%(l)s]+){2,}" % {
+                   'u': config.chars_upper,
+                   'l': config.chars_lower,
+               }
+
     singleword_re = re.compile(singleword, re.U)
-    wikiword_re = re.compile(WikiParser.word_rule, re.UNICODE|re.VERBOSE)
+    wikiword_re = re.compile(wikiword, re.U)
 
     token_re = re.compile(
         r"(?P<company>\w+[&@]\w+)|" + # company names like AT&T and Excite@Home.
@@ -44,10 +52,11 @@ class WikiAnalyzer(object):
 
     def __init__(self, language=None):
         """
-        @param language: if given, the language in which to stem words
+        @param language: if given, the language in which to stem words (needs
+                         xapian and cfg.xapian_stemming)
         """
         self.stemmer = None
-        if app.cfg.xapian_stemming and language:
+        if language and xapian is not None and app.cfg.xapian_stemming:
             try:
                 stemmer = xapian.Stem(language)
                 # we need this wrapper because the stemmer returns a utf-8
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+    MoinMoin - Test - item name index
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+from MoinMoin.items import MIMETYPE, NAME
+from MoinMoin.search.nameindex import trigrams
+from MoinMoin.storage.backends.memory import MemoryBackend
+from MoinMoin.storage.backends.router import RouterBackend
+
+
+def test_trigrams():
+    assert trigrams(u'Foo') == set([u'  f', u' fo', u'foo', u'oo '])
+    assert trigrams(u'Foo', head=False) == set([u'foo', u'oo '])
+    assert trigrams(u'a', head=False) == set()
+
+
+class TestNameIndex(object):
+    names = [u'FrontPage', u'FrontPages', u'BackPage', u'HelpOnMacros', u'HelpOnLinking',
+             u'FrontPage/Sub', u'Mega', u'Some%Name', ]
+
+    def setup_method(self, method):
+        self.backend = RouterBackend([('/', MemoryBackend())], index_uri='sqlite://')
+        for name in self.names:
+            item = self.backend.create_item(name)
+            rev = item.create_revision(0)
+            rev[MIMETYPE] = 'text/plain;charset=utf-8'
+            item.commit()
+
+    def test_similar_names(self):
+        backend = self.backend
+        result = backend.similar_names(u'frontpag')
+        assert result[:2] == [u'FrontPage', u'FrontPages']
+        assert u'HelpOnMacros' not in result
+        assert backend.similar_names(u'HelpOnMakros')[0] == u'HelpOnMacros'
+        assert backend.similar_names(u'xyzzy') == []
+
+    def test_names_starting_with(self):
+        backend = self.backend
+        assert backend.names_starting_with(u'Front') == [u'FrontPage', u'FrontPage/Sub', u'FrontPages']
+        assert backend.names_starting_with(u'FrontPage/') == [u'FrontPage/Sub']
+        assert backend.names_starting_with(u'front') == []
+
+    def test_names_ending_with(self):
+        backend = self.backend
+        assert backend.names_ending_with(u'Page') == [u'BackPage', u'FrontPage']
+        assert backend.names_ending_with(u'ge') == [u'BackPage', u'FrontPage']
+        assert backend.names_ending_with(u'a') == [u'Mega']
+        assert backend.names_ending_with(u'%Name') == [u'Some%Name']
+        assert backend.names_ending_with(u'page') == []
+
+    def test_rename_destroy(self):
+        backend = self.backend
+        backend.get_item(u'BackPage').rename(u'BackDoor')
+        assert backend.names_ending_with(u'Page') == [u'FrontPage']
+        assert backend.names_ending_with(u'Door') == [u'BackDoor']
+        backend.get_item(u'FrontPage').destroy()
+        assert backend.names_ending_with(u'Page') == []
+        assert u'FrontPage' not in backend.similar_names(u'FrontPage')
+
+
+    def test_update_only_changed_names(self):
+        backend = self.backend
+        name_index = backend._index.name_index
+        updated = []
+        update = name_index.update
+        def recording_update(item_id, name):
+            updated.append(name)
+            return update(item_id, name)
+        name_index.update = recording_update
+        try:
+            item = backend.get_item(u'Mega')
+            rev = item.create_revision(1)
+            rev[MIMETYPE] = 'text/plain;charset=utf-8'
+            item.commit()
+            assert updated == [] # same name
+            item = backend.get_item(u'Mega')
+            rev = item.create_revision(2)
+            rev[MIMETYPE] = 'text/plain;charset=utf-8'
+            rev[NAME] = u'Giga'
+            item.commit()
+            assert updated == [u'Giga']
+        finally:
+            del name_index.update
+        assert backend.names_ending_with(u'ga') == [u'Giga']
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+    MoinMoin - Test - full text index
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import re
+
+import py
+
+from MoinMoin.items import MIMETYPE
+from MoinMoin.search.queryparser import QueryParser, QueryError
+from MoinMoin.search.textindex import encode_positions, decode_positions, required_literal
+from MoinMoin.storage.backends.memory import MemoryBackend
+from MoinMoin.storage.backends.router import RouterBackend
+
+
+def test_positions():
+    for positions in [[], [0], [1, 2, 3], [0, 127, 128, 300, 16384, 2000000], ]:
+        assert decode_positions(encode_positions(positions)) == positions
+
+
+def test_required_literal():
+    for pattern, flags, expected in [
+        (u'^foo.*bar', re.U, (u'foo', True)),
+        (u'fo+bar', re.U, (u'bar', False)),
+        (u'^a.bcd', re.U|re.I, (u'bcd', False)),
+        (u'foo|barbaz', re.U, (u'', False)),
+        (u'^(foo)', re.U, (u'', False)),
+        (u'x[yz]', re.U, (u'x', False)),
+       ]:
+        assert required_literal(re.compile(pattern, flags)) == expected, pattern
+
+
+class TestTextIndex(object):
+    items = {
+        # name: (mimetype, text)
+        u'Fruit': ('text/plain;charset=utf-8', u'apple banana cherry. Banana split!'),
+        u'Banana': ('text/plain;charset=utf-8', u'a yellow fruit'),
+        u'Colors': ('text/x.moin.wiki;charset=utf-8', u'yellow red green, cherry red'),
+        u'Image': ('image/png', u'apple banana'),
+        u'Links': ('text/x.moin.wiki;charset=utf-8', u'see FrontPage today'),
+    }
+
+    def setup_method(self, method):
+        self.backend = RouterBackend([('/', MemoryBackend())], index_uri='sqlite://')
+        for name, (mimetype, text) in self.items.items():
+            self._commit(name, mimetype, text)
+
+    def _commit(self, name, mimetype, text):
+        if self.backend.has_item(name):
+            item = self.backend.get_item(name)
+            revno = item.list_revisions()[-1] + 1
+        else:
+            item = self.backend.create_item(name)
+            revno = 0
+        rev = item.create_revision(revno)
+        rev[MIMETYPE] = mimetype
+        rev.write(text.encode('utf-8'))
+        item.commit()
+
+    def _search(self, query, **kw):
+        expr = QueryParser(**kw).parse_query(query)
+        return [name for name, score in self.backend.search_text(expr)]
+
+    def test_search(self):
+        for query, expected in [
+            (u'apple', [u'Fruit']),
+            (u'cherry', [u'Colors', u'Fruit']),
+            (u'nothere', []),
+            (u'banana', [u'Banana', u'Fruit']), # title match first
+            (u'"banana split"', [u'Fruit']),
+            (u'"split banana"', []),
+            (u'red cherry', [u'Colors']),
+            (u'yellow -fruit', [u'Colors']),
+            (u'apple or green', [u'Colors', u'Fruit']),
+            (u'-yellow', [u'Fruit', u'Image', u'Links']),
+            (u're:^ban', [u'Banana', u'Fruit']),
+            (u're:nan', [u'Banana', u'Fruit']),
+            (u're:an.na', [u'Banana', u'Fruit']),
+            (u're:^.pple', [u'Fruit']),
+            (u'title:re:^Col', [u'Colors']),
+            (u'title:re:^col', [u'Colors']),
+            (u'title:case:re:^col', []),
+            (u'title:lor', [u'Colors']),
+            (u'title:lo', [u'Colors']),
+            (u'title:col', [u'Colors']),
+            (u'mimetype:image/png', [u'Image']),
+            # words split into parts by the analyzer
+            (u'"see frontpage today"', [u'Links']),
+            (u'"see FrontPage today"', [u'Links']),
+            (u'front', [u'Links']),
+           ]:
+            assert sorted(self._search(query)) == sorted(expected), query
+        assert self._search(u'banana')[0] == u'Banana'
+        assert self._search(u'fruit', titlesearch=True) == [u'Fruit']
+
+    def test_unsupported(self):
+        py.test.raises(QueryError, self._search, u'language:en')
+        py.test.raises(QueryError, self._search, u'apple -domain:system')
+
+    def test_ranking(self):
+        self._commit(u'More', 'text/plain;charset=utf-8', u'banana banana banana')
+        assert self._search(u'banana') == [u'Banana', u'More', u'Fruit']
+
+    def test_update(self):
+        self._commit(u'Fruit', 'text/plain;charset=utf-8', u'kiwi')
+        assert self._search(u'apple') == []
+        assert self._search(u'kiwi') == [u'Fruit']
+        self._commit(u'Fruit', 'image/png', u'kiwi')
+        assert self._search(u'kiwi') == []
+
+    def test_destroy(self):
+        self._commit(u'Fruit', 'text/plain;charset=utf-8', u'kiwi')
+        self.backend.get_item(u'Fruit').get_revision(1).destroy()
+        assert self._search(u'kiwi') == []
+        assert self._search(u'apple') == [u'Fruit']
+        self.backend.get_item(u'Fruit').destroy()
+        assert self._search(u'apple') == []
+
+    def test_rebuild(self):
+        self.backend.index_rebuild()
+        assert self._search(u'apple') == [u'Fruit']
@@ -0,0 +1,180 @@
+# -*- coding: iso-8859-1 -*-
+"""
+    MoinMoin - item name index
+
+    A trigram index of the names of the items in an ItemIndex (see
+    MoinMoin.storage.backends.indexing), for finding similar names (e.g. for
+    +similar_names and "item not found" pages) without looking at all names.
+
+    Every (lower cased) name is split into its trigrams, padded with spaces
+    at the start and end, so u'Foo' gives u'  f', u' fo', u'foo' and u'oo '.
+    Candidates for a similar name are the items sharing most trigrams with it,
+    only these are ranked by difflib.
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import difflib
+
+from sqlalchemy import Table, Column, Unicode, ForeignKey
+from sqlalchemy import select, func, null, desc
+from sqlalchemy.sql import and_
+
+from MoinMoin.util.kvstore import escape_like
+
+
+def trigrams(name, head=True, tail=True):
+    """
+    return the set of trigrams of <name> (lower cased).
+
+    @param head: include the trigrams padded at the start of name
+    @param tail: include the trigram padded at the end of name
+    """
+    name = name.lower()
+    if head:
+        name = u'  ' + name
+    if tail:
+        name = name + u' '
+    return set(name[i:i+3] for i in range(len(name) - 2))
+
+
+class NameIndex(object):
+    """
+    Trigram index for the names of the items of an ItemIndex
+    """
+    # max. number of candidates (sharing most trigrams) ranked by difflib
+    MAX_CANDIDATES = 100
+    # max. number of parameters we put into one IN clause (sqlite has a limit)
+    IN_CHUNK_SIZE = 500
+
+    def __init__(self, item_index):
+        self.item_index = item_index
+        self.trigram_table = Table('name_trigram', item_index.metadata,
+            Column('trigram', Unicode(3), primary_key=True),
+            Column('item_id', ForeignKey('item_table.id'), primary_key=True, index=True),
+        )
+
+    def update(self, item_id, name):
+        """
+        replace the indexed name of item <item_id> by <name> (None: remove it)
+        """
+        trigram_table = self.trigram_table
+        conn = self.item_index.metadata.bind.connect()
+        trans = conn.begin()
+        try:
+            conn.execute(trigram_table.delete().where(trigram_table.c.item_id == item_id))
+            if name:
+                conn.execute(trigram_table.insert(),
+                             [dict(trigram=trigram, item_id=item_id) for trigram in trigrams(name)])
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def remove(self, item_id):
+        """
+        remove the indexed name of item <item_id>
+        """
+        self.update(item_id, None)
+
+    def _candidates(self, grams, minimum=1, limit=None):
+        """
+        return the names of the items (with a current revision) having at
+        least <minimum> of the trigrams <grams>, most shared trigrams first.
+        """
+        # very long names: the first trigrams are enough for the candidates
+        grams = list(grams)[:self.IN_CHUNK_SIZE]
+        minimum = min(minimum, len(grams))
+        return self._query(self.trigram_table.c.trigram.in_(grams), minimum, limit)
+
+    def _query(self, condition, minimum=1, limit=None):
+        """
+        return the names of the items (with a current revision) having at
+        least <minimum> trigrams matching <condition>, most matching first.
+        """
+        item_table = self.item_index.item_table
+        trigram_table = self.trigram_table
+        shared = func.count(trigram_table.c.trigram).label('shared')
+        query = select([item_table.c.name, shared],
+                       and_(condition,
+                            trigram_table.c.item_id == item_table.c.id,
+                            item_table.c.current != null())
+                      ).group_by(item_table.c.name).having(shared >= minimum
+                      ).order_by(desc(shared), item_table.c.name)
+        if limit is not None:
+            query = query.limit(limit)
+        return [name for name, count in query.execute()]
+
+    def items_containing(self, text):
+        """
+        return (item id, name) of the items (with a current revision) whose
+        names might contain <text> (case insensitive): the ones having all
+        its trigrams. Callers must check the names.
+
+        @return: list of (item id, name) tuples or None if <text> is too
+                 short to have a trigram
+        """
+        grams = list(trigrams(text, head=False, tail=False))[:self.IN_CHUNK_SIZE]
+        if not grams:
+            return None
+        item_table = self.item_index.item_table
+        trigram_table = self.trigram_table
+        shared = func.count(trigram_table.c.trigram)
+        query = select([item_table.c.id, item_table.c.name],
+                       and_(trigram_table.c.trigram.in_(grams),
+                            trigram_table.c.item_id == item_table.c.id,
+                            item_table.c.current != null())
+                      ).group_by(item_table.c.id, item_table.c.name).having(shared >= len(grams))
+        return query.execute().fetchall()
+
+    def similar_names(self, name, cutoff=0.6):
+        """
+        return the names similar to <name> (case insensitive, difflib ratio
+        of at least <cutoff>), best matches first.
+        """
+        lower = name.lower()
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(lower)
+        ranked = []
+        for candidate in self._candidates(trigrams(name), limit=self.MAX_CANDIDATES):
+            matcher.set_seq1(candidate.lower())
+            if (matcher.real_quick_ratio() >= cutoff and
+                matcher.quick_ratio() >= cutoff):
+                ratio = matcher.ratio()
+                if ratio >= cutoff:
+                    ranked.append((-ratio, candidate))
+        ranked.sort()
+        return [candidate for ratio, candidate in ranked]
+
+    def names_ending_with(self, suffix):
+        """
+        return the names ending with <suffix> (case sensitive), sorted
+        """
+        if not suffix:
+            return []
+        grams = trigrams(suffix, head=False)
+        if grams:
+            names = self._candidates(grams, minimum=len(grams))
+        else:
+            # one char suffix: trigrams ending with it and the padding
+            char = escape_like(suffix.lower())
+            names = self._query(self.trigram_table.c.trigram.like(u'_%s ' % char, escape=u'\\'))
+        return sorted(name for name in names if name.endswith(suffix))
+
+    def names_starting_with(self, prefix):
+        """
+        return the names starting with <prefix> (case sensitive), sorted
+        """
+        if not prefix:
+            return []
+        item_table = self.item_index.item_table
+        # the name column is indexed, so a range query is fast
+        condition = and_(item_table.c.name >= prefix,
+                         item_table.c.name < prefix[:-1] + unichr(ord(prefix[-1]) + 1),
+                         item_table.c.current != null())
+        return [candidate for candidate, in select([item_table.c.name], condition
+                                                   ).order_by(item_table.c.name).execute()]
+
@@ -0,0 +1,502 @@
+# -*- coding: iso-8859-1 -*-
+"""
+    MoinMoin - full text index
+
+    An inverted index (term -> items containing it, with the term positions)
+    of the text of the items' current revisions. It lives in the same
+    database as the ItemIndex (see MoinMoin.storage.backends.indexing), so it
+    is on disk if the item index is.
+
+    The text is split into terms by the WikiAnalyzer. For every term and item
+    containing it, the index stores the term frequency and the term positions
+    (delta encoded as variable length integers). Queries are the expression
+    trees built by the search query parser, results are ranked (BM25).
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import re
+import sre_constants
+import sre_parse
+import math
+
+from MoinMoin import log
+logging = log.getLogger(__name__)
+
+from MoinMoin.i18n import _
+from MoinMoin.util.kvstore import escape_like
+from MoinMoin.search.Xapian.tokenizer import WikiAnalyzer
+from MoinMoin.search.queryparser import QueryError
+from MoinMoin.search.queryparser.expressions import AndExpression, OrExpression, \
+    TextSearch, TitleSearch, LinkSearch, MimetypeSearch, LanguageSearch, DomainSearch
+
+from sqlalchemy import Table, Column, Integer, Unicode, LargeBinary, ForeignKey
+from sqlalchemy import select, func, null
+from sqlalchemy.sql import and_
+
+
+def encode_positions(positions):
+    """
+    encode a sorted list of ints (>= 0) as a string of variable length
+    encoded deltas (7 bits per byte, high bit set: more bytes follow)
+    """
+    result = []
+    last = 0
+    for position in positions:
+        delta = position - last
+        last = position
+        while delta >= 0x80:
+            result.append(chr(delta & 0x7f | 0x80))
+            delta = delta >> 7
+        result.append(chr(delta))
+    return ''.join(result)
+
+
+def decode_positions(data):
+    """
+    decode a string encoded by encode_positions
+    """
+    positions = []
+    position = delta = shift = 0
+    for c in data:
+        byte = ord(c)
+        delta |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            position += delta
+            positions.append(position)
+            delta = shift = 0
+    return positions
+
+
+def required_literal(search_re):
+    """
+    analyze a compiled regex: find the longest literal string every match
+    contains (only looking at the top level of the regex).
+
+    @return: tuple (literal, anchored) - literal is u'' if there is none,
+             anchored is True if every match starts with literal
+    """
+    if search_re.flags & (sre_constants.SRE_FLAG_LOCALE | sre_constants.SRE_FLAG_MULTILINE):
+        return u'', False
+    try:
+        parsed = list(sre_parse.parse(search_re.pattern, search_re.flags))
+    except (sre_constants.error, TypeError), e:
+        return u'', False
+    at_start = bool(parsed) and parsed[0] == (sre_constants.AT, sre_constants.AT_BEGINNING)
+    if at_start:
+        parsed = parsed[1:]
+    longest, anchored = u'', False
+    chars = []
+    first = True # the current run of literals starts at the start of the regex
+    for op, av in parsed + [(None, None)]:
+        if op == sre_constants.LITERAL:
+            chars.append(unichr(av))
+            continue
+        if len(chars) > len(longest):
+            longest, anchored = u''.join(chars), at_start and first
+        chars = []
+        first = False
+    return longest, anchored
+
+
+class TextIndex(object):
+    """
+    Full text index for the items of an ItemIndex
+    """
+    # max. length of an indexed term, longer terms are not indexed
+    TERM_LEN = 64
+    # max. number of parameters we put into one IN clause (sqlite has a limit)
+    IN_CHUNK_SIZE = 500
+    # BM25 parameters
+    K1 = 1.2
+    B = 0.75
+    # score of a title match (relative to the text match scores)
+    TITLE_SCORE = 5.0
+
+    def __init__(self, item_index):
+        self.item_index = item_index
+        metadata = item_index.metadata
+        self.term_table = Table('text_term', metadata,
+            Column('id', Integer, primary_key=True),
+            Column('term', Unicode(self.TERM_LEN), index=True, unique=True),
+        )
+        # the indexed text of an item
+        self.doc_table = Table('text_doc', metadata,
+            Column('item_id', ForeignKey('item_table.id'), primary_key=True),
+            Column('length', Integer), # number of terms in the text
+        )
+        self.posting_table = Table('text_posting', metadata,
+            Column('term_id', ForeignKey('text_term.id'), primary_key=True),
+            Column('item_id', ForeignKey('item_table.id'), primary_key=True, index=True),
+            Column('positions', LargeBinary), # see encode_positions
+        )
+        self.analyzer = WikiAnalyzer()
+
+    def analyze(self, text):
+        """
+        return the (lower cased) terms of <text> as a list of (term, position)
+        tuples, the position counts the words of <text>.
+
+        The analyzer also yields parts of some words (e.g. Camel and Case of
+        CamelCase), these get the position of their word.
+        """
+        terms = []
+        position = -1
+        end = 0 # of the current word in text
+        for word, pos in self.analyzer.raw_tokenize(text):
+            if pos >= end:
+                position += 1
+                end = pos + len(word)
+            terms.append((word.lower(), position))
+        return terms
+
+    def _get_term_ids(self, conn, terms, create=False):
+        """
+        return a dict term -> term id for the given terms, if <create> is
+        True, add the terms not in the index yet.
+        """
+        term_table = self.term_table
+        term_ids = {}
+
+        def lookup(terms):
+            for start in range(0, len(terms), self.IN_CHUNK_SIZE):
+                chunk = terms[start:start+self.IN_CHUNK_SIZE]
+                for term_id, term in conn.execute(select([term_table.c.id, term_table.c.term],
+                                                         term_table.c.term.in_(chunk))):
+                    term_ids[term] = term_id
+
+        terms = list(terms)
+        lookup(terms)
+        missing = [term for term in terms if term not in term_ids]
+        if create and missing:
+            conn.execute(term_table.insert(), [dict(term=term) for term in missing])
+            lookup(missing)
+        return term_ids
+
+    def update(self, item_id, text):
+        """
+        replace the indexed text of item <item_id> by <text> (None: remove it)
+        """
+        positions = {}
+        length = 0
+        if text is not None:
+            terms = self.analyze(text)
+            if terms:
+                length = terms[-1][1] + 1
+            for term, position in terms:
+                if len(term) <= self.TERM_LEN:
+                    term_positions = positions.setdefault(term, [])
+                    if not term_positions or term_positions[-1] != position:
+                        term_positions.append(position)
+        doc_table = self.doc_table
+        posting_table = self.posting_table
+        conn = self.item_index.metadata.bind.connect()
+        trans = conn.begin()
+        try:
+            conn.execute(posting_table.delete().where(posting_table.c.item_id == item_id))
+            conn.execute(doc_table.delete().where(doc_table.c.item_id == item_id))
+            if text is not None:
+                conn.execute(doc_table.insert().values(item_id=item_id, length=length))
+            if positions:
+                term_ids = self._get_term_ids(conn, positions, create=True)
+                conn.execute(posting_table.insert(),
+                             [dict(term_id=term_ids[term], item_id=item_id,
+                                   positions=encode_positions(term_positions))
+                              for term, term_positions in positions.iteritems()])
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def remove(self, item_id):
+        """
+        remove the indexed text of item <item_id>
+        """
+        self.update(item_id, None)
+
+    def _postings(self, terms):
+        """
+        return a dict term -> dict item_id -> positions for the given terms
+        """
+        posting_table = self.posting_table
+        conn = self.item_index.metadata.bind.connect()
+        try:
+            term_ids = self._get_term_ids(conn, terms)
+            result = dict((term, {}) for term in terms)
+            for term, term_id in term_ids.items():
+                postings = result[term]
+                for item_id, positions in conn.execute(select([posting_table.c.item_id, posting_table.c.positions],
+                                                              posting_table.c.term_id == term_id)):
+                    postings[item_id] = positions
+            return result
+        finally:
+            conn.close()
+
+    def _stats(self, cache):
+        """
+        return (number of indexed items, average text length), computed once
+        per query (<cache> is the per query cache, see search)
+        """
+        try:
+            return cache['stats']
+        except KeyError:
+            doc_table = self.doc_table
+            count, total = select([func.count(doc_table.c.item_id), func.sum(doc_table.c.length)]).execute().fetchone()
+            if not count:
+                stats = 0, 0.0
+            else:
+                stats = count, float(total) / count
+            cache['stats'] = stats
+            return stats
+
+    def _lengths(self, item_ids):
+        """
+        return a dict item_id -> text length
+        """
+        doc_table = self.doc_table
+        item_ids = list(item_ids)
+        lengths = {}
+        for start in range(0, len(item_ids), self.IN_CHUNK_SIZE):
+            chunk = item_ids[start:start+self.IN_CHUNK_SIZE]
+            for item_id, length in select([doc_table.c.item_id, doc_table.c.length],
+                                          doc_table.c.item_id.in_(chunk)).execute():
+                lengths[item_id] = length
+        return lengths
+
+    def _score(self, frequencies, postings_count, cache):
+        """
+        BM25 scores for a term found <frequencies> (dict item_id -> term
+        frequency) times, contained in <postings_count> items.
+        """
+        count, avg_length = self._stats(cache)
+        idf = math.log(1.0 + (count - postings_count + 0.5) / (postings_count + 0.5))
+        lengths = self._lengths(frequencies)
+        scores = {}
+        for item_id, frequency in frequencies.iteritems():
+            norm = 1.0 - self.B + self.B * lengths.get(item_id, avg_length) / (avg_length or 1.0)
+            scores[item_id] = idf * frequency * (self.K1 + 1) / (frequency + self.K1 * norm)
+        return scores
+
+    def _phrase_search(self, terms, cache):
+        """
+        return a dict item_id -> score of the items containing the sequence
+        of <terms>
+        """
+        postings = self._postings(set(terms))
+        candidates = None
+        for term in terms:
+            item_ids = set(postings[term])
+            if candidates is None:
+                candidates = item_ids
+            else:
+                candidates &= item_ids
+        if not candidates:
+            return {}
+        frequencies = {}
+        if len(terms) == 1:
+            postings_count = len(postings[terms[0]])
+            for item_id in candidates:
+                frequencies[item_id] = len(decode_positions(postings[terms[0]][item_id]))
+        else:
+            postings_count = min(len(postings[term]) for term in terms)
+            for item_id in candidates:
+                positions = [set(decode_positions(postings[term][item_id])) for term in terms]
+                frequency = 0
+                for start in positions[0]:
+                    for offset in range(1, len(terms)):
+                        if start + offset not in positions[offset]:
+                            break
+                    else:
+                        frequency += 1
+                if frequency:
+                    frequencies[item_id] = frequency
+        return self._score(frequencies, postings_count, cache)
+
+    def _regex_search(self, search_re, cache):
+        """
+        return a dict item_id -> score of the items containing a term matching
+        <search_re>
+
+        Only the terms containing the longest literal part of <search_re> are
+        looked at (or starting with it, if it is anchored at the start, using
+        the index of the term column). Without a literal part, all terms are.
+        """
+        term_table = self.term_table
+        literal, anchored = required_literal(search_re)
+        # the indexed terms are lower case
+        if search_re.flags & re.I:
+            literal = literal.lower()
+        if not literal:
+            condition = None
+        elif anchored:
+            condition = and_(term_table.c.term >= literal,
+                             term_table.c.term < literal[:-1] + unichr(ord(literal[-1]) + 1))
+        else:
+            condition = term_table.c.term.like(u'%%%s%%' % escape_like(literal), escape=u'\\')
+        terms = [term for term, in select([term_table.c.term], condition).execute()
+                 if search_re.search(term)]
+        postings = self._postings(terms)
+        scores = {}
+        for term in terms:
+            frequencies = dict((item_id, len(decode_positions(positions)))
+                               for item_id, positions in postings[term].iteritems())
+            for item_id, score in self._score(frequencies, len(frequencies), cache).iteritems():
+                scores[item_id] = scores.get(item_id, 0.0) + score
+        return scores
+
+    def _title_search(self, search_re):
+        """
+        return a dict item_id -> TITLE_SCORE of the items whose name matches
+        <search_re>
+
+        Only the names containing the longest literal part of <search_re> are
+        looked at (using the trigrams of the name index, or the index of the
+        name column, if the literal is a case sensitive prefix). Without a
+        literal part, all names are.
+        """
+        item_table = self.item_index.item_table
+        literal, anchored = required_literal(search_re)
+        candidates = None
+        if literal and anchored and not search_re.flags & re.I:
+            candidates = select([item_table.c.id, item_table.c.name],
+                                and_(item_table.c.name >= literal,
+                                     item_table.c.name < literal[:-1] + unichr(ord(literal[-1]) + 1),
+                                     item_table.c.current != null())).execute()
+        elif literal:
+            candidates = self.item_index.name_index.items_containing(literal)
+        if candidates is None:
+            candidates = select([item_table.c.id, item_table.c.name],
+                                item_table.c.current != null()).execute()
+        return dict((item_id, self.TITLE_SCORE) for item_id, name in candidates
+                    if search_re.search(name))
+
+    def _all(self, cache):
+        """
+        return a dict item_id -> 0.0 of all items with a current revision
+        (a new dict, but the item ids are fetched once per query)
+        """
+        try:
+            item_ids = cache['all']
+        except KeyError:
+            item_table = self.item_index.item_table
+            item_ids = cache['all'] = [item_id for item_id, in select([item_table.c.id],
+                                                                      item_table.c.current != null()).execute()]
+        return dict((item_id, 0.0) for item_id in item_ids)
+
+    def _names(self, item_ids):
+        """
+        return a dict item_id -> name of the given items with a current revision
+        """
+        item_table = self.item_index.item_table
+        item_ids = list(item_ids)
+        names = {}
+        for start in range(0, len(item_ids), self.IN_CHUNK_SIZE):
+            chunk = item_ids[start:start+self.IN_CHUNK_SIZE]
+            for item_id, name in select([item_table.c.id, item_table.c.name],
+                                        and_(item_table.c.id.in_(chunk),
+                                             item_table.c.current != null())).execute():
+                names[item_id] = name
+        return names
+
+    def _evaluate(self, expr, cache):
+        """
+        evaluate the query expression <expr>, return a dict item_id -> score
+        of the matching items (<cache> is the per query cache, see search)
+
+        @raise QueryError: for expressions the index can not evaluate
+        """
+        if isinstance(expr, AndExpression):
+            # note: OrExpression is a subclass of AndExpression
+            subterms = expr.subterms()
+            if isinstance(expr, OrExpression):
+                result = {}
+                for subterm in subterms:
+                    for item_id, score in self._evaluate(subterm, cache).iteritems():
+                        result[item_id] = result.get(item_id, 0.0) + score
+            else:
+                positive = [subterm for subterm in subterms if not subterm.negated]
+                negative = [subterm for subterm in subterms if subterm.negated]
+                if positive:
+                    result = None
+                    for subterm in positive:
+                        scores = self._evaluate(subterm, cache)
+                        if result is None:
+                            result = scores
+                        else:
+                            result = dict((item_id, score + scores[item_id])
+                                          for item_id, score in result.iteritems()
+                                          if item_id in scores)
+                        if not result:
+                            break
+                else:
+                    result = self._all(cache)
+                for subterm in negative:
+                    if not result:
+                        break
+                    subterm.negated = False
+                    try:
+                        excluded = self._evaluate(subterm, cache)
+                    finally:
+                        subterm.negated = True
+                    for item_id in excluded:
+                        result.pop(item_id, None)
+        elif isinstance(expr, TitleSearch):
+            result = self._title_search(expr.search_re)
+        elif isinstance(expr, TextSearch):
+            # note: the indexed terms are lower case, so the text matching is
+            # always case insensitive (case only affects the title matching)
+            result = self._title_search(expr.search_re)
+            if expr.use_re:
+                scores = self._regex_search(expr.search_re, cache)
+            else:
+                # the words of the phrase, without their parts
+                terms = []
+                for term, position in self.analyze(expr._pattern):
+                    if position == len(terms):
+                        terms.append(term)
+                scores = terms and self._phrase_search(terms, cache) or {}
+            for item_id, score in scores.iteritems():
+                result[item_id] = result.get(item_id, 0.0) + score
+        elif isinstance(expr, MimetypeSearch):
+            item_table = self.item_index.item_table
+            result = dict((item_id, 0.0) for item_id, mimetype in select([item_table.c.id, item_table.c.mimetype],
+                                                                         item_table.c.current != null()).execute()
+                          if mimetype and expr.search_re.search(mimetype))
+        elif isinstance(expr, LinkSearch):
+            link_table = self.item_index.link_table
+            result = {}
+            for item_id, target in select([link_table.c.item_id, link_table.c.target]).execute():
+                if expr.search_re.match(target):
+                    result[item_id] = 0.0
+        elif isinstance(expr, LanguageSearch):
+            raise QueryError(_(u'Searching by language is not supported.'))
+        elif isinstance(expr, DomainSearch):
+            raise QueryError(_(u'Searching by domain is not supported.'))
+        else:
+            raise ValueError("unsupported search expression %r" % expr)
+        if expr.negated:
+            all_items = self._all(cache)
+            for item_id in result:
+                all_items.pop(item_id, None)
+            result = all_items
+        return result
+
+    def search(self, query):
+        """
+        search for the items matching the query expression <query>
+
+        @return: list of (name, score) tuples, best matches first
+        @raise QueryError: for queries the index can not evaluate (language:
+                           and domain: searches)
+        """
+        scores = self._evaluate(query, {})
+        names = self._names(scores)
+        results = [(names[item_id], score) for item_id, score in scores.iteritems()
+                   if item_id in names]
+        results.sort(key=lambda (name, score): (-score, name))
+        return results
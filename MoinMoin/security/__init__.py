@@ -71,6 +71,19 @@ class Permissions(object):
 Default = Permissions
 
 
+def get_acl_cache():
+    """ Get the ACL decision cache of the current request (a dict).
+
+        It is cleared when items get changed (see
+        MoinMoin.storage.backends.acl.AclWrapperBackend._changed).
+    """
+    try:
+        return flaskg.acl_decisions
+    except AttributeError:
+        flaskg.acl_decisions = {}
+        return flaskg.acl_decisions
+
+
 class AccessControlList(object):
     """
     Access Control List
@@ -166,6 +179,14 @@ class AccessControlList(object):
            These are the acceptable (known) rights (and the place to
            extend, if necessary).
            Default: ["read", "write", "create", "destroy", "admin"]
+
+    How ACL is evaluated
+
+        Each right in acl_rights_valid gets a bit. The ACL entries are
+        compiled once into (entry, decided rights mask, granted rights mask)
+        tuples. For a user, one pass over the entries yields the masks of
+        the rights decided / granted by this ACL for all rights at once
+        (see rights), this is cached for the current request.
     """
 
     special_users = ["All", "Known", "Trusted"] # order is important
@@ -176,6 +197,10 @@ class AccessControlList(object):
             self.acl_rights_valid = cfg.acl_rights_valid
         else:
             self.acl_rights_valid = valid
+        # right -> bit
+        self.right_bits = dict((right, 1 << i) for i, right in enumerate(self.acl_rights_valid))
+        self.all_rights = (1 << len(self.acl_rights_valid)) - 1
+        self._compiled = None
         self.default = default
         self.auth_methods_trusted = cfg.auth_methods_trusted
         assert isinstance(lines, (list, tuple))
@@ -228,54 +253,98 @@ class AccessControlList(object):
                             rightsdict[right] = (right in rights)
                     self.acl.append((entry, rightsdict))
 
-    def may(self, name, dowhat):
-        """ May <name> <dowhat>? Returns boolean answer.
-
-            Note: this just checks THIS ACL, the before/default/after ACL must
-                  be handled elsewhere, if needed.
+    def compile(self):
+        """ Return the compiled ACL, a list of (entry, decided, granted)
+            tuples - decided / granted are the bit masks of the rights the
+            entry decides / grants.
+        """
+        if self._compiled is None:
+            right_bits = self.right_bits
+            compiled = []
+            for entry, rightsdict in self.acl or []:
+                decided = granted = 0
+                for right, allowed in rightsdict.items():
+                    bit = right_bits.get(right, 0)
+                    decided |= bit
+                    if allowed:
+                        granted |= bit
+                compiled.append((entry, decided, granted))
+            self._compiled = compiled
+        return self._compiled
+
+    def rights(self, name):
+        """ Return (decided, granted) - the bit masks of the rights this ACL
+            decides / grants for user <name> (see right_bits).
+
+            The result is cached for the current request.
         """
+        current_user = flaskg.user
+        key = ('rights', self, name, current_user.name, getattr(current_user, 'auth_method', None))
+        cache = get_acl_cache()
+        try:
+            return cache[key]
+        except KeyError:
+            result = cache[key] = self._rights(name)
+            return result
+
+    def _rights(self, name):
         groups = flaskg.groups
-        allowed = None
-        for entry, rightsdict in self.acl:
+        all_rights = self.all_rights
+        specials = {}
+        decided = granted = 0
+        for entry, entry_decided, entry_granted in self.compile():
             if entry in self.special_users:
-                handler = getattr(self, "_special_"+entry, None)
-                allowed = handler(name, dowhat, rightsdict)
+                match = self._special_match(entry, name, specials)
             elif entry in groups:
-                if name in groups[entry]:
-                    allowed = rightsdict.get(dowhat)
-                else:
+                match = name in groups[entry]
+                if not match:
                     for special in self.special_users:
                         if special in entry:
-                            handler = getattr(self, "_special_" + special, None)
-                            allowed = handler(name, dowhat, rightsdict)
+                            match = self._special_match(special, name, specials)
                             break # order of self.special_users is important
-            elif entry == name:
-                allowed = rightsdict.get(dowhat)
-            if allowed is not None:
-                return allowed
-        return allowed # should be None
-
-    def _special_All(self, name, dowhat, rightsdict):
-        return rightsdict.get(dowhat)
-
-    def _special_Known(self, name, dowhat, rightsdict):
-        """ check if user <name> is known to us,
-            that means that there is a valid user account present.
-            works for subscription emails.
+            else:
+                match = entry == name
+            if match:
+                new = entry_decided & ~decided
+                granted |= entry_granted & new
+                decided |= new
+                if decided == all_rights:
+                    break
+        return decided, granted
+
+    def _special_match(self, special, name, specials):
+        """ Check if user <name> is in special group <special> (memoized
+            in dict <specials>).
+
+            All: all users
+            Known: there is a valid user account (works for subscription emails)
+            Trusted: user is the current user and has logged in using a trusted
+                     authentication method (does not work for subscription emails)
         """
-        if user.getUserId(name): # is a user with this name known?
-            return rightsdict.get(dowhat)
-        return None
+        try:
+            return specials[special]
+        except KeyError:
+            if special == 'All':
+                match = True
+            elif special == 'Known':
+                match = bool(user.getUserId(name))
+            else: # Trusted
+                match = (flaskg.user.name == name and
+                         flaskg.user.auth_method in self.auth_methods_trusted)
+            specials[special] = match
+            return match
 
-    def _special_Trusted(self, name, dowhat, rightsdict):
-        """ check if user <name> is known AND has logged in using a trusted
-            authentication method.
-            Does not work for subsription emails that should be sent to <user>,
-            as he is not logged in in that case.
+    def may(self, name, dowhat):
+        """ May <name> <dowhat>? Returns boolean answer (None if this ACL
+            does not decide it).
+
+            Note: this just checks THIS ACL, the before/default/after ACL must
+                  be handled elsewhere, if needed.
         """
-        if (flaskg.user.name == name and
-            flaskg.user.auth_method in self.auth_methods_trusted):
-            return rightsdict.get(dowhat)
+        bit = self.right_bits.get(dowhat, 0)
+        decided, granted = self.rights(name)
+        if decided & bit:
+            return bool(granted & bit)
         return None
 
     def __eq__(self, other):
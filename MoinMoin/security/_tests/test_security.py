@@ -261,6 +261,23 @@ class TestAcl(object):
             for right in mayNot:
                 assert not acl.may(user, right)
 
+    def testRights(self):
+        """ security: rights bit masks of an acl """
+        acl = security.AccessControlList(app.cfg, ["+JoeDoe:write -JoeDoe:admin Known:read All:"],
+                                         valid=['read', 'write', 'admin', 'destroy'])
+        read, write, admin, destroy = 1, 2, 4, 8
+        assert acl.right_bits == dict(read=read, write=write, admin=admin, destroy=destroy)
+        assert acl.compile() == [('JoeDoe', write, write), ('JoeDoe', admin, 0),
+                                 ('Known', read|write|admin|destroy, read),
+                                 ('All', read|write|admin|destroy, 0)]
+        assert acl.rights(u'JoeDoe') == (read|write|admin|destroy, write)
+        assert acl.may(u'JoeDoe', 'write')
+        assert not acl.may(u'JoeDoe', 'read') # JoeDoe is not known
+        assert acl.may(u'JoeDoe', 'unknown right') is None
+        empty_acl = security.AccessControlList(app.cfg, [""])
+        assert empty_acl.rights(u'JoeDoe') == (0, 0)
+        assert empty_acl.may(u'JoeDoe', 'read') is None
+
 
 class TestItemAcls(object):
     """ security: real-life access control list on items testing
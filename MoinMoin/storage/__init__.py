@@ -56,6 +56,10 @@ from MoinMoin.storage.error import RevisionNumberMismatchError, AccessError, \
 # some backends may use this also for other purposes.
 HASH_ALGORITHM = 'sha1'
 
+# metadata key of the mimetype of a revision (some backends store revisions
+# differently depending on it)
+MIMETYPE = 'mimetype'
+
 import hashlib
 
 
@@ -454,6 +458,20 @@ class Backend(object):
         """
         raise NotImplementedError()
 
+    def _get_revision_local_path(self, revision):
+        """
+        Return the path of a local file holding exactly the revision's data.
+
+        Backends storing revision data as plain files can implement this, so
+        the data can be served directly from the file (e.g. via the WSGI
+        server's file_wrapper or X-Sendfile), without copying it through python.
+
+        @type revision: Object of type StoredRevision.
+        @param revision: The revision we want the data file path of.
+        @return: filesystem path or None, if there is no such file.
+        """
+        return None
+
     # item copying
     def _copy_item_progress(self, verbose, st):
         if verbose:
@@ -885,6 +903,11 @@ class StoredRevision(Revision):
 
     size = property(_get_size, doc="Size of revision's data")
 
+    def _get_local_path(self):
+        return self._backend._get_revision_local_path(self)
+
+    local_path = property(_get_local_path, doc="Path of a local file with the revision's data (or None)")
+
     def __setitem__(self, key, value):
         """
         Revision metadata cannot be altered, thus, we raise an Exception.
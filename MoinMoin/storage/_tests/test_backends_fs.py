@@ -7,10 +7,12 @@
     @license: GNU GPL, see COPYING for details.
 """
 
-import py, os, tempfile, shutil
+import py, os, tempfile, shutil, struct
+import cPickle as pickle
 
 from MoinMoin.storage._tests.test_backends import BackendTest
-from MoinMoin.storage.backends.fs import FSBackend
+from MoinMoin.storage.backends import fs
+from MoinMoin.storage.backends.fs import FSBackend, NameLog, cdb
 
 class TestFSBackend(BackendTest):
 
@@ -57,3 +59,139 @@ class TestFSBackend(BackendTest):
         # if we leave out the latter line, it fails
         i2.publish_metadata()
 
+
+    def test_name_log(self):
+        for i in range(3):
+            item = self.backend.create_item(u'item%d' % i)
+            item.create_revision(0)
+            item.commit()
+        item = self.backend.get_item(u'item0')
+        item.rename(u'renamed')
+        self.backend.get_item(u'item1').destroy()
+        # a second reader (as another process would have it) replays the log
+        name_log = NameLog(os.path.join(self.tempdir, 'name-log'))
+        assert sorted(name_log.items()) == sorted(self.backend._name_log.items())
+        assert name_log.get('renamed') == item._fs_item_id
+        assert name_log.get('item0') is None
+        assert name_log.get('item1') is None
+        # incomplete records (crashed writer) are ignored and dropped
+        f = open(name_log.path, 'ab')
+        f.write('A\0\0')
+        f.close()
+        assert name_log.get('item2') is not None
+        self.backend.create_item(u'item3').create_revision(0).item.commit()
+        assert name_log.get('item3') is not None
+        assert sorted([item.name for item in self.backend.iteritems()]) == [u'item2', u'item3', u'renamed']
+
+    def test_name_log_compaction(self):
+        name_log = NameLog(os.path.join(self.tempdir, 'name-log'))
+        item = self.backend.create_item(u'item')
+        item.create_revision(0)
+        item.commit()
+        inode = os.stat(name_log.path).st_ino
+        for i in range(NameLog.COMPACT_MIN):
+            item.rename(u'item%d' % (i % 2))
+        assert os.stat(name_log.path).st_ino != inode
+        assert self.backend._name_log._records < NameLog.COMPACT_MIN
+        # the other reader notices the new log
+        assert name_log.items() == [('item1', item._fs_item_id)]
+
+    def test_convert_cdb(self):
+        shutil.rmtree(self.tempdir)
+        os.mkdir(self.tempdir)
+        maker = cdb.cdbmake(os.path.join(self.tempdir, 'name-mapping'), os.path.join(self.tempdir, 'name-mapping.tmp'))
+        maker.add(u'\xe4'.encode('utf-8'), '1')
+        maker.finish()
+        os.mkdir(os.path.join(self.tempdir, '1'))
+        backend = FSBackend(self.tempdir)
+        assert backend.has_item(u'\xe4')
+        assert [item.name for item in backend.iteritems()] == [u'\xe4']
+
+    def test_file_pool(self):
+        pool = fs.file_pool
+        item = self.backend.create_item(u'pooled')
+        for revno in range(pool.size + 10):
+            rev = item.create_revision(revno)
+            rev.write('data %d' % revno)
+            item.commit()
+        revs = [item.get_revision(revno) for revno in item.list_revisions()]
+        for rev in revs:
+            rev.read(4)
+        # the revisions do not keep their files open
+        assert pool._count <= pool.size
+        for revno, rev in enumerate(revs):
+            assert rev.read() == ' %d' % revno
+        rev = revs[-1]
+        rev.seek(-2, 2)
+        assert rev.read() == str(pool.size + 9)[-2:]
+        assert rev.tell() == rev.size
+        # metadata is decoded once per revision file
+        path = os.path.abspath(revs[0]._fs_revpath)
+        assert [k for k in fs.metadata_cache._entries if k[0] == path]
+        item.destroy()
+        assert not [k for k in pool._files if k[0].startswith(self.tempdir)]
+
+    def test_metadata_cache_key(self):
+        # same item id, revno, size (and mtime, on coarse filesystems) in
+        # two backends must not share cached metadata
+        dirs = [tempfile.mkdtemp('', 'moin-'), tempfile.mkdtemp('', 'moin-')]
+        randint = fs.random.randint
+        fs.random.randint = lambda a, b: 17
+        try:
+            backends = [(FSBackend(dirs[0]), u'All:read'), (FSBackend(dirs[1]), u'All:none'), ]
+            for backend, acl in backends:
+                item = backend.create_item(u'same')
+                rev = item.create_revision(0)
+                rev['acl'] = acl
+                rev['tags'] = [u'tag']
+                item.commit()
+                assert item._fs_item_id == '17'
+            for backend, acl in backends:
+                rev = backend.get_item(u'same').get_revision(0)
+                assert rev['acl'] == acl
+                # the cached metadata is not shared
+                rev['tags'].append(u'changed')
+                assert backend.get_item(u'same').get_revision(0)['tags'] == [u'tag']
+        finally:
+            fs.random.randint = randint
+            for path in dirs:
+                shutil.rmtree(path)
+
+    def test_convert_metadata(self):
+        item = self.backend.create_item(u'converted')
+        item.change_metadata()
+        item['key'] = u'item value'
+        item.publish_metadata()
+        for revno, data in enumerate(['', 'data']):
+            rev = item.create_revision(revno)
+            rev['key'] = u'value %d' % revno
+            rev.write(data)
+            item.commit()
+        item_path = os.path.join(self.tempdir, item._fs_item_id)
+        # store the metadata in the old format
+        f = open(os.path.join(item_path, 'meta'), 'wb')
+        f.write(pickle.dumps({'key': u'item value'}, protocol=1))
+        f.close()
+        for revno, data in enumerate(['', 'data']):
+            md = pickle.dumps({'__timestamp': 1, 'key': u'value %d' % revno}, protocol=1)
+            f = open(os.path.join(item_path, 'rev.%d' % revno), 'wb')
+            f.write(struct.pack('!L', len(md) + 4) + md + data)
+            f.close()
+
+        def check():
+            item = self.backend.get_item(u'converted')
+            assert item['key'] == u'item value'
+            for revno, data in enumerate(['', 'data']):
+                rev = item.get_revision(revno)
+                assert rev['key'] == u'value %d' % revno
+                assert rev.timestamp == 1
+                assert rev.read() == data
+
+        check()
+        # a reader of a revision being converted continues reading
+        rev = self.backend.get_item(u'converted').get_revision(1)
+        assert rev.read(2) == 'da'
+        assert self.backend.convert_metadata() == 3
+        assert rev.read() == 'ta'
+        check()
+        assert self.backend.convert_metadata() == 0
@@ -8,9 +8,12 @@
 """
 
 import py, os, tempfile, shutil
+import cPickle as pickle
 
 from MoinMoin.storage._tests.test_backends import BackendTest
-from MoinMoin.storage.backends.fs2 import FS2Backend
+from MoinMoin.storage import HASH_ALGORITHM
+from MoinMoin.items import MIMETYPE
+from MoinMoin.storage.backends.fs2 import FS2Backend, DELTA, text_cache
 from MoinMoin.storage.backends.router import RouterBackend
 
 class TestFS2Backend(BackendTest):
@@ -58,3 +61,110 @@ class TestFS2Backend(BackendTest):
         # if we leave out the latter line, it fails
         i2.publish_metadata()
 
+
+    def test_local_path(self):
+        i = self.backend.create_item('local path')
+        r = i.create_revision(0)
+        r.write('some data')
+        i.commit()
+        r = self.backend.get_item('local path').get_revision(0)
+        assert r.local_path.startswith(self.tempdir)
+        assert open(r.local_path, 'rb').read() == 'some data'
+
+    def test_convert_metadata(self):
+        backend = FS2Backend(self.tempdir)
+        item = backend.create_item(u'converted')
+        item.change_metadata()
+        item['key'] = u'item value'
+        item.publish_metadata()
+        rev = item.create_revision(0)
+        rev['key'] = u'rev value'
+        rev.write('data')
+        item.commit()
+        meta_path = os.path.join(self.tempdir, 'meta', item._fs_item_id)
+        # store the metadata in the old format
+        for name, metadata in [('item', {'key': u'item value'}),
+                               ('0.rev', dict(backend.get_item(u'converted').get_revision(0)))]:
+            f = open(os.path.join(meta_path, name), 'wb')
+            f.write(pickle.dumps(metadata, protocol=1))
+            f.close()
+
+        def check():
+            item = backend.get_item(u'converted')
+            assert item['key'] == u'item value'
+            rev = item.get_revision(0)
+            assert rev['key'] == u'rev value'
+            assert rev.read() == 'data'
+
+        check()
+        assert backend.convert_metadata() == 2
+        check()
+        assert backend.convert_metadata() == 0
+
+    def test_shared_data(self):
+        backend = FS2Backend(self.tempdir)
+        data_path = os.path.join(self.tempdir, 'data')
+        for name in [u'copy1', u'copy2']:
+            item = backend.create_item(name)
+            rev = item.create_revision(0)
+            rev.write('same data')
+            item.commit()
+        rev = backend.get_item(u'copy1').get_revision(0)
+        data_hash = rev[HASH_ALGORITHM]
+        assert os.listdir(data_path) == [data_hash]
+        assert backend._blobs.refs(data_hash) == 2
+        rev.destroy()
+        assert backend.get_item(u'copy2').get_revision(0).read() == 'same data'
+        assert backend._blobs.refs(data_hash) == 1
+        backend.get_item(u'copy2').destroy()
+        # the last reference is gone
+        assert backend._blobs.refs(data_hash) == 0
+        assert os.listdir(data_path) == []
+
+    def test_collect_garbage(self):
+        backend = FS2Backend(self.tempdir)
+        item = backend.create_item(u'collected')
+        rev = item.create_revision(0)
+        rev.write('used data')
+        item.commit()
+        data_hash = item.get_revision(0)[HASH_ALGORITHM]
+        data_path = os.path.join(self.tempdir, 'data')
+        f = open(os.path.join(data_path, 'da39a3ee5e6b4b0d3255bfef95601890afd80709'), 'wb')
+        f.close()
+        backend._blobs._set_refs(data_hash, 5)
+        assert backend.collect_garbage() == 1
+        assert os.listdir(data_path) == [data_hash]
+        assert backend._blobs.refs(data_hash) == 1
+        assert backend.get_item(u'collected').get_revision(0).read() == 'used data'
+
+    def test_delta_storage(self):
+        backend = FS2Backend(self.tempdir, delta_interval=4)
+        item = backend.create_item(u'text')
+        texts = []
+        text = ''.join(['line %d\n' % i for i in range(1000)])
+        for revno in range(10):
+            text = text.replace('line %d\n' % revno, 'changed line %d\n' % revno)
+            texts.append(text)
+            rev = item.create_revision(revno)
+            rev[MIMETYPE] = 'text/plain'
+            rev.write(text)
+            item.commit()
+        item = backend.get_item(u'text')
+        deltas = [revno for revno in range(10) if DELTA in item.get_revision(revno)._fs_metadata]
+        assert deltas == [1, 2, 3, 5, 6, 7, 9]
+        # stored deltas are small
+        data_path = os.path.join(self.tempdir, 'data')
+        assert sum([os.path.getsize(os.path.join(data_path, name)) for name in os.listdir(data_path)]) < 4 * len(text)
+        text_cache._entries.clear()
+        for revno in reversed(range(10)):
+            rev = item.get_revision(revno)
+            assert rev.size == len(texts[revno])
+            assert rev.read() == texts[revno]
+        assert item.get_revision(2).local_path is None
+        # destroying the base of a delta stores the next revision completely
+        item.get_revision(1).destroy()
+        assert DELTA not in item.get_revision(2)._fs_metadata
+        text_cache._entries.clear()
+        for revno in [2, 3, 4]:
+            assert item.get_revision(revno).read() == texts[revno]
+        assert sorted(os.listdir(data_path)) == sorted(backend._iter_data_hashes())
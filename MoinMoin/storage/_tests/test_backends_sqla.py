@@ -9,11 +9,13 @@
 """
 
 from StringIO import StringIO
+import os, tempfile, shutil, sqlite3
+import cPickle as pickle
 
 import py
 
 from MoinMoin.storage._tests.test_backends import BackendTest
-from MoinMoin.storage.backends.sqla import SQLAlchemyBackend, SQLARevision, Data
+from MoinMoin.storage.backends.sqla import SQLAlchemyBackend, SQLARevision, Data, Chunk
 
 
 class TestSQLABackend(BackendTest):
@@ -65,7 +67,7 @@ class TestChunkedRevDataStorage(object):
         item.commit()
         rev = item.get_revision(0)
         # there should be exactly one chunk (if write() works correctly)
-        assert len(rev._data._chunks) == 1
+        assert rev._data._chunks.count() == 1
         # read all we have
         read_data = rev.read()
         assert read_data == data
@@ -86,7 +88,7 @@ class TestChunkedRevDataStorage(object):
         # read 0 bytes at pos 0
         rev = item.get_revision(1)
         # there should be no chunks (if write() works correctly)
-        #assert len(rev._data._chunks) == 0
+        assert rev._data._chunks.count() == 0
         # read all we have (== nothing)
         read_data = rev.read()
         assert read_data == data
@@ -153,3 +155,129 @@ class TestChunkedRevDataStorage(object):
             assert sio.tell() == self.rev._data.tell()
             assert sio.read() == self.rev._data.read()
 
+
+class TestChunkStreaming(object):
+    raw_data = "".join([chr(i % 256) for i in range(1000)])
+
+    def setup_method(self, meth):
+        self.chunksize = Chunk.chunksize
+        Chunk.chunksize = 64
+        self.sqlabackend = SQLAlchemyBackend('sqlite:///:memory:')
+
+    def teardown_method(self, meth):
+        Chunk.chunksize = self.chunksize
+
+    def _chunk_count(self):
+        session = self.sqlabackend.Session()
+        count = session.query(Chunk).count()
+        session.close()
+        return count
+
+    def test_write_flushes_chunks(self):
+        item = self.sqlabackend.create_item(u"streamed")
+        rev = item.create_revision(0)
+        for i in range(0, len(self.raw_data), 100):
+            rev.write(self.raw_data[i:i+100])
+        # full chunks were already flushed to the DB (but are not committed yet)
+        assert rev.session.query(Chunk).count() == len(self.raw_data) // 64
+        item.commit()
+        assert self._chunk_count() == len(self.raw_data) // 64 + 1
+
+    def test_read_seek(self):
+        item = self.sqlabackend.create_item(u"streamed")
+        rev = item.create_revision(0)
+        rev.write(self.raw_data)
+        item.commit()
+        rev = item.get_revision(0)
+        assert rev.read() == self.raw_data
+        for pos, amount in [(0, 1), (63, 2), (64, 64), (500, 300), (990, 100), (1000, 1), ]:
+            rev.seek(pos)
+            assert rev.read(amount) == self.raw_data[pos:pos+amount]
+        rev.seek(0)
+        data = []
+        while True:
+            block = rev.read(10)
+            if not block:
+                break
+            data.append(block)
+        assert "".join(data) == self.raw_data
+
+    def test_destroy_removes_chunks(self):
+        item = self.sqlabackend.create_item(u"streamed")
+        rev = item.create_revision(0)
+        rev.write(self.raw_data)
+        item.commit()
+        assert self._chunk_count() > 0
+        item.get_revision(0).destroy()
+        assert self._chunk_count() == 0
+
+    def test_shared_data(self):
+        for name in [u"copy1", u"copy2"]:
+            item = self.sqlabackend.create_item(name)
+            rev = item.create_revision(0)
+            rev.write(self.raw_data)
+            item.commit()
+        # the same content is stored once
+        assert self._chunk_count() == len(self.raw_data) // 64 + 1
+        self.sqlabackend.get_item(u"copy1").get_revision(0).destroy()
+        assert self.sqlabackend.get_item(u"copy2").get_revision(0).read() == self.raw_data
+        self.sqlabackend.get_item(u"copy2").destroy()
+        assert self._chunk_count() == 0
+
+    def test_collect_garbage(self):
+        item = self.sqlabackend.create_item(u"collected")
+        rev = item.create_revision(0)
+        rev.write(self.raw_data)
+        item.commit()
+        conn = self.sqlabackend.engine.connect()
+        conn.execute(Data.__table__.update().values(refs=5))
+        conn.execute(Data.__table__.insert().values(size=0, refs=1))
+        conn.execute(Chunk.__table__.insert().values(chunkno=0, _container_id=42, _data='orphaned'))
+        conn.close()
+        assert self.sqlabackend.collect_garbage() == 1
+        assert self._chunk_count() == len(self.raw_data) // 64 + 1
+        rev = item.get_revision(0)
+        assert rev._data.refs == 1
+        assert rev.read() == self.raw_data
+
+
+def test_migrate_shared_data():
+    tempdir = tempfile.mkdtemp('', 'moin-')
+    try:
+        path = os.path.join(tempdir, 'old.db')
+        # the schema before revisions shared their data containers
+        conn = sqlite3.connect(path)
+        conn.executescript("""
+            CREATE TABLE items (id INTEGER PRIMARY KEY, _name VARCHAR(512) UNIQUE, _metadata BLOB);
+            CREATE TABLE revisions (id INTEGER PRIMARY KEY, _item_id INTEGER, _revno INTEGER,
+                                    _metadata BLOB, _timestamp INTEGER, UNIQUE (_item_id, _revno));
+            CREATE TABLE rev_data (id INTEGER PRIMARY KEY, _revision_id INTEGER, size INTEGER);
+            CREATE TABLE rev_data_chunks (id INTEGER PRIMARY KEY, chunkno INTEGER, _container_id INTEGER, _data BLOB);
+        """)
+        metadata = sqlite3.Binary(pickle.dumps({}, 2))
+        conn.execute("INSERT INTO items VALUES (1, 'old', ?)", (metadata, ))
+        for rev_id, data_id in [(1, 7), (2, 8), ]:
+            conn.execute("INSERT INTO revisions VALUES (?, 1, ?, ?, 0)", (rev_id, rev_id - 1, metadata))
+            conn.execute("INSERT INTO rev_data VALUES (?, ?, 4)", (data_id, rev_id))
+            conn.execute("INSERT INTO rev_data_chunks VALUES (?, 0, ?, ?)",
+                         (data_id, data_id, sqlite3.Binary('rev%d' % rev_id)))
+        conn.commit()
+        conn.close()
+        backend = SQLAlchemyBackend('sqlite:///' + path)
+        item = backend.get_item(u'old')
+        assert item.get_revision(0).read() == 'rev1'
+        assert item.get_revision(1).read() == 'rev2'
+        item.get_revision(0).destroy()
+        assert backend.get_item(u'old').get_revision(1).read() == 'rev2'
+        session = backend.Session()
+        assert session.query(Chunk).count() == 1
+        session.close()
+        # already migrated
+        SQLAlchemyBackend('sqlite:///' + path)
+        conn = sqlite3.connect(path)
+        indexes = [sql for sql, in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL")]
+        conn.close()
+        assert [sql for sql in indexes if '_data_id' in sql]
+        assert [sql for sql in indexes if 'digest' in sql]
+    finally:
+        shutil.rmtree(tempdir)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+    MoinMoin - Test - line based deltas
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import random
+import time
+
+from MoinMoin.storage.backends._delta import make_delta, apply_delta
+
+
+def test_delta():
+    base = ''.join(['line %d\n' % i for i in range(1000)])
+    tests = [
+        base,
+        '',
+        base.replace('line 500\n', 'changed line\n'),
+        'new first line\r\n' + base + 'no newline at the end',
+        base[:2000] + base[4000:],
+        '\xff\x00binary\rdata\x0c',
+    ]
+    for data in tests:
+        delta = make_delta(base, data)
+        assert apply_delta(base, delta) == data
+        assert apply_delta('', make_delta('', data)) == data
+    # small changes give small deltas
+    assert len(make_delta(base, tests[2])) < 50
+
+
+def test_delta_repetitive():
+    # wiki markup repeats lines a lot, the work for a delta must stay bounded
+    rnd = random.Random(42)
+    markup = ['\n', '----\n', '||cell||cell||\n', ' * item\n', 'text\n']
+    base = ''.join([rnd.choice(markup) for i in range(20000)])
+    data = ''.join([rnd.choice(markup) for i in range(20000)])
+    t = time.time()
+    delta = make_delta(base, data)
+    assert time.time() - t < 10
+    assert delta is None or apply_delta(base, delta) == data
+    changed = base[:50000] + 'changed line\n' + base[50000:]
+    delta = make_delta(base, changed)
+    assert apply_delta(base, delta) == changed
+    assert len(delta) < 50
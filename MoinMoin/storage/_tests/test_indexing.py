@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+    MoinMoin - Test - indexing
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import os, re, shutil, tempfile
+import sqlite3
+
+import py
+
+from MoinMoin.items import USERGROUP, TAGS
+from MoinMoin.search import term
+from MoinMoin.storage.backends.memory import MemoryBackend
+from MoinMoin.storage.backends.router import RouterBackend
+from MoinMoin.storage.backends.indexing import name_prefix, is_name_term
+
+
+class TestNamePrefix(object):
+    def test_prefix(self):
+        for pattern, flags, expected in [
+            (u'^foo/.*', re.U, (u'foo/', True)),
+            (u'^foo/', re.U, (u'foo/', True)),
+            (u'^.*', re.U, (u'', True)),
+            (u'^' + re.escape(u'a b/'), re.U, (u'a b/', True)),
+            (u'^foo/.*bar', re.U, (u'foo/', False)),
+            (u'^foo/', re.U|re.I, (u'', False)),
+            (u'foo/.*', re.U, (u'', False)),
+            (u'^fo+', re.U, (u'f', False)),
+           ]:
+            assert name_prefix(re.compile(pattern, flags)) == expected
+
+    def test_is_name_term(self):
+        assert is_name_term(term.NameRE(re.compile(u'x')))
+        assert is_name_term(term.AND(term.Name(u'x', True), term.NOT(term.NameFn(bool))))
+        assert not is_name_term(term.OR(term.Name(u'x', True), term.Text(u'x', True)))
+
+
+class TestIndexedSearch(object):
+    items = {
+        # name: (item metadata, last revision metadata)
+        u'a': ({'m1': u'True'}, {'r1': u'1', 'r2': 1}),
+        u'a/b': ({'m1': u'False'}, {'r1': u'2', 'r2': 2}),
+        u'a/b/c': ({}, {'r1': u'1', 'r3': [u'list']}),
+        u'b': ({'m1': u'True'}, {'r1': u'1'}),
+        u'B': ({'m1': u'True'}, {}),
+        u'meta_only': ({'m1': u'True'}, None),
+    }
+
+    def setup_method(self, method):
+        self.backend = RouterBackend([('/', MemoryBackend())], index_uri='sqlite://')
+        for name, (item_meta, rev_meta) in self.items.items():
+            item = self.backend.create_item(name)
+            item.change_metadata()
+            item.update(item_meta)
+            item.publish_metadata()
+            if rev_meta is not None:
+                rev = item.create_revision(0)
+                rev.update(rev_meta)
+                rev.write('')
+                item.commit()
+
+    def _check(self, t):
+        expected = []
+        for item in self.backend.iteritems():
+            t.prepare()
+            if t.evaluate(item):
+                expected.append(item.name)
+        found = [item.name for item in self.backend.search_items(t)]
+        assert sorted(found) == sorted(expected)
+
+    def test_search(self):
+        NameRE, Name = term.NameRE, term.Name
+        for t in [
+            NameRE(re.compile(u'^a/.*', re.U)),
+            NameRE(re.compile(u'^a.*', re.U)),
+            NameRE(re.compile(u'^a/.*c$', re.U)),
+            NameRE(re.compile(u'^.*', re.U)),
+            NameRE(re.compile(u'b')),
+            Name(u'B', False),
+            term.NameFn(lambda name: len(name) == 1),
+            term.ItemMetaDataMatch('m1', u'True'),
+            term.ItemMetaDataMatch('m1', 'True'),
+            term.ItemMetaDataMatch('m1', 'nothere'),
+            term.ItemHasMetaDataKey('m1'),
+            term.LastRevisionMetaDataMatch('r1', u'1'),
+            term.LastRevisionMetaDataMatch('r2', 2),
+            term.LastRevisionMetaDataMatch('r3', [u'list']),
+            term.LastRevisionHasMetaDataKey('r2'),
+            term.AND(NameRE(re.compile(u'^a', re.U)), term.LastRevisionMetaDataMatch('r1', u'1')),
+            term.AND(Name(u'a', True), term.Text(u'x', True)),
+            term.OR(term.ItemMetaDataMatch('m1', u'False'), term.LastRevisionMetaDataMatch('r1', u'1')),
+            term.OR(term.ItemMetaDataMatch('m1', u'False'), Name(u'meta', True)),
+            term.NOT(term.ItemHasMetaDataKey('m1')),
+            term.NOT(term.AND(term.LastRevisionHasMetaDataKey('r1'), NameRE(re.compile(u'^a/', re.U)))),
+           ]:
+            yield self._check, t
+
+    def test_search_after_rename(self):
+        item = self.backend.get_item(u'a/b/c')
+        item.rename(u'x/y')
+        found = [item.name for item in self.backend.search_items(term.LastRevisionHasMetaDataKey('r3'))]
+        assert found == [u'x/y']
+
+    def test_search_after_destroy(self):
+        self.backend.get_item(u'b').destroy()
+        found = [item.name for item in self.backend.search_items(term.NameRE(re.compile(u'^b', re.U)))]
+        assert found == []
+
+
+class TestIndexedHistory(object):
+    def setup_method(self, method):
+        self.backend = RouterBackend([('/', MemoryBackend())], index_uri='sqlite://')
+        for name in [u'a', u'b', u'c', ]:
+            item = self.backend.create_item(name)
+            for revno in range(3):
+                rev = item.create_revision(revno)
+                rev[u'comment'] = u'%s %d' % (name, revno)
+                rev.write(name * revno)
+                item.commit()
+
+    def test_indexed_revision(self):
+        revs = list(self.backend.history(item_name=u'b'))
+        assert [rev.revno for rev in revs] == [2, 1, 0]
+        rev = revs[0]
+        assert rev.item_name == u'b'
+        assert rev[u'comment'] == u'b 2'
+        assert rev.get(u'nothere') is None
+        assert rev.size == 2
+        assert rev.read() == 'bb'
+        assert rev.item.name == u'b'
+
+    def test_paging(self):
+        for reverse in [True, False, ]:
+            expected = [(rev.item_name, rev.revno) for rev in self.backend.history(reverse=reverse)]
+            assert len(expected) == 9
+            found = []
+            after = None
+            while True:
+                page = list(self.backend.history(reverse=reverse, limit=2, after=after))
+                if not page:
+                    break
+                found.extend([(rev.item_name, rev.revno) for rev in page])
+                after = page[-1].history_key
+            assert found == expected
+
+    def test_limit_readable(self):
+        self.backend.history_batch_size = 2
+        self.backend._may = lambda name, right: name != u'b'
+        revs = list(self.backend.history(limit=5))
+        assert [(rev.item_name, rev.revno) for rev in revs] == [
+            (u'c', 2), (u'c', 1), (u'c', 0), (u'a', 2), (u'a', 1)]
+        assert len(list(self.backend.history())) == 6
+
+    def test_history_after_rename(self):
+        self.backend.get_item(u'a').rename(u'x')
+        revs = list(self.backend.history(item_name=u'x'))
+        assert [(rev.item_name, rev.revno) for rev in revs] == [(u'x', 2), (u'x', 1), (u'x', 0)]
+        assert revs[0].read() == 'aa'
+
+    def test_get_acl(self):
+        index = self.backend._index
+        py.test.raises(KeyError, index.get_acl, u'nothere')
+        assert index.get_acl(u'a') is None
+        item = self.backend.get_item(u'a')
+        rev = item.create_revision(3)
+        rev[u'acl'] = u''
+        item.commit()
+        assert index.get_acl(u'a') == u''
+        item.get_revision(3).destroy()
+        assert index.get_acl(u'a') is None
+        # changes done by other processes are seen
+        item_table = index.item_table
+        item_table.update().where(item_table.c.name == u'a').values(acl=u'All:').execute()
+        assert index.get_acl(u'a') == u'All:'
+        assert [rev.revno for rev in self.backend.history(item_name=u'a')] == [2, 1, 0]
+
+
+class TestIndexUpdate(object):
+    def setup_method(self, method):
+        self.memory = MemoryBackend()
+        self.backend = RouterBackend([('/', self.memory)], index_uri='sqlite://')
+        self.timestamp = 1000000000
+
+    def _add(self, backend, name, revno):
+        if backend.has_item(name):
+            item = backend.get_item(name)
+        else:
+            item = backend.create_item(name)
+        rev = item.create_revision(revno)
+        self.timestamp += 1
+        rev.timestamp = self.timestamp
+        rev.write(name)
+        item.commit()
+
+    def _indexed(self):
+        return sorted((rev.item_name, rev.revno) for rev in self.backend.history())
+
+    def test_update(self):
+        index = self.backend._index
+        self._add(self.backend, u'a', 0)
+        assert index.get_sync_mark(u'') is None
+        self.backend.index_update() # first update indexes everything
+        mark = index.get_sync_mark(u'')
+        assert mark is not None
+        assert self._indexed() == [(u'a', 0)]
+        # changes behind the index's back
+        self._add(self.memory, u'a', 1)
+        self._add(self.memory, u'b', 0)
+        assert self._indexed() == [(u'a', 0)]
+        self.backend.index_update()
+        assert self._indexed() == [(u'a', 0), (u'a', 1), (u'b', 0)]
+        assert index.get_sync_mark(u'') >= mark
+        assert index.get_rev_id(u'a', 1) is not None
+        # the current revision got cached into the item
+        assert [rev.revno for rev in self.backend.history(item_name=u'a')] == [1, 0]
+        self.backend.index_update() # nothing new
+        assert self._indexed() == [(u'a', 0), (u'a', 1), (u'b', 0)]
+
+    def test_rebuild(self):
+        self._add(self.memory, u'a', 0)
+        self._add(self.memory, u'b', 0)
+        self.backend.index_rebuild()
+        assert self._indexed() == [(u'a', 0), (u'b', 0)]
+        assert self.backend._index.get_sync_mark(u'') is not None
+
+    def test_bulk_rollback(self):
+        index = self.backend._index
+        self._add(self.backend, u'a', 0)
+        def fail(backend):
+            index._rebuild(backend)
+            raise ValueError
+        index.metadata.drop_all()
+        index._clear_caches()
+        index.metadata.create_all()
+        py.test.raises(ValueError, index._bulk, fail, self.backend)
+        assert self._indexed() == []
+        assert index.get_sync_mark(u'') is None
+
+    def test_outdated_schema(self):
+        tempdir = tempfile.mkdtemp('', 'moin-')
+        try:
+            index_uri = 'sqlite:///%s' % os.path.join(tempdir, 'index.db')
+            # item_table as created by an older version (without sysitem)
+            conn = sqlite3.connect(os.path.join(tempdir, 'index.db'))
+            conn.execute('CREATE TABLE item_table (id INTEGER PRIMARY KEY, current INTEGER, '
+                         'uuid VARCHAR(32), name VARCHAR, mimetype VARCHAR, acl VARCHAR)')
+            conn.commit()
+            conn.close()
+            self._add(self.memory, u'a', 0)
+            backend = RouterBackend([('/', self.memory)], index_uri=index_uri)
+            assert backend.index_outdated
+            backend.index_update() # rebuilds
+            assert not backend.index_outdated
+            assert [rev.item_name for rev in backend.history()] == [u'a']
+            assert not RouterBackend([('/', self.memory)], index_uri=index_uri).index_outdated
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class TestGroupIndex(object):
+    def setup_method(self, method):
+        self.backend = RouterBackend([('/', MemoryBackend())], index_uri='sqlite://',
+                                     group_re=re.compile(ur'^\S+Group$', re.U))
+        self.groups = self.backend.group_index
+        self._group(u'AGroup', [u'a1', u'BGroup'])
+        self._group(u'BGroup', [u'b1', u'CGroup'])
+        self._group(u'CGroup', [u'c1', u'AGroup', u'OtherGroup'])
+        self._group(u'NoGroupItem', [u'x'])
+
+    def _group(self, name, members):
+        if self.backend.has_item(name):
+            item = self.backend.get_item(name)
+            revno = item.list_revisions()[-1] + 1
+        else:
+            item = self.backend.create_item(name)
+            revno = 0
+        rev = item.create_revision(revno)
+        rev[USERGROUP] = members
+        item.commit()
+
+    def test_closure(self):
+        groups = self.groups
+        assert groups.group_names() == [u'AGroup', u'BGroup', u'CGroup']
+        assert groups.members(u'AGroup') == ([u'a1', u'b1', u'c1'],
+                                            [u'AGroup', u'BGroup', u'CGroup'],
+                                            [u'OtherGroup'])
+        assert groups.has_member(u'AGroup', u'c1')
+        assert not groups.has_member(u'NoGroupItem', u'x')
+        assert groups.groups_with_member(u'b1') == [u'AGroup', u'BGroup', u'CGroup']
+        assert groups.other_group_names() == [u'OtherGroup']
+        assert groups.other_groups(u'CGroup') == [u'OtherGroup']
+        assert groups.other_groups(u'NoGroupItem') == []
+
+    def test_update(self):
+        groups = self.groups
+        self._group(u'CGroup', [u'c2'])
+        assert groups.groups_with_member(u'c1') == []
+        assert groups.groups_with_member(u'c2') == [u'AGroup', u'BGroup', u'CGroup']
+        assert groups.groups_with_member(u'a1') == [u'AGroup']
+        self._group(u'OtherGroup', [u'o1'])
+        assert groups.groups_with_member(u'o1') == [u'OtherGroup']
+        self._group(u'CGroup', [u'OtherGroup'])
+        assert groups.groups_with_member(u'o1') == [u'AGroup', u'BGroup', u'CGroup', u'OtherGroup']
+
+    def test_rename_and_destroy(self):
+        groups = self.groups
+        self.backend.get_item(u'BGroup').rename(u'DGroup')
+        assert groups.groups_with_member(u'b1') == [u'DGroup']
+        assert groups.groups_with_member(u'c1') == [u'CGroup', u'DGroup']
+        self.backend.get_item(u'CGroup').destroy()
+        assert groups.group_names() == [u'AGroup', u'DGroup']
+        assert groups.groups_with_member(u'c1') == []
+
+    def test_rebuild(self):
+        self.backend.index_rebuild()
+        assert self.groups.groups_with_member(u'c1') == [u'AGroup', u'BGroup', u'CGroup']
+
+
+class TestTagIndex(object):
+    def setup_method(self, method):
+        self.backend = RouterBackend([('/', MemoryBackend())], index_uri='sqlite://')
+        self._tag(u'a', [u'fruit', u'red'])
+        self._tag(u'b', [u'fruit', u'yellow'])
+        self._tag(u'c', [u'fruit', u'red', u'red'])
+        self._tag(u'd', [])
+
+    def _tag(self, name, tags):
+        if self.backend.has_item(name):
+            item = self.backend.get_item(name)
+            revno = item.list_revisions()[-1] + 1
+        else:
+            item = self.backend.create_item(name)
+            revno = 0
+        rev = item.create_revision(revno)
+        rev[TAGS] = tags
+        item.commit()
+
+    def test_tags(self):
+        backend = self.backend
+        assert sorted(backend.tag_counts()) == [(1, u'yellow'), (2, u'red'), (3, u'fruit')]
+        assert sorted((count, tag, sorted(names)) for count, tag, names in backend.all_tags()) == [
+            (1, u'yellow', [u'b']), (2, u'red', [u'a', u'c']), (3, u'fruit', [u'a', u'b', u'c'])]
+        assert backend.tagged_items(u'red') == [u'a', u'c']
+        assert backend.tagged_items(u'blue') == []
+
+    def test_tags_starting_with(self):
+        backend = self.backend
+        self._tag(u'e', [u'frozen'])
+        assert backend.tags_starting_with(u'fr') == [(u'fruit', 3), (u'frozen', 1)]
+        assert backend.tags_starting_with(u'fr', limit=1) == [(u'fruit', 3)]
+        assert backend.tags_starting_with(u'x') == []
+        assert [tag for tag, count in backend.tags_starting_with(u'')] == [u'fruit', u'red', u'frozen', u'yellow']
+
+    def test_update_and_destroy(self):
+        backend = self.backend
+        self._tag(u'a', [u'blue'])
+        assert backend.tagged_items(u'red') == [u'c']
+        assert backend.tagged_items(u'blue') == [u'a']
+        backend.get_item(u'a').rename(u'x')
+        assert backend.tagged_items(u'blue') == [u'x']
+        backend.get_item(u'c').destroy()
+        assert backend.tagged_items(u'red') == []
+        assert sorted(backend.tag_counts()) == [(1, u'blue'), (1, u'fruit'), (1, u'yellow')]
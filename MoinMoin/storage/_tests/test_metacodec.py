@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+    MoinMoin - Test - metadata codec for fs based backends
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import cPickle as pickle
+
+from MoinMoin.storage.backends._metacodec import dumps, loads, is_pickle, MAGIC
+
+METADATA = {
+    '__timestamp': 1300000000,
+    'sha1': 'da39a3ee5e6b4b0d3255bfef95601890afd80709',
+    'name': u'Some\xe4Item',
+    'mimetype': 'text/x.moin.wiki',
+    'size': 0,
+    'tags': [u'tag1', u'tag2'],
+    'itemlinks': [],
+    'acl': None,
+    'is_syspage': True,
+    'some_float': 1.5,
+    'negative': -2 ** 70,
+    'some_tuple': (1, 'two', (u'three', )),
+    'some_dict': {u'\xf6': [False, None], 3: {}},
+    'some_set': set([1, 2]), # pickled
+    u'unicode key \xfc': 'value',
+    42: 'int key',
+}
+
+
+def test_roundtrip():
+    data = dumps(METADATA)
+    assert data.startswith(MAGIC)
+    assert not is_pickle(data)
+    result = loads(data)
+    assert result == METADATA
+    for key, value in METADATA.items():
+        assert type(result[key]) is type(value)
+    # smaller than pickle (well-known keys are interned)
+    assert len(data) < len(pickle.dumps(METADATA, protocol=1))
+    assert loads(dumps({})) == {}
+
+
+def test_selected_keys():
+    data = dumps(METADATA)
+    assert loads(data, ['__timestamp', 'comment']) == {'__timestamp': 1300000000}
+    assert loads(data, [u'unicode key \xfc', 'some_dict']) == {
+        u'unicode key \xfc': 'value',
+        'some_dict': METADATA['some_dict'],
+    }
+
+
+def test_pickle():
+    # metadata stored by older versions
+    data = pickle.dumps(METADATA, protocol=1)
+    assert is_pickle(data)
+    assert loads(data) == METADATA
+    assert loads(data, ['name', 'comment']) == {'name': METADATA['name']}
+
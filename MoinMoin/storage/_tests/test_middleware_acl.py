@@ -108,3 +108,30 @@ class TestACLMiddleware(BackendTest):
         py.test.raises(AccessDeniedError, item.get_revision, -1)
         py.test.raises(AccessDeniedError, item.get_revision, 0)
 
+
+    def test_acl_change_not_cached(self):
+        name = "acl_change"
+        item = self.create_item_acl(name, "All:read,write,admin")
+        assert flaskg.user.may.write(name)
+        rev = item.create_revision(1)
+        rev[ACL] = "All:read"
+        item.commit()
+        assert not flaskg.user.may.write(name)
+        # changes done via the unprotected storage must be seen also
+        item = flaskg.unprotected_storage.get_item(name)
+        rev = item.create_revision(2)
+        rev[ACL] = "All:"
+        item.commit()
+        flaskg.acl_decisions.clear() # a new request
+        assert not flaskg.user.may.read(name)
+        item.get_revision(2).destroy()
+        flaskg.acl_decisions.clear()
+        assert flaskg.user.may.read(name)
+        assert not flaskg.user.may.write(name)
+
+    def test_acl_after_rename(self):
+        name = "acl_rename"
+        item = self.create_item_acl(name, "All:read,write,create")
+        item.rename("acl_renamed")
+        assert flaskg.user.may.admin(name) # default acl
+        assert not flaskg.user.may.admin("acl_renamed")
@@ -0,0 +1,149 @@
+# -*- coding: ascii -*-
+"""
+    MoinMoin - content addressed blob store for fs based backends
+
+    Revision data is stored once per content, in a file named by its
+    HASH_ALGORITHM digest. A reference count per blob is kept in a database
+    table, so a blob is removed when the last revision using it is destroyed.
+
+    If the reference counts get out of sync (e.g. after a crash between
+    adding a blob and storing the revision referencing it), collect() does a
+    mark and sweep garbage collection: it rebuilds the reference counts from
+    the digests actually referenced and removes the unreferenced blobs. As it
+    can not know about revisions currently being committed, only run it while
+    the backend is not in use.
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import os, errno
+
+from sqlalchemy import Table, Column, String, Integer, select
+
+from MoinMoin import log
+logging = log.getLogger(__name__)
+
+from MoinMoin.util.lock import ExclusiveLock
+from MoinMoin.util import filesys
+
+DIGEST_LEN = 128 # hex digest of sha512
+
+
+class FileBlobStore(object):
+    """
+    Blobs stored as files <path>/<digest>, reference counts in table blob_refs
+    """
+    def __init__(self, path, metadata):
+        """
+        @param path: directory for the blob files (must exist)
+        @param metadata: sqlalchemy MetaData (bound) for the blob_refs table
+        """
+        self.path = path
+        self.ref_table = Table('blob_refs', metadata,
+            Column('digest', String(DIGEST_LEN), primary_key=True),
+            Column('refs', Integer, nullable=False),
+        )
+
+    def blob_path(self, digest):
+        """
+        path of the file with the data of blob <digest>
+        """
+        return os.path.join(self.path, digest)
+
+    def _locked(self, fn, *args):
+        lock = ExclusiveLock(os.path.join(self.path, 'blobs.lock'), 30)
+        lock.acquire(30)
+        try:
+            return fn(*args)
+        finally:
+            lock.release()
+
+    def _get_refs(self, digest):
+        ref_table = self.ref_table
+        return select([ref_table.c.refs], ref_table.c.digest == digest).execute().scalar() or 0
+
+    def _set_refs(self, digest, refs):
+        ref_table = self.ref_table
+        ref_table.delete().where(ref_table.c.digest == digest).execute()
+        if refs > 0:
+            ref_table.insert().values(digest=digest, refs=refs).execute()
+
+    def add(self, digest, tmp_path):
+        """
+        add a reference to blob <digest>, its data is in file <tmp_path>.
+        If the blob already exists, the file is just removed.
+        """
+        self._locked(self._add, digest, tmp_path)
+
+    def _add(self, digest, tmp_path):
+        try:
+            filesys.rename_no_overwrite(tmp_path, self.blob_path(digest), delete_old=True)
+        except OSError, err:
+            if err.errno != errno.EEXIST:
+                raise
+            # we already have this content
+        self._set_refs(digest, self._get_refs(digest) + 1)
+
+    def remove(self, digest):
+        """
+        remove a reference to blob <digest>, remove the blob if it was the last
+        """
+        self._locked(self._remove, digest)
+
+    def _remove(self, digest):
+        refs = self._get_refs(digest) - 1
+        self._set_refs(digest, refs)
+        if refs <= 0:
+            try:
+                os.unlink(self.blob_path(digest))
+            except OSError, err:
+                if err.errno != errno.ENOENT:
+                    raise
+
+    def refs(self, digest):
+        """
+        number of references to blob <digest>
+        """
+        return self._get_refs(digest)
+
+    def recount(self, digests):
+        """
+        set the reference counts to the number of times a digest is in
+        <digests> (iterable), without removing any blobs.
+        """
+        counts = {}
+        for digest in digests:
+            counts[digest] = counts.get(digest, 0) + 1
+        self._locked(self._recount, counts)
+
+    def _recount(self, counts):
+        ref_table = self.ref_table
+        ref_table.delete().execute()
+        if counts:
+            ref_table.insert().execute([dict(digest=digest, refs=refs)
+                                        for digest, refs in counts.iteritems()])
+
+    def collect(self, digests):
+        """
+        mark and sweep: set the reference counts to the number of times a
+        digest is in <digests> (iterable, all references) and remove all blobs
+        not in there. Only use this while the backend is not in use.
+
+        @return: number of removed blobs
+        """
+        counts = {}
+        for digest in digests:
+            counts[digest] = counts.get(digest, 0) + 1
+        return self._locked(self._collect, counts)
+
+    def _collect(self, counts):
+        self._recount(counts)
+        removed = 0
+        for name in os.listdir(self.path):
+            if name in counts or name.endswith('.tmp') or name.endswith('.lock'):
+                continue
+            logging.debug("removing unreferenced blob %s" % name)
+            os.unlink(self.blob_path(name))
+            removed += 1
+        return removed
@@ -0,0 +1,72 @@
+# -*- coding: ascii -*-
+"""
+    MoinMoin - line based deltas for storing text revisions
+
+    A delta transforms the data of a base revision into the data of a new
+    revision. It is a (zlib compressed) sequence of operations:
+     - 'c', start, count: copy count lines starting at line start of the base
+     - 'i', length, data: insert data
+    (numbers are varints, see _metacodec). Lines keep their line endings, so
+    the data is reconstructed exactly.
+
+    The lines are diffed with MoinMoin.util.diff_engine. As this is done for
+    every commit, the work is limited (see DELTA_WORK_LIMIT): if two texts are
+    too different for a delta, none is made.
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import zlib
+
+from MoinMoin.storage.backends._metacodec import encode_varint, decode_varint
+from MoinMoin.util.diff_engine import opcodes, DiffLimitError
+
+# max. work done by the diff engine for one delta
+DELTA_WORK_LIMIT = 500000
+
+
+def make_delta(base, data):
+    """
+    return the delta transforming <base> into <data> (both str) or None if
+    finding it is too much work (store the full data then)
+    """
+    base_lines = base.splitlines(True)
+    lines = data.splitlines(True)
+    try:
+        line_ops = opcodes(base_lines, lines, work_limit=DELTA_WORK_LIMIT, exact=True)
+    except DiffLimitError:
+        return None
+    ops = []
+    for tag, i1, i2, j1, j2 in line_ops:
+        if tag == 'equal':
+            ops.append('c' + encode_varint(i1) + encode_varint(i2 - i1))
+        elif j2 > j1:
+            # replace or insert
+            inserted = ''.join(lines[j1:j2])
+            ops.append('i' + encode_varint(len(inserted)) + inserted)
+        # else: delete, nothing to do
+    return zlib.compress(''.join(ops))
+
+
+def apply_delta(base, delta):
+    """
+    return the data made from <base> by applying <delta> (see make_delta)
+    """
+    base_lines = base.splitlines(True)
+    delta = zlib.decompress(delta)
+    result = []
+    pos = 0
+    while pos < len(delta):
+        op = delta[pos]
+        if op == 'c':
+            start, pos = decode_varint(delta, pos + 1)
+            count, pos = decode_varint(delta, pos)
+            result.extend(base_lines[start:start+count])
+        elif op == 'i':
+            length, pos = decode_varint(delta, pos + 1)
+            result.append(delta[pos:pos+length])
+            pos += length
+        else:
+            raise ValueError("invalid delta operation %r" % op)
+    return ''.join(result)
@@ -0,0 +1,217 @@
+# -*- coding: ascii -*-
+"""
+    MoinMoin - metadata codec for fs based backends
+
+    A compact binary format for metadata dicts, replacing pickle.
+
+    A record is the MAGIC (including the format version), followed by the
+    number of fields and the fields. A field is the key (a KEYS index + 1 for
+    well-known keys, 0 followed by the encoded key for others), the type
+    (one char) and the payload length, followed by the payload. As all
+    payloads are length-prefixed, a decoder can skip the fields it does not
+    need (see loads keys parameter) without decoding them.
+
+    Values are encoded recursively with the same type chars:
+     - 'N' None, 'T' True, 'F' False (empty payload)
+     - 'i' int / long (zigzag varint), 'f' float (IEEE 754 double)
+     - 's' str, 'u' unicode (utf-8)
+     - 'l' list, 't' tuple, 'd' dict: item count, then the items
+       (each: type, length, payload; dicts: key, value, key, value, ...)
+     - 'p' any other type (pickle)
+
+    Data not starting with MAGIC is unpickled, so metadata stored by older
+    versions can still be read (and gets converted when rewritten).
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import struct
+import cPickle as pickle
+
+# a pickle (protocol 0..2) never starts with a NUL byte
+MAGIC = '\0MM\1'
+
+PICKLEPROTOCOL = 1
+
+# well-known keys, stored as index into this list.
+# NEVER change or remove entries, only append new ones!
+KEYS = [
+    '__timestamp', 'sha1', 'uuid', 'name', 'name_old', 'reverted_to', 'acl',
+    'is_syspage', 'syspage_version', 'usergroup', 'somedict', 'mimetype',
+    'size', 'language', 'itemlinks', 'itemtransclusions', 'tags', 'action',
+    'address', 'hostname', 'userid', 'extra', 'comment',
+    # user profiles
+    'email', 'openid', 'aliasname', 'enc_password', 'disabled', 'css_url',
+    'edit_rows', 'locale', 'timezone', 'theme_name', 'subscribed_items',
+    'quicklinks', 'bookmarks', 'recoverpass_key',
+    # fs2 revisions stored as delta
+    '__delta', '__size',
+]
+KEY_IDS = dict((key, index + 1) for index, key in enumerate(KEYS))
+
+
+def encode_varint(value):
+    """
+    encode an int >= 0 (7 bits per byte, high bit set: more bytes follow)
+    """
+    result = []
+    while value >= 0x80:
+        result.append(chr(value & 0x7f | 0x80))
+        value = value >> 7
+    result.append(chr(value))
+    return ''.join(result)
+
+
+def decode_varint(data, pos):
+    """
+    decode the varint at data[pos:], return (value, position after it)
+    """
+    value = shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def _encode_item(value):
+    """
+    encode value as type char, payload length and payload
+    """
+    type_, payload = _encode_value(value)
+    return type_ + encode_varint(len(payload)) + payload
+
+
+def _encode_value(value):
+    """
+    return (type char, payload) for value
+    """
+    t = type(value)
+    if value is None:
+        return 'N', ''
+    elif t is bool:
+        return value and 'T' or 'F', ''
+    elif t is int or t is long:
+        # zigzag encoding, so small negative numbers are small, too
+        return 'i', encode_varint(value < 0 and (-value << 1) - 1 or value << 1)
+    elif t is float:
+        return 'f', struct.pack('!d', value)
+    elif t is str:
+        return 's', value
+    elif t is unicode:
+        return 'u', value.encode('utf-8')
+    elif t is list or t is tuple:
+        return t is list and 'l' or 't', encode_varint(len(value)) + ''.join([_encode_item(v) for v in value])
+    elif t is dict:
+        items = []
+        for k, v in value.iteritems():
+            items.append(_encode_item(k))
+            items.append(_encode_item(v))
+        return 'd', encode_varint(len(value)) + ''.join(items)
+    else:
+        return 'p', pickle.dumps(value, protocol=PICKLEPROTOCOL)
+
+
+def _decode_items(data, pos, count):
+    """
+    decode <count> items (type, length, payload) starting at data[pos:]
+    """
+    values = []
+    for i in xrange(count):
+        type_ = data[pos]
+        length, pos = decode_varint(data, pos + 1)
+        values.append(_decode_value(type_, data, pos, pos + length))
+        pos += length
+    return values
+
+
+def _decode_value(type_, data, start, end):
+    """
+    decode the payload data[start:end] of type <type_>
+    """
+    if type_ == 's':
+        return data[start:end]
+    elif type_ == 'u':
+        return data[start:end].decode('utf-8')
+    elif type_ == 'i':
+        value = decode_varint(data, start)[0]
+        return value & 1 and -((value + 1) >> 1) or value >> 1
+    elif type_ == 'N':
+        return None
+    elif type_ == 'T':
+        return True
+    elif type_ == 'F':
+        return False
+    elif type_ == 'f':
+        return struct.unpack('!d', data[start:end])[0]
+    elif type_ in 'ltd':
+        count, pos = decode_varint(data, start)
+        if type_ == 'd':
+            values = _decode_items(data, pos, 2 * count)
+            return dict(zip(values[::2], values[1::2]))
+        values = _decode_items(data, pos, count)
+        if type_ == 't':
+            return tuple(values)
+        return values
+    elif type_ == 'p':
+        return pickle.loads(data[start:end])
+    raise ValueError("invalid metadata type %r" % type_)
+
+
+def dumps(metadata):
+    """
+    encode the metadata dict <metadata>
+    """
+    fields = [MAGIC, encode_varint(len(metadata))]
+    for key, value in metadata.iteritems():
+        key_id = type(key) is str and KEY_IDS.get(key)
+        if key_id:
+            fields.append(encode_varint(key_id))
+        else:
+            fields.append('\0' + _encode_item(key))
+        fields.append(_encode_item(value))
+    return ''.join(fields)
+
+
+def loads(data, keys=None):
+    """
+    decode metadata encoded by dumps (or pickled, for older metadata)
+
+    @param data: encoded metadata (str)
+    @param keys: if given, only decode the values of these keys
+    @return: metadata dict
+    """
+    if not data.startswith(MAGIC):
+        metadata = pickle.loads(data)
+        if keys is not None:
+            metadata = dict((key, metadata[key]) for key in keys if key in metadata)
+        return metadata
+    if keys is not None:
+        keys = set(keys)
+    metadata = {}
+    count, pos = decode_varint(data, len(MAGIC))
+    for i in xrange(count):
+        key_id, pos = decode_varint(data, pos)
+        if key_id:
+            key = KEYS[key_id - 1]
+        else:
+            type_ = data[pos]
+            length, pos = decode_varint(data, pos + 1)
+            key = _decode_value(type_, data, pos, pos + length)
+            pos += length
+        type_ = data[pos]
+        length, pos = decode_varint(data, pos + 1)
+        if keys is None or key in keys:
+            metadata[key] = _decode_value(type_, data, pos, pos + length)
+        pos += length
+    return metadata
+
+
+def is_pickle(data):
+    """
+    True if <data> is metadata in the old (pickle) format
+    """
+    return not data.startswith(MAGIC)
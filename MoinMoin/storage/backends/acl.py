@@ -33,6 +33,11 @@
 
     All wrapped classes must, of course, adhere to the normal storage API.
 
+    Permission checks are cached: ACL decisions are remembered for the duration
+    of a request (the cache is dropped when an item is changed via the AMW) and
+    item ACLs are read from the index (if the AMW was given one), which keeps
+    them cached across requests. Parsed ACLs are cached by their ACL strings.
+
     @copyright: 2003-2010 MoinMoin:ThomasWaldmann,
                 2000-2004 Juergen Hermann <jh@web.de>,
                 2003 Gustavo Niemeyer,
@@ -49,7 +54,7 @@ from flask import current_app as app
 from flask import flaskg
 
 from MoinMoin.items import ACL
-from MoinMoin.security import AccessControlList
+from MoinMoin.security import AccessControlList, get_acl_cache
 
 from MoinMoin.storage import Item, NewRevision, StoredRevision
 from MoinMoin.storage.error import NoSuchItemError, NoSuchRevisionError, AccessDeniedError
@@ -68,7 +73,8 @@ class AclWrapperBackend(object):
     implementor may decide to use his own helper functions which the items and revisions
     will still try to call).
     """
-    def __init__(self, cfg, backend, hierarchic=False, before=u"", default=u"", after=u"", valid=None):
+    def __init__(self, cfg, backend, hierarchic=False, before=u"", default=u"", after=u"", valid=None,
+                 index=None, mountpoint=u""):
         """
         @type backend: Some object that implements the storage API.
         @param backend: The unprotected backend that we want to protect.
@@ -83,6 +89,12 @@ class AclWrapperBackend(object):
         @type valid: list of strings or None
         @param valid: If a list is given, only strings in the list are treated as valid acl privilege descriptors.
                       If None is give, the global wiki default is used.
+        @type index: ItemIndex or None
+        @param index: If given, the item ACLs are taken from this index (if it
+                      knows the item, otherwise from the backend).
+        @type mountpoint: unicode
+        @param mountpoint: The mountpoint of the backend (the index uses fully
+                           qualified item names).
         """
         self.cfg = cfg
         self.backend = backend
@@ -91,6 +103,9 @@ class AclWrapperBackend(object):
         self.before = AccessControlList(cfg, [before], default=default, valid=valid)
         self.default = AccessControlList(cfg, [default], default=default, valid=valid)
         self.after = AccessControlList(cfg, [after], default=default, valid=valid)
+        self.index = index
+        self.mountpoint = mountpoint.rstrip('/')
+        self._parsed_acls = {} # acl strings -> AccessControlList
 
     def __getattr__(self, attr):
         # Attributes that this backend does not define itself are just looked
@@ -160,26 +175,96 @@ class AclWrapperBackend(object):
                 revision = AclWrapperRevision(revision, item)
                 yield revision
 
-    def _get_acl(self, itemname):
+    def _get_acl_strings(self, itemname):
         """
-        Get ACL strings from the last revision's metadata and return ACL object.
+        Get ACL strings from the last revision's metadata (via the index, if
+        it knows the item), return None if there are none.
+
+        They are cached for the current request (together with the ACL
+        decisions, see _get_decisions), as checking a right usually needs
+        the ACLs of the item and its parents several times.
         """
+        cache = self._get_decisions()
+        key = (id(self), itemname)
+        try:
+            return cache[key]
+        except KeyError:
+            acls = cache[key] = self._uncached_get_acl_strings(itemname)
+            return acls
+
+    def _uncached_get_acl_strings(self, itemname):
+        if self.index is not None:
+            index_name = self.mountpoint and self.mountpoint + '/' + itemname or itemname
+            try:
+                return self.index.get_acl(index_name)
+            except KeyError:
+                # item not in the index, ask the backend
+                pass
         try:
             item = self.backend.get_item(itemname)
             # we always use the ACLs set on the latest revision:
             current_rev = item.get_revision(-1)
-            acls = current_rev[ACL]
+            return current_rev[ACL]
         except (NoSuchItemError, NoSuchRevisionError, KeyError):
+            return None
+
+    def _get_acl(self, itemname):
+        """
+        Get ACL strings from the last revision's metadata and return ACL object.
+        """
+        acls = self._get_acl_strings(itemname)
+        if acls is None:
             # do not use default acl here
             acls = []
         if not isinstance(acls, (tuple, list)):
             acls = (acls, )
-        default = self.default.default
-        return AccessControlList(self.cfg, acls, default=default, valid=self.valid)
+        acls = tuple(acls)
+        try:
+            return self._parsed_acls[acls]
+        except KeyError:
+            default = self.default.default
+            acl = AccessControlList(self.cfg, acls, default=default, valid=self.valid)
+            self._parsed_acls[acls] = acl
+            return acl
+
+    def _get_decisions(self):
+        """
+        Get the ACL decision cache of the current request, a dict
+        (id(AMW), username, auth_method, itemname, right) -> bool.
+        It also holds the ACL strings, (id(AMW), itemname) -> acl strings.
+        """
+        return get_acl_cache()
+
+    def _changed(self):
+        """
+        Invalidate cached ACL decisions after an item was changed.
+        """
+        self._get_decisions().clear()
 
     def _may(self, itemname, right):
         """ Check if self.username may have <right> access on item <itemname>.
 
+        Decisions are cached for the current request, see _uncached_may.
+
+        @param itemname: item to get permissions from
+        @param right: the right to check
+
+        @rtype: bool
+        @return: True if you have permission or False
+        """
+        user = flaskg.user
+        # the decision also depends on the authentication method (Trusted)
+        key = (id(self), user.name, getattr(user, 'auth_method', None), itemname, right)
+        decisions = self._get_decisions()
+        try:
+            return decisions[key]
+        except KeyError:
+            allowed = decisions[key] = self._uncached_may(itemname, right)
+            return allowed
+
+    def _uncached_may(self, itemname, right):
+        """ Check if self.username may have <right> access on item <itemname>.
+
         For hierarchic=False we just check the item in question.
 
         For hierarchic=True, we check each item in the hierarchy. We
@@ -194,55 +279,43 @@ class AclWrapperBackend(object):
         `default` is only used if there is no ACL on the item (and none on
         any of the item's parents when using hierarchic.)
 
+        The ACLs are evaluated for all rights at once (see
+        AccessControlList.rights), so checking other rights or items with the
+        same ACL does not need to evaluate them again.
+
         @param itemname: item to get permissions from
         @param right: the right to check
 
         @rtype: bool
         @return: True if you have permission or False
         """
-        username = flaskg.user.name
-
-        allowed = self.before.may(username, right)
-        if allowed is not None:
-            return allowed
-
         if self.hierarchic:
             items = itemname.split('/') # create item hierarchy list
-            some_acl = False
+            acl = self.default
             for i in range(len(items), 0, -1):
                 # Create the next pagename in the hierarchy
                 # starting at the leaf, going to the root
                 name = '/'.join(items[:i])
-                acl = self._get_acl(name)
-                if acl.has_acl():
-                    some_acl = True
-                    allowed = acl.may(username, right)
-                    if allowed is not None:
-                        return allowed
+                item_acl = self._get_acl(name)
+                if item_acl.has_acl():
                     # If the item has an acl (even one that doesn't match) we *do not*
                     # check the parents. We only check the parents if there's no acl on
                     # the item at all.
+                    acl = item_acl
                     break
-            if not some_acl:
-                allowed = self.default.may(username, right)
-                if allowed is not None:
-                    return allowed
         else:
             acl = self._get_acl(itemname)
-            if acl.has_acl():
-                allowed = acl.may(username, right)
-                if allowed is not None:
-                    return allowed
-            else:
-                allowed = self.default.may(username, right)
-                if allowed is not None:
-                    return allowed
-
-        allowed = self.after.may(username, right)
-        if allowed is not None:
-            return allowed
+            if not acl.has_acl():
+                acl = self.default
 
-        return False
+        username = flaskg.user.name
+        decided = granted = 0
+        for layer in [self.before, acl, self.after, ]:
+            acl_decided, acl_granted = layer.rights(username)
+            new = acl_decided & ~decided
+            granted |= acl_granted & new
+            decided |= new
+        return bool(granted & self.before.right_bits.get(right, 0))
 
 
 class AclWrapperItem(Item):
@@ -261,6 +334,7 @@ class AclWrapperItem(Item):
         self._backend = aclbackend
         self._item = item
         self._may = aclbackend._may
+        self._changed = aclbackend._changed
 
     @property
     def name(self):
@@ -379,14 +453,20 @@ class AclWrapperItem(Item):
             raise AccessDeniedError(username, CREATE, newname)
         if not self._may(newname, WRITE):
             raise AccessDeniedError(username, WRITE, newname)
-        return self._item.rename(newname)
+        try:
+            return self._item.rename(newname)
+        finally:
+            self._changed()
 
     @require_privilege(WRITE)
     def commit(self):
         """
         @see: Item.commit.__doc__
         """
-        return self._item.commit()
+        try:
+            return self._item.commit()
+        finally:
+            self._changed()
 
     # This does not require a privilege as the item must have been obtained
     # by either get_item or create_item already, which already check permissions.
@@ -403,7 +483,10 @@ class AclWrapperItem(Item):
 
         @see: Item.destroy.__doc__
         """
-        return self._item.destroy()
+        try:
+            return self._item.destroy()
+        finally:
+            self._changed()
 
     @require_privilege(WRITE)
     def create_revision(self, revno):
@@ -530,7 +613,10 @@ class AclWrapperRevision(object, DictMixin):
         if not self._may(self._item.name, DESTROY):
             username = flaskg.user.name
             raise AccessDeniedError(username, DESTROY + " revisions of", self._item.name)
-        return self._revision.destroy()
+        try:
+            return self._revision.destroy()
+        finally:
+            self._item._changed()
 
     def write(self, data):
         """
@@ -4,13 +4,17 @@
     XXX: Does NOT work on win32. some problems are documented below (see XXX),
          some are maybe NOT.
 
+    XXX: Revisions with the same data do not share it (like in the fs2 and
+         sqla backends), each revision file holds its metadata and its data.
+         Sharing would need a new storage format, it is deferred to that.
+
     @copyright: 2008 MoinMoin:JohannesBerg,
                 2009-2010 MoinMoin:ThomasWaldmann
     @license: GNU GPL, see COPYING for details.
 """
 
-import os, struct, tempfile, random, errno, shutil
-import cPickle as pickle
+import os, struct, tempfile, random, errno, shutil, copy
+from threading import Lock
 
 from MoinMoin import log
 logging = log.getLogger(__name__)
@@ -22,18 +26,342 @@ except ImportError:
 
 from MoinMoin.util.lock import ExclusiveLock
 from MoinMoin.util import filesys
+from MoinMoin.util.lru import LRUDict
+from MoinMoin.storage.backends import _metacodec as metacodec
 
 from MoinMoin.storage import Backend as BackendBase
 from MoinMoin.storage import Item as ItemBase
 from MoinMoin.storage import StoredRevision as StoredRevisionBase
 from MoinMoin.storage import NewRevision as NewRevisionBase
 
-from MoinMoin.storage.error import NoSuchItemError, NoSuchRevisionError, \
+from MoinMoin.storage.error import BackendError, NoSuchItemError, NoSuchRevisionError, \
                                    ItemAlreadyExistsError, \
                                    RevisionAlreadyExistsError, RevisionNumberMismatchError, \
                                    CouldNotDestroyError
 
-PICKLEPROTOCOL = 1
+
+class FilePool(object):
+    """
+    Process-wide pool of open (read-only) revision files.
+
+    Revisions do not keep their file open, they only take a file from the
+    pool while reading from it. At most <size> idle files are kept open,
+    the least recently used ones are closed first.
+
+    Files are keyed by (path, inode): a revision file can only be replaced
+    by destroying it and creating a new one, which gets a new inode as
+    long as we have the old one open.
+    """
+    def __init__(self, size=64):
+        self.size = size
+        self._files = LRUDict() # (path, inode) -> list of idle files
+        self._count = 0 # number of idle files
+        self._lock = Lock()
+
+    def acquire(self, path, inode):
+        """
+        return an open file for <path> (with <inode>), give it back with release
+        """
+        with self._lock:
+            files = self._files.get((path, inode))
+            if files:
+                self._count -= 1
+                f = files.pop()
+                if not files:
+                    del self._files[(path, inode)]
+                return f
+        f = open(path, 'rb')
+        if os.fstat(f.fileno()).st_ino != inode:
+            f.close()
+            raise NoSuchRevisionError("Revision file %r was replaced." % path)
+        return f
+
+    def release(self, path, inode, f):
+        with self._lock:
+            files = self._files.pop((path, inode), [])
+            files.append(f)
+            self._files[(path, inode)] = files # most recently used
+            self._count += 1
+            while self._count > self.size:
+                key, files = self._files.popitem() # least recently used
+                self._count -= len(files)
+                for f in files:
+                    f.close()
+
+    def discard(self, prefix):
+        """
+        close the idle files with a path starting with <prefix>
+        """
+        with self._lock:
+            for key in self._files.keys():
+                if key[0].startswith(prefix):
+                    files = self._files.pop(key)
+                    self._count -= len(files)
+                    for f in files:
+                        f.close()
+
+file_pool = FilePool()
+
+
+class MetadataCache(object):
+    """
+    Process-wide cache of decoded revision metadata,
+    (absolute revision file path, inode, mtime, size) -> (data start, metadata dict).
+
+    The key must identify the revision file: item ids are only unique per
+    backend (and get reused after destroying an item), and there may be
+    several FSBackends in a process.
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self._entries = LRUDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry # most recently used
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem() # least recently used
+
+metadata_cache = MetadataCache()
+
+
+class NameLog(object):
+    """
+    Name -> item id mapping of a FSBackend, kept in an append-only log file.
+
+    Every change of the mapping (add, rename, destroy) appends one record to
+    the log, so the costs of a change do not depend on the number of items.
+    Readers keep the mapping in memory and only read the records appended
+    since the last lookup. If the log has much more records than names, it
+    is compacted (rewritten with one record per name and renamed into place),
+    readers notice this by the changed inode and reload the whole log.
+
+    All changes must be done while holding the name-mapping.lock of the
+    backend, the instances are shared by all backends using the same path
+    (see get_name_log).
+
+    Record format: op (1 byte), key length, value length (4 bytes each,
+    network byte order), key, value. Ops:
+     - 'A': add item, key is the name, value the item id
+     - 'R': rename item, key is the new name, value the old name
+     - 'D': destroy item, key is the name
+    An incomplete record at the end of the log (from a crashed writer) is
+    ignored and truncated by the next writer.
+    """
+    MAGIC = 'MoinNameLog1\n'
+    HEADER = '!cLL'
+    HEADER_SIZE = struct.calcsize(HEADER)
+    # compact if there are more than COMPACT_MIN records and less than
+    # 1 / COMPACT_RATIO of them are needed
+    COMPACT_MIN = 1000
+    COMPACT_RATIO = 2
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        self._records = 0
+        self._names = {}
+
+    def _reset(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._inode = None
+        self._offset = 0
+        self._records = 0
+        self._names = {}
+
+    def _refresh(self):
+        """
+        bring the in-memory mapping up to date with the log file,
+        call this with self._lock held.
+        """
+        try:
+            st = os.stat(self.path)
+        except OSError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            self._reset()
+            return
+        inode = (st.st_dev, st.st_ino)
+        if inode != self._inode:
+            # new (compacted) log file
+            self._reset()
+            self._file = open(self.path, 'rb')
+            self._inode = inode
+            magic = self._file.read(len(self.MAGIC))
+            if magic != self.MAGIC:
+                self._reset()
+                raise BackendError("%s is not a name log" % self.path)
+            self._offset = len(self.MAGIC)
+        if st.st_size <= self._offset:
+            return
+        f = self._file
+        f.seek(self._offset)
+        data = f.read(st.st_size - self._offset)
+        names = self._names
+        pos = 0
+        while pos + self.HEADER_SIZE <= len(data):
+            op, keylen, valuelen = struct.unpack(self.HEADER, data[pos:pos+self.HEADER_SIZE])
+            end = pos + self.HEADER_SIZE + keylen + valuelen
+            if end > len(data):
+                break
+            key = data[pos+self.HEADER_SIZE:pos+self.HEADER_SIZE+keylen]
+            value = data[pos+self.HEADER_SIZE+keylen:end]
+            if op == 'A':
+                names[key] = value
+            elif op == 'R':
+                names[key] = names.pop(value)
+            elif op == 'D':
+                names.pop(key, None)
+            else:
+                raise BackendError("%s: invalid name log record at offset %d" % (self.path, self._offset + pos))
+            self._records += 1
+            pos = end
+        self._offset += pos
+
+    def get(self, name):
+        """
+        return the item id of item <name> (utf-8 str) or None
+        """
+        self._lock.acquire()
+        try:
+            self._refresh()
+            return self._names.get(name)
+        finally:
+            self._lock.release()
+
+    def items(self):
+        """
+        return a list of (name, item id) of all items
+        """
+        self._lock.acquire()
+        try:
+            self._refresh()
+            return self._names.items()
+        finally:
+            self._lock.release()
+
+    def create(self, names=None):
+        """
+        write a new log containing <names> (dict name -> item id) if there
+        is no log yet. Call this with the name-mapping.lock held.
+        """
+        if not os.path.exists(self.path):
+            self._write(names or {})
+
+    def _write(self, names):
+        tmp = self.path + '.tmp'
+        f = open(tmp, 'wb')
+        try:
+            f.write(self.MAGIC)
+            f.write(''.join([self._record('A', name, item_id) for name, item_id in names.iteritems()]))
+        finally:
+            f.close()
+        filesys.rename(tmp, self.path)
+
+    def _record(self, op, key, value=''):
+        return struct.pack(self.HEADER, op, len(key), len(value)) + key + value
+
+    def _append(self, records):
+        """
+        append <records> to the log. Call this with the name-mapping.lock and
+        self._lock held and the mapping refreshed.
+        """
+        f = open(self.path, 'r+b')
+        try:
+            # drop an incomplete record left by a crashed writer
+            f.truncate(self._offset)
+            f.seek(self._offset)
+            f.write(''.join(records))
+        finally:
+            f.close()
+        self._refresh()
+        if (self._records > self.COMPACT_MIN and
+            self._records > self.COMPACT_RATIO * len(self._names)):
+            self._write(self._names)
+            self._refresh()
+
+    def change(self, fn):
+        """
+        call fn(names) with the up to date mapping (do not modify it), fn
+        returns a list of records to append. Call this with the name-mapping.lock
+        held.
+        """
+        self._lock.acquire()
+        try:
+            self._refresh()
+            records = fn(self._names)
+            if records:
+                self._append(records)
+        finally:
+            self._lock.release()
+
+    def add(self, name, item_id):
+        """
+        add item <name> with <item_id>, raise ItemAlreadyExistsError if the name
+        is taken. Call this with the name-mapping.lock held.
+        """
+        def fn(names):
+            if name in names:
+                raise ItemAlreadyExistsError("Item '%r' already exists!" % name.decode('utf-8'))
+            return [self._record('A', name, item_id)]
+        self.change(fn)
+
+    def rename(self, oldname, newname, item_id):
+        """
+        rename item <oldname> (with <item_id>) to <newname>, raise
+        ItemAlreadyExistsError if the new name is taken. Call this with the
+        name-mapping.lock held.
+        """
+        def fn(names):
+            if names.get(oldname) != item_id:
+                raise NoSuchItemError("No such item '%r'." % oldname.decode('utf-8'))
+            if newname in names:
+                raise ItemAlreadyExistsError("Target item '%r' already exists!" % newname.decode('utf-8'))
+            return [self._record('R', newname, oldname)]
+        self.change(fn)
+
+    def remove(self, name, item_id):
+        """
+        remove item <name> (with <item_id>). Call this with the name-mapping.lock
+        held.
+        """
+        def fn(names):
+            if names.get(name) == item_id:
+                return [self._record('D', name)]
+        self.change(fn)
+
+
+_name_logs = {}
+_name_logs_lock = Lock()
+
+def get_name_log(path):
+    """
+    return the (per process) NameLog instance for the log at <path>
+    """
+    path = os.path.abspath(path)
+    _name_logs_lock.acquire()
+    try:
+        try:
+            return _name_logs[path]
+        except KeyError:
+            name_log = _name_logs[path] = NameLog(path)
+            return name_log
+    finally:
+        _name_logs_lock.release()
 
 
 class Item(ItemBase):
@@ -64,7 +392,7 @@ class FSBackend(BackendBase):
                                         at byte 512 in the file by default.
         """
         self._path = path
-        self._name_db = os.path.join(path, 'name-mapping')
+        self._name_log = get_name_log(os.path.join(path, 'name-log'))
         self._itemspace = 128
         self._revmeta_reserved_space = reserved_metadata_space
 
@@ -74,19 +402,26 @@ class FSBackend(BackendBase):
             if err.errno != errno.EEXIST:
                 raise BackendError(str(err))
 
-        # if no name-mapping db yet, create an empty one
+        # if no name-mapping log yet, create an empty one
         # (under lock, re-tests existence too)
-        if not os.path.exists(self._name_db):
-            self._do_locked(self._name_db + '.lock', self._create_new_cdb, None)
+        if not os.path.exists(self._name_log.path):
+            self._do_locked(os.path.join(self._path, 'name-mapping.lock'), self._create_name_log, None)
 
-    def _create_new_cdb(self, arg):
+    def _create_name_log(self, arg):
         """
-        Create new name-mapping if it doesn't exist yet,
-        call this under the name-mapping.lock.
+        Create new name-mapping log if it doesn't exist yet, converting the
+        name-mapping CDB used by older versions if there is one.
+        Call this under the name-mapping.lock.
         """
-        if not os.path.exists(self._name_db):
-            maker = cdb.cdbmake(self._name_db, self._name_db + '.tmp')
-            maker.finish()
+        names = {}
+        name_db = os.path.join(self._path, 'name-mapping')
+        if os.path.exists(name_db) and not os.path.exists(self._name_log.path):
+            c = cdb.init(name_db)
+            r = c.each()
+            while r:
+                names[r[0]] = r[1]
+                r = c.each()
+        self._name_log.create(names)
 
     def _get_item_id(self, itemname):
         """
@@ -94,8 +429,7 @@ class FSBackend(BackendBase):
 
         @param itemname: name of item (unicode)
         """
-        c = cdb.init(self._name_db)
-        return c.get(itemname.encode('utf-8'))
+        return self._name_log.get(itemname.encode('utf-8'))
 
     def get_item(self, itemname):
         item_id = self._get_item_id(itemname)
@@ -125,13 +459,10 @@ class FSBackend(BackendBase):
         return item
 
     def iteritems(self):
-        c = cdb.init(self._name_db)
-        r = c.each()
-        while r:
-            item = Item(self, r[0].decode('utf-8'))
-            item._fs_item_id = r[1]
+        for name, item_id in self._name_log.items():
+            item = Item(self, name.decode('utf-8'))
+            item._fs_item_id = item_id
             yield item
-            r = c.each()
 
     def _get_revision(self, item, revno):
         item_id = item._fs_item_id
@@ -148,7 +479,10 @@ class FSBackend(BackendBase):
 
         rev = StoredRevision(item, revno)
         rev._fs_revpath = revpath
-        rev._fs_file = None
+        rev._fs_inode = None
+        rev._fs_datastart = None
+        rev._fs_size = None
+        rev._fs_position = 0
         rev._fs_metadata = None
 
         return rev
@@ -185,8 +519,7 @@ class FSBackend(BackendBase):
         return rev
 
     def _destroy_revision(self, revision):
-        if revision._fs_file is not None:
-            revision._fs_file.close()
+        file_pool.discard(revision._fs_revpath)
         try:
             os.unlink(revision._fs_revpath)
         except OSError, err:
@@ -211,21 +544,7 @@ class FSBackend(BackendBase):
         nn = newname.encode('utf-8')
         npath = os.path.join(self._path, item._fs_item_id, 'name')
 
-        c = cdb.init(self._name_db)
-        maker = cdb.cdbmake(self._name_db + '.ndb', self._name_db + '.tmp')
-        r = c.each()
-        while r:
-            i, v = r
-            if i == nn:
-                raise ItemAlreadyExistsError("Target item '%r' already exists!" % newname)
-            elif v == item._fs_item_id:
-                maker.add(nn, v)
-            else:
-                maker.add(i, v)
-            r = c.each()
-        maker.finish()
-
-        filesys.rename(self._name_db + '.ndb', self._name_db)
+        self._name_log.rename(item.name.encode('utf-8'), nn, item._fs_item_id)
         nf = open(npath, mode='wb')
         nf.write(nn)
         nf.close()
@@ -260,24 +579,12 @@ class FSBackend(BackendBase):
 
         nn = item.name.encode('utf-8')
 
-        c = cdb.init(self._name_db)
-        maker = cdb.cdbmake(self._name_db + '.ndb', self._name_db + '.tmp')
-        r = c.each()
-        while r:
-            i, v = r
-            if i == nn:
-                # Oops. This item already exists! Clean up and error out.
-                maker.finish()
-                os.unlink(self._name_db + '.ndb')
-                os.rmdir(ipath)
-                if newrev is not None:
-                    os.unlink(newrev)
-                raise ItemAlreadyExistsError("Item '%r' already exists!" % item.name)
-            else:
-                maker.add(i, v)
-            r = c.each()
-        maker.add(nn, itemid)
-        maker.finish()
+        if self._name_log.get(nn) is not None:
+            # Oops. This item already exists! Clean up and error out.
+            os.rmdir(ipath)
+            if newrev is not None:
+                os.unlink(newrev)
+            raise ItemAlreadyExistsError("Item '%r' already exists!" % item.name)
 
         if newrev is not None:
             rp = os.path.join(self._path, itemid, 'rev.0')
@@ -287,7 +594,7 @@ class FSBackend(BackendBase):
             # only write metadata file if we have any
             meta = os.path.join(self._path, itemid, 'meta')
             f = open(meta, 'wb')
-            pickle.dump(metadata, f, protocol=PICKLEPROTOCOL)
+            f.write(metacodec.dumps(metadata))
             f.close()
 
         # write 'name' file of item
@@ -296,8 +603,8 @@ class FSBackend(BackendBase):
         nf.write(nn)
         nf.close()
 
-        # make item retrievable (by putting the name-mapping in place)
-        filesys.rename(self._name_db + '.ndb', self._name_db)
+        # make item retrievable (by adding it to the name-mapping)
+        self._name_log.add(nn, itemid)
 
         item._fs_item_id = itemid
 
@@ -323,7 +630,7 @@ class FSBackend(BackendBase):
         item = rev.item
         metadata = {'__timestamp': rev.timestamp}
         metadata.update(rev)
-        md = pickle.dumps(metadata, protocol=PICKLEPROTOCOL)
+        md = metacodec.dumps(metadata)
 
         hasdata = rev._fs_file.tell() > self._revmeta_reserved_space + 4
 
@@ -365,18 +672,9 @@ class FSBackend(BackendBase):
         os.unlink(rev._fs_revpath)
 
     def _destroy_item_locked(self, item):
-        c = cdb.init(self._name_db)
-        maker = cdb.cdbmake(self._name_db + '.ndb', self._name_db + '.tmp')
-        r = c.each()
-        while r:
-            i, v = r
-            if v != item._fs_item_id:
-                maker.add(i, v)
-            r = c.each()
-        maker.finish()
-
-        filesys.rename(self._name_db + '.ndb', self._name_db)
+        self._name_log.remove(item.name.encode('utf-8'), item._fs_item_id)
         path = os.path.join(self._path, item._fs_item_id)
+        file_pool.discard(path + os.sep)
         try:
             shutil.rmtree(path)
         except OSError, err:
@@ -387,6 +685,83 @@ class FSBackend(BackendBase):
         self._do_locked(os.path.join(self._path, 'name-mapping.lock'),
                         self._destroy_item_locked, item)
 
+    def convert_metadata(self):
+        """
+        Convert item and revision metadata stored by older versions (pickles)
+        to the current metadata format (see _metacodec).
+
+        This can be done while the backend is in use: item metadata files are
+        converted while holding the item metadata lock, revision files are
+        replaced by a converted copy (with the same data, maybe at another
+        offset). Readers notice a replaced revision file (by its inode) and
+        read its metadata again (see _get_revision_metadata and
+        _read_revision_data).
+
+        @return: number of converted files
+        """
+        count = 0
+        for item in self.iteritems():
+            item_path = os.path.join(self._path, item._fs_item_id)
+            self._change_item_metadata(item)
+            try:
+                count += self._convert_item_metadata(os.path.join(item_path, 'meta'))
+            finally:
+                item._fs_metadata_lock.release()
+                del item._fs_metadata_lock
+            for revno in self._list_revisions(item):
+                count += self._convert_revision_metadata(os.path.join(item_path, 'rev.%d' % revno))
+        return count
+
+    def _convert_item_metadata(self, path):
+        try:
+            f = open(path, 'rb')
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return 0
+        try:
+            md = f.read()
+        finally:
+            f.close()
+        if not metacodec.is_pickle(md):
+            return 0
+        tmp = path + '.tmp'
+        f = open(tmp, 'wb')
+        f.write(metacodec.dumps(metacodec.loads(md)))
+        f.close()
+        filesys.rename(tmp, path)
+        return 1
+
+    def _convert_revision_metadata(self, path):
+        try:
+            f = open(path, 'rb')
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return 0
+        try:
+            datastart = struct.unpack('!L', f.read(4))[0]
+            md = f.read(datastart - 4)
+            if not metacodec.is_pickle(md):
+                return 0
+            md = metacodec.dumps(metacodec.loads(md))
+            # keep the data where it is if the metadata fits
+            newstart = max(datastart, len(md) + 4)
+            fd, tmp = tempfile.mkstemp('-rev', 'tmp-', self._path)
+            nf = os.fdopen(fd, 'wb')
+            try:
+                nf.write(struct.pack('!L', newstart))
+                nf.write(md)
+                nf.write('\0' * (newstart - 4 - len(md)))
+                f.seek(datastart)
+                shutil.copyfileobj(f, nf)
+            finally:
+                nf.close()
+        finally:
+            f.close()
+        filesys.rename(tmp, path)
+        return 1
+
     def _change_item_metadata(self, item):
         if not item._fs_item_id is None:
             lp = os.path.join(self._path, item._fs_item_id, 'meta.lock')
@@ -413,7 +788,7 @@ class FSBackend(BackendBase):
             else:
                 tmp = os.path.join(self._path, item._fs_item_id, 'meta.tmp')
                 f = open(tmp, 'wb')
-                pickle.dump(md, f, protocol=PICKLEPROTOCOL)
+                f.write(metacodec.dumps(md))
                 f.close()
 
                 filesys.rename(tmp, os.path.join(self._path, item._fs_item_id, 'meta'))
@@ -421,9 +796,22 @@ class FSBackend(BackendBase):
             del item._fs_metadata_lock
 
     def _read_revision_data(self, rev, chunksize):
-        if rev._fs_file is None:
+        if rev._fs_datastart is None:
             self._get_revision_metadata(rev)
-        return rev._fs_file.read(chunksize)
+        try:
+            f = file_pool.acquire(rev._fs_revpath, rev._fs_inode)
+        except NoSuchRevisionError:
+            # replaced by convert_metadata: same data, but it may start
+            # at another offset now
+            self._get_revision_metadata(rev)
+            f = file_pool.acquire(rev._fs_revpath, rev._fs_inode)
+        try:
+            f.seek(rev._fs_datastart + rev._fs_position)
+            data = f.read(chunksize)
+        finally:
+            file_pool.release(rev._fs_revpath, rev._fs_inode, f)
+        rev._fs_position += len(data)
+        return data
 
     def _write_revision_data(self, rev, data):
         rev._fs_file.write(data)
@@ -433,7 +821,7 @@ class FSBackend(BackendBase):
             p = os.path.join(self._path, item._fs_item_id, 'meta')
             try:
                 f = open(p, 'rb')
-                metadata = pickle.load(f)
+                metadata = metacodec.loads(f.read())
                 f.close()
             except IOError, err:
                 if err.errno != errno.ENOENT:
@@ -444,19 +832,35 @@ class FSBackend(BackendBase):
         return item._fs_metadata
 
     def _get_revision_metadata(self, rev):
-        if rev._fs_file is None:
-            rev._fs_file = f = open(rev._fs_revpath, 'rb+') # XXX keeps file open as long as rev exists
-                                                            # XXX further, this is easily triggered by accessing ANY
-                                                            # XXX revision metadata (e.g. the timestamp or size or ACL)
-            datastart = f.read(4)
-            datastart = struct.unpack('!L', datastart)[0]
-            rev._datastart = pos = datastart
-        else:
-            f = rev._fs_file
-            pos = f.tell()
-            f.seek(4)
-        rev._fs_metadata = pickle.load(f)
-        f.seek(pos)
+        retries = 3
+        while True:
+            st = os.stat(rev._fs_revpath)
+            key = (os.path.abspath(rev._fs_revpath), st.st_ino, st.st_mtime, st.st_size)
+            entry = metadata_cache.get(key)
+            if entry is not None:
+                break
+            try:
+                f = file_pool.acquire(rev._fs_revpath, st.st_ino)
+            except NoSuchRevisionError:
+                # replaced after the stat (see convert_metadata), stat again
+                retries -= 1
+                if not retries:
+                    raise
+                continue
+            try:
+                f.seek(0)
+                datastart = struct.unpack('!L', f.read(4))[0]
+                metadata = metacodec.loads(f.read(datastart - 4))
+            finally:
+                file_pool.release(rev._fs_revpath, st.st_ino, f)
+            entry = datastart, metadata
+            metadata_cache.put(key, entry)
+            break
+        rev._fs_inode = st.st_ino
+        rev._fs_datastart, metadata = entry
+        rev._fs_size = st.st_size - rev._fs_datastart
+        # the cached values (e.g. lists) must not be shared with the revision
+        rev._fs_metadata = copy.deepcopy(metadata)
         return rev._fs_metadata
 
     def _get_revision_timestamp(self, rev):
@@ -465,24 +869,22 @@ class FSBackend(BackendBase):
         return rev._fs_metadata['__timestamp']
 
     def _get_revision_size(self, rev):
-        if rev._fs_file is None:
+        if rev._fs_datastart is None:
             self._get_revision_metadata(rev)
-        return os.stat(rev._fs_revpath).st_size - rev._datastart
+        return rev._fs_size
 
     def _seek_revision_data(self, rev, position, mode):
-        if rev._fs_file is None:
+        if rev._fs_datastart is None:
             self._get_revision_metadata(rev)
 
         if mode == 0:
-            rev._fs_file.seek(position + rev._datastart, mode)
+            rev._fs_position = position
+        elif mode == 1:
+            rev._fs_position += position
         else:
-            rev._fs_file.seek(position, mode)
+            rev._fs_position = rev._fs_size + position
+        rev._fs_position = max(0, rev._fs_position)
 
     def _tell_revision_data(self, revision):
-        if revision._fs_file is None:
-            self._get_revision_metadata(revision)
-
-        pos = revision._fs_file.tell()
-        return pos - revision._datastart
-
+        return revision._fs_position
 
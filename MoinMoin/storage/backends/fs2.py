@@ -4,7 +4,9 @@
     Features:
     * store metadata and data separately
     * use uuids for item storage names
-    * uses content hash addressing for revision data storage
+    * uses content hash addressing for revision data storage (same content
+      is stored once, reference counted, see _blobstore)
+    * optionally stores text revisions as deltas to the previous revision
     * use sqlalchemy/sqlite (not cdb/self-made DBs like fs does)
 
     @copyright: 2008 MoinMoin:JohannesBerg ("fs2" is originally based on "fs" from JB),
@@ -12,10 +14,11 @@
     @license: GNU GPL, see COPYING for details.
 """
 
-import os, tempfile, errno, shutil
+import os, tempfile, errno, shutil, hashlib
 from uuid import uuid4 as make_uuid
+from StringIO import StringIO
+from threading import Lock
 
-import cPickle as pickle
 
 from flask import current_app as app
 
@@ -29,6 +32,10 @@ logging = log.getLogger(__name__)
 
 from MoinMoin.util.lock import ExclusiveLock
 from MoinMoin.util import filesys
+from MoinMoin.util.lru import LRUDict
+from MoinMoin.storage.backends import _metacodec as metacodec
+from MoinMoin.storage.backends._blobstore import FileBlobStore
+from MoinMoin.storage.backends._delta import make_delta, apply_delta
 
 from MoinMoin.storage import Backend as BackendBase
 from MoinMoin.storage import Item as ItemBase
@@ -40,13 +47,50 @@ from MoinMoin.storage.error import NoSuchItemError, NoSuchRevisionError, \
                                    RevisionAlreadyExistsError, RevisionNumberMismatchError, \
                                    CouldNotDestroyError
 
-PICKLEPROTOCOL = 1
-
 MAX_NAME_LEN = 500
-from MoinMoin.storage import HASH_ALGORITHM
+from MoinMoin.storage import HASH_ALGORITHM, MIMETYPE
 
 UUID_LEN = len(make_uuid().hex)
 
+# revision metadata of revisions stored as delta to the previous revision:
+DELTA = '__delta' # hash of the delta blob
+DATA_SIZE = '__size' # size of the revision data
+
+
+def data_blob(metadata):
+    """
+    hash of the blob with the data (or the delta, see DELTA) of a revision
+    """
+    return metadata.get(DELTA) or metadata[HASH_ALGORITHM]
+
+
+class TextCache(object):
+    """
+    Process-wide cache of reconstructed revision data (of revisions stored as
+    delta), (item id, revno, data hash) -> data. Committing a text revision
+    puts it here, too, as the next revision will be stored as delta to it.
+    """
+    def __init__(self, size=32):
+        self.size = size
+        self._entries = LRUDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.pop(key, None)
+            if data is not None:
+                self._entries[key] = data # most recently used
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = data
+            while len(self._entries) > self.size:
+                self._entries.popitem() # least recently used
+
+text_cache = TextCache()
+
 
 class Item(ItemBase):
     def __init__(self, backend, item_name, _fs_item_id=None, _fs_metadata=None, *args, **kw):
@@ -69,20 +113,24 @@ class StoredRevision(StoredRevisionBase):
         if not os.path.exists(self._fs_path_meta):
             raise NoSuchRevisionError("Item '%r' has no revision #%d." % (item.name, revno))
 
-    @cached_property
-    def _fs_metadata(self):
+    def _fs_load_metadata(self, keys=None):
         f = open(self._fs_path_meta, 'rb')
         try:
-            metadata = pickle.load(f)
-        except EOFError:
-            metadata = {}
-        f.close()
-        return metadata
+            data = f.read()
+        finally:
+            f.close()
+        if not data:
+            return {}
+        return metacodec.loads(data, keys)
+
+    @cached_property
+    def _fs_metadata(self):
+        return self._fs_load_metadata()
 
     @cached_property
     def _fs_path_data(self):
         data_hash = self._fs_metadata[HASH_ALGORITHM]
-        return self._backend._make_path('data', data_hash)
+        return self._backend._blobs.blob_path(data_hash)
 
 
 class NewRevision(NewRevisionBase):
@@ -102,13 +150,19 @@ class FS2Backend(BackendBase):
     """
     FS2 backend
     """
-    def __init__(self, path):
+    def __init__(self, path, delta_interval=0):
         """
         Initialise filesystem backend, creating initial files and some internal structures.
 
         @param path: storage path
+        @param delta_interval: if > 0, store text revisions as delta to the
+                               previous revision, except every delta_interval-th
+                               revision, which is stored completely (so at most
+                               delta_interval - 1 deltas need to be applied to
+                               read a revision). 0 disables storing deltas.
         """
         self._path = path
+        self._delta_interval = delta_interval
 
         # create <path>, meta data and revision content data storage subdirs
         meta_path = self._make_path('meta')
@@ -130,8 +184,16 @@ class FS2Backend(BackendBase):
                             Column('item_id', String(UUID_LEN), index=True, unique=True),
                         )
 
+        # revision content data, by content hash
+        self._blobs = FileBlobStore(data_path, metadata)
+        count_refs = not engine.has_table(self._blobs.ref_table.name)
+
         metadata.create_all()
 
+        if count_refs:
+            # storage created by a version without reference counting
+            self._blobs.recount(self._iter_data_hashes())
+
     def _make_path(self, *args):
         return os.path.join(self._path, *args)
 
@@ -225,15 +287,39 @@ class FS2Backend(BackendBase):
     def _destroy_revision(self, rev):
         self._close_revision_data(rev)
         try:
+            data_hash = data_blob(rev._fs_metadata)
+            self._store_completely(rev.item._fs_item_id, rev.revno + 1)
             os.unlink(rev._fs_path_meta)
-            # XXX do refcount data files and if zero, kill it
-            #os.unlink(rev._fs_path_data)
-        except OSError, err:
+        except (OSError, IOError), err:
             if err.errno != errno.ENOENT:
                 raise CouldNotDestroyError("Could not destroy revision #%d of item '%r' [errno: %d]" % (
                     rev.revno, rev.item.name, err.errno))
             #else:
             #    someone else already killed this revision, we silently ignore this error
+        else:
+            self._blobs.remove(data_hash)
+
+    def _iter_data_hashes(self):
+        """
+        yield the data hash of every revision (of all items)
+        """
+        for item in self.iteritems():
+            for revno in self._list_revisions(item):
+                try:
+                    yield data_blob(self._get_revision(item, revno)._fs_metadata)
+                except (NoSuchRevisionError, IOError):
+                    # destroyed meanwhile
+                    pass
+
+    def collect_garbage(self):
+        """
+        Remove the revision data files not used by any revision and fix the
+        reference counts (see FileBlobStore.collect). Only use this while the
+        backend is not in use.
+
+        @return: number of removed data files
+        """
+        return self._blobs.collect(self._iter_data_hashes())
 
     def _do_locked(self, lockname, fn, arg):
         l = ExclusiveLock(lockname, 30)
@@ -263,7 +349,7 @@ class FS2Backend(BackendBase):
         """
         See _add_item_internally, this is just internal for locked operation.
         """
-        item, revmeta, revdata, revdata_target, itemmeta = arg
+        item, revmeta, revdata, revdata_hash, itemmeta = arg
         item_id = make_uuid().hex
         item_name = item.name
 
@@ -276,7 +362,7 @@ class FS2Backend(BackendBase):
         os.mkdir(self._make_path('meta', item_id))
 
         if revdata is not None:
-            filesys.rename(revdata, revdata_target)
+            self._blobs.add(revdata_hash, revdata)
 
         if revmeta is not None:
             rp = self._make_path('meta', item_id, '%d.rev' % 0)
@@ -286,12 +372,12 @@ class FS2Backend(BackendBase):
             # only write item level metadata file if we have any
             mp = self._make_path('meta', item_id, 'item')
             f = open(mp, 'wb')
-            pickle.dump(itemmeta, f, protocol=PICKLEPROTOCOL)
+            f.write(metacodec.dumps(itemmeta))
             f.close()
 
         item._fs_item_id = item_id
 
-    def _add_item_internally(self, item, revmeta=None, revdata=None, revdata_target=None, itemmeta=None):
+    def _add_item_internally(self, item, revmeta=None, revdata=None, revdata_hash=None, itemmeta=None):
         """
         This method adds a new item. It locks the name-mapping database to
         ensure putting the item into place and adding it to the name-mapping
@@ -305,33 +391,31 @@ class FS2Backend(BackendBase):
 
         @param revmeta: new revision's temporary meta file path
         @param revdata: new revision's temporary data file path
+        @param revdata_hash: new revision's data hash
         @param itemmeta: item metadata dict
         """
         self._do_locked(self._make_path('name-mapping.lock'),
-                        self._add_item_internally_locked, (item, revmeta, revdata, revdata_target, itemmeta))
+                        self._add_item_internally_locked, (item, revmeta, revdata, revdata_hash, itemmeta))
 
     def _commit_item(self, rev):
         item = rev.item
         metadata = {'__timestamp': rev.timestamp}
         metadata.update(rev)
-        md = pickle.dumps(metadata, protocol=PICKLEPROTOCOL)
 
-        rev._fs_file_meta.write(md)
+        self._close_revision_data(rev)
+        if self._delta_interval and metadata.get(MIMETYPE, '').startswith('text/'):
+            self._store_delta(rev, metadata)
 
+        md = metacodec.dumps(metadata)
+        rev._fs_file_meta.write(md)
         self._close_revision_meta(rev)
-        self._close_revision_data(rev)
 
-        data_hash = metadata[HASH_ALGORITHM]
+        data_hash = data_blob(metadata)
 
-        pd = self._make_path('data', data_hash)
         if item._fs_item_id is None:
-            self._add_item_internally(item, revmeta=rev._fs_path_meta, revdata=rev._fs_path_data, revdata_target=pd)
+            self._add_item_internally(item, revmeta=rev._fs_path_meta, revdata=rev._fs_path_data, revdata_hash=data_hash)
         else:
-            try:
-                filesys.rename_no_overwrite(rev._fs_path_data, pd, delete_old=True)
-            except OSError, err:
-                if err.errno != errno.EEXIST:
-                    raise
+            self._blobs.add(data_hash, rev._fs_path_data)
 
             pm = self._make_path('meta', item._fs_item_id, '%d.rev' % rev.revno)
             try:
@@ -339,8 +423,118 @@ class FS2Backend(BackendBase):
             except OSError, err:
                 if err.errno != errno.EEXIST:
                     raise
+                self._blobs.remove(data_hash)
                 raise RevisionAlreadyExistsError("")
 
+    def _store_delta(self, rev, metadata):
+        """
+        replace the (complete) data of the new revision <rev> by a delta to the
+        previous revision if that is smaller, add DELTA and DATA_SIZE to its
+        <metadata> then.
+        """
+        item_id = rev.item._fs_item_id
+        f = open(rev._fs_path_data, 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if item_id is None or rev.revno % self._delta_interval == 0:
+            delta = None
+        else:
+            try:
+                base = self._get_revision_data(item_id, rev.revno - 1)
+            except (IOError, OSError), err:
+                if err.errno != errno.ENOENT:
+                    raise
+                # no previous revision (destroyed)
+                delta = None
+            else:
+                delta = make_delta(base, data)
+                if delta is not None and len(delta) >= len(data):
+                    delta = None
+        if delta is not None:
+            metadata[DELTA] = unicode(hashlib.new(HASH_ALGORITHM, delta).hexdigest())
+            metadata[DATA_SIZE] = len(data)
+            f = open(rev._fs_path_data, 'wb')
+            try:
+                f.write(delta)
+            finally:
+                f.close()
+        if item_id is not None:
+            text_cache.put((item_id, rev.revno, metadata[HASH_ALGORITHM]), data)
+
+    def _load_revision_metadata(self, item_id, revno, keys=None):
+        f = open(self._make_path('meta', item_id, '%d.rev' % revno), 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if not data:
+            return {}
+        return metacodec.loads(data, keys)
+
+    def _read_blob(self, blob_hash):
+        f = open(self._blobs.blob_path(blob_hash), 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def _get_revision_data(self, item_id, revno):
+        """
+        return the data of revision <revno> of item <item_id>, for revisions
+        stored as delta, apply the deltas to the last completely stored one.
+        """
+        deltas = []
+        while True:
+            metadata = self._load_revision_metadata(item_id, revno, [HASH_ALGORITHM, DELTA])
+            data = text_cache.get((item_id, revno, metadata[HASH_ALGORITHM]))
+            if data is not None:
+                break
+            if DELTA not in metadata:
+                data = self._read_blob(metadata[HASH_ALGORITHM])
+                break
+            deltas.append(metadata)
+            revno -= 1
+        for metadata in reversed(deltas):
+            revno += 1
+            data = apply_delta(data, self._read_blob(metadata[DELTA]))
+        if deltas:
+            text_cache.put((item_id, revno, metadata[HASH_ALGORITHM]), data)
+        return data
+
+    def _store_completely(self, item_id, revno):
+        """
+        if revision <revno> of item <item_id> is stored as delta, store it
+        completely (called before its base revision gets destroyed).
+        """
+        try:
+            metadata = self._load_revision_metadata(item_id, revno)
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return
+        if DELTA not in metadata:
+            return
+        data = self._get_revision_data(item_id, revno)
+        fd, tmp = tempfile.mkstemp('.tmp', '', self._make_path('data'))
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        self._blobs.add(metadata[HASH_ALGORITHM], tmp)
+        delta_hash = metadata.pop(DELTA)
+        del metadata[DATA_SIZE]
+        path = self._make_path('meta', item_id, '%d.rev' % revno)
+        f = open(path + '.tmp', 'wb')
+        try:
+            f.write(metacodec.dumps(metadata))
+        finally:
+            f.close()
+        filesys.rename(path + '.tmp', path)
+        self._blobs.remove(delta_hash)
+
     def _rollback_item(self, rev):
         self._close_revision_meta(rev)
         self._close_revision_data(rev)
@@ -350,6 +544,9 @@ class FS2Backend(BackendBase):
     def _destroy_item_locked(self, item):
         item_id = item._fs_item_id
 
+        data_hashes = [data_blob(self._get_revision(item, revno)._fs_metadata)
+                       for revno in self._list_revisions(item)]
+
         name2id = self._name2id
         results = name2id.delete().where(name2id.c.item_id==item_id).execute()
 
@@ -359,12 +556,53 @@ class FS2Backend(BackendBase):
         except OSError, err:
             raise CouldNotDestroyError("Could not destroy item '%r' [errno: %d]" % (
                 item.name, err.errno))
-        # XXX do refcount data files and if zero, kill it
+        for data_hash in data_hashes:
+            self._blobs.remove(data_hash)
 
     def _destroy_item(self, item):
         self._do_locked(self._make_path('name-mapping.lock'),
                         self._destroy_item_locked, item)
 
+    def convert_metadata(self):
+        """
+        Convert item and revision metadata stored by older versions (pickles)
+        to the current metadata format (see _metacodec). This can be done
+        while the backend is in use.
+
+        @return: number of converted files
+        """
+        count = 0
+        for item in self.iteritems():
+            self._change_item_metadata(item)
+            try:
+                count += self._convert_metadata_file(self._make_path('meta', item._fs_item_id, 'item'))
+            finally:
+                item._fs_metadata_lock.release()
+                del item._fs_metadata_lock
+            for revno in self._list_revisions(item):
+                count += self._convert_metadata_file(self._make_path('meta', item._fs_item_id, '%d.rev' % revno))
+        return count
+
+    def _convert_metadata_file(self, path):
+        try:
+            f = open(path, 'rb')
+        except IOError, err:
+            if err.errno != errno.ENOENT:
+                raise
+            return 0
+        try:
+            md = f.read()
+        finally:
+            f.close()
+        if not md or not metacodec.is_pickle(md):
+            return 0
+        tmp = path + '.tmp'
+        f = open(tmp, 'wb')
+        f.write(metacodec.dumps(metacodec.loads(md)))
+        f.close()
+        filesys.rename(tmp, path)
+        return 1
+
     def _change_item_metadata(self, item):
         if not item._fs_item_id is None:
             lp = self._make_path('meta', item._fs_item_id, 'item.lock')
@@ -391,7 +629,7 @@ class FS2Backend(BackendBase):
             else:
                 tmp = self._make_path('meta', item._fs_item_id, 'item.tmp')
                 f = open(tmp, 'wb')
-                pickle.dump(md, f, protocol=PICKLEPROTOCOL)
+                f.write(metacodec.dumps(md))
                 f.close()
 
                 filesys.rename(tmp, self._make_path('meta', item._fs_item_id, 'item'))
@@ -403,7 +641,7 @@ class FS2Backend(BackendBase):
             p = self._make_path('meta', item._fs_item_id, 'item')
             try:
                 f = open(p, 'rb')
-                metadata = pickle.load(f)
+                metadata = metacodec.loads(f.read())
                 f.close()
             except IOError, err:
                 if err.errno != errno.ENOENT:
@@ -417,14 +655,29 @@ class FS2Backend(BackendBase):
         return rev._fs_metadata
 
     def _get_revision_timestamp(self, rev):
-        return rev._fs_metadata['__timestamp']
+        if '_fs_metadata' in rev.__dict__:
+            return rev._fs_metadata['__timestamp']
+        # e.g. for history listings, do not decode all the metadata
+        return rev._fs_load_metadata(['__timestamp'])['__timestamp']
 
     def _get_revision_size(self, rev):
+        if DELTA in rev._fs_metadata:
+            return rev._fs_metadata[DATA_SIZE]
         return os.stat(rev._fs_path_data).st_size
 
+    def _get_revision_local_path(self, rev):
+        if DELTA in rev._fs_metadata:
+            # there is no file with the data
+            return None
+        return rev._fs_path_data
+
     def _open_revision_data(self, rev, mode='rb'):
         if rev._fs_file_data is None:
-            rev._fs_file_data = open(rev._fs_path_data, mode) # XXX keeps file open as long as rev exists
+            if DELTA in rev._fs_metadata:
+                data = self._get_revision_data(rev.item._fs_item_id, rev.revno)
+                rev._fs_file_data = StringIO(data)
+            else:
+                rev._fs_file_data = open(rev._fs_path_data, mode) # XXX keeps file open as long as rev exists
 
     def _close_revision_data(self, rev):
         if rev._fs_file_data is not None:
@@ -20,49 +20,141 @@
 """
 
 import os
-import time, datetime
+import time, datetime, calendar
+import sre_parse, sre_constants
+from UserDict import DictMixin
 
 from MoinMoin import log
 logging = log.getLogger(__name__)
 
-from MoinMoin.storage.error import NoSuchItemError, NoSuchRevisionError
+from MoinMoin.storage.error import NoSuchItemError, NoSuchRevisionError, \
+                                   AccessDeniedError
 from MoinMoin.items import ACL, MIMETYPE, UUID, NAME, NAME_OLD, \
-                           TAGS
+                           TAGS, ITEMLINKS, ITEMTRANSCLUSIONS, USERGROUP, IS_SYSITEM
+from MoinMoin.search import term
+from MoinMoin import config
+from MoinMoin.config import READ
+
+
+# max. size of the data of a new revision we keep for the full text index
+TEXT_BUFFER_SIZE = 1024 * 1024
 
 
 class IndexingBackendMixin(object):
     """
     Backend indexing support
     """
+    # number of index rows fetched at once by history()
+    history_batch_size = 100
+
     def __init__(self, *args, **kw):
         index_uri = kw.pop('index_uri', None)
+        index = kw.pop('index', None) # share an existing ItemIndex
+        group_re = kw.pop('group_re', None) # see GroupIndex
         super(IndexingBackendMixin, self).__init__(*args, **kw)
-        self._index = ItemIndex(index_uri)
+        if index is None:
+            index = ItemIndex(index_uri, group_re=group_re)
+        self._index = index
 
     def index_rebuild(self):
         return self._index.index_rebuild(self)
 
-    def history(self, reverse=True, item_name=u'', start=None, end=None):
+    def index_update(self):
+        return self._index.index_update(self)
+
+    @property
+    def index_outdated(self):
         """
-        History implementation using the index.
+        True if the index tables were created by an older version and the
+        index needs a rebuild
+        """
+        return bool(self._index.outdated)
+
+    @property
+    def user_index(self):
+        return self._index.user_index
+
+    @property
+    def group_index(self):
+        return self._index.group_index
+
+    def search_items(self, searchterm):
+        """
+        Search implementation using the index.
+
+        The parts of searchterm that the index can answer are run as a query
+        against the index, only the residual terms are evaluated per item.
+
+        @see: Backend.search_items.__doc__
         """
-        for result in self._index.history(reverse=reverse, item_name=item_name, start=start, end=end):
-            # we currently create the item, the revision and yield it to stay
-            # compatible with storage api definition, but this could be changed to
-            # just return the data we get from the index (without accessing backend)
-            # TODO: A problem exists at item = self.get_item(name).
-            # In the history_size_after_rename test in test_backends.py,
-            # an item was created with the name "first" and then renamed to "second."
-            # When it runs through this history function and runs item = self.get_item("first"),
-            # it can't find it because it was already renamed to "second."
-            # Some suggested solutions are: using some neverchanging uuid to identify some specific item
-            # or continuing to use the name, but tracking name changes within the item's history.
-            rev_datetime, name, rev_no, rev_metas = result
+        condition, residual = self._index.compile_term(searchterm)
+        name_only = residual is None or is_name_term(residual)
+        for name in self._index.item_names(condition):
+            if residual is not None and name_only:
+                # no need to load the item, evaluating the name is enough
+                residual.prepare()
+                if not residual.evaluate(_NamedThing(name)):
+                    continue
             try:
                 item = self.get_item(name)
-                yield item.get_revision(rev_no)
-            except (NoSuchItemError, NoSuchRevisionError), e:
-                logging.exception("history processing catched exception")
+            except (NoSuchItemError, AccessDeniedError), e:
+                # index is out of sync with the backend or user may not read it
+                continue
+            if residual is not None and not name_only:
+                residual.prepare()
+                if not residual.evaluate(item):
+                    continue
+            yield item
+
+    def history(self, reverse=True, item_name=u'', limit=None, after=None):
+        """
+        History implementation using the index.
+
+        Yields IndexedRevision objects, which are created from the index data
+        only (without accessing the backend). Revisions of items the user may
+        not read are skipped.
+
+        The index is queried in batches (keyset paging, each with a SQL
+        LIMIT), until <limit> readable revisions were yielded, so neither the
+        whole history gets fetched nor does the ACL filtering make us return
+        less than <limit> revisions.
+
+        @param limit: if given, yield at most that many revisions
+        @param after: if given, start after the revision with this history_key
+                      (use the history_key of the last revision of the previous
+                      page for paging through the history)
+        """
+        batch_size = self.history_batch_size
+        while limit is None or limit > 0:
+            if limit is not None:
+                batch_size = min(batch_size, limit)
+            rows = 0
+            for result in self._index.history(reverse=reverse, item_name=item_name, limit=batch_size, after=after):
+                rev_datetime, name, rev_no, rev_id, size, rev_metas = result
+                rows += 1
+                after = rev_datetime, rev_id
+                if not self._may(name, READ):
+                    continue
+                yield IndexedRevision(self, name, rev_no, rev_datetime, size, rev_metas, after)
+                if limit is not None:
+                    limit -= 1
+                    if not limit:
+                        return
+            if rows < batch_size:
+                # no more revisions
+                return
+
+    def search_text(self, query):
+        """
+        Full text search using the index.
+
+        Yields (item name, score) tuples for the items matching <query> (a
+        search query parser expression), best matches first. Items the user
+        may not read are skipped.
+        """
+        for name, score in self._index.search_text(query):
+            if self._may(name, READ):
+                yield name, score
 
     def all_tags(self):
         """
@@ -71,12 +163,93 @@ class IndexingBackendMixin(object):
         """
         return self._index.all_tags()
 
+    def tag_counts(self):
+        """
+        Return a unsorted list of tuples (count, tag) for all tags.
+        """
+        return self._index.tag_counts()
+
+    def tags_starting_with(self, prefix, limit=None):
+        """
+        Return a list of tuples (tag, count) for the tags starting with
+        <prefix> (e.g. for tag completion), most used tags first.
+
+        @param limit: if given, return at most that many tags
+        """
+        return self._index.tags_starting_with(prefix, limit)
+
     def tagged_items(self, tag):
         """
-        Return a list of item names of items that are tagged with <tag>.
+        Return a sorted list of item names of items that are tagged with <tag>.
         """
         return self._index.tagged_items(tag)
 
+    def backrefs(self, item_name):
+        """
+        Return a sorted list of names of items that link to or transclude
+        item <item_name>.
+        """
+        return self._index.backrefs(item_name)
+
+    def wanteds(self):
+        """
+        Return a dict wanted_itemname -> sorted list of names of the items
+        linking to or transcluding it, for all non-existing items that are
+        linked or transcluded.
+        """
+        return self._index.wanteds()
+
+    def orphans(self):
+        """
+        Return a sorted list of names of items (with revisions) that are
+        neither linked nor transcluded by any item.
+        """
+        return self._index.orphans()
+
+    def similar_names(self, item_name):
+        """
+        Return a list of the names of items with names similar to
+        <item_name> (case insensitive), best matches first.
+        """
+        return [name for name in self._index.name_index.similar_names(item_name)
+                if self._may(name, READ)]
+
+    def names_starting_with(self, prefix):
+        """
+        Return a sorted list of the names of items with names starting with
+        <prefix>.
+        """
+        return [name for name in self._index.name_index.names_starting_with(prefix)
+                if self._may(name, READ)]
+
+    def names_ending_with(self, suffix):
+        """
+        Return a sorted list of the names of items with names ending with
+        <suffix>.
+        """
+        return [name for name in self._index.name_index.names_ending_with(suffix)
+                if self._may(name, READ)]
+
+    def current_items(self, offset=0, limit=None):
+        """
+        Yield (item name, datetime of the current revision, is system item)
+        tuples for all items with revisions, ordered by name. Items the user
+        may not read are skipped.
+
+        @param offset: skip that many items (of all items, not just readable ones)
+        @param limit: if given, look at most at that many items
+        """
+        for name, rev_datetime, sysitem in self._index.current_items(offset=offset, limit=limit):
+            if self._may(name, READ):
+                yield name, rev_datetime, sysitem
+
+    def count_current_items(self):
+        """
+        Return the number of items with revisions (including the ones the
+        user may not read).
+        """
+        return self._index.count_current_items()
+
 
 class IndexingItemMixin(object):
     """
@@ -94,9 +267,21 @@ class IndexingItemMixin(object):
         return self.__unindexed_revision
 
     def commit(self):
-        self.__unindexed_revision.update_index()
+        rev = self.__unindexed_revision
+        rev.update_index()
         self.__unindexed_revision = None
-        return super(IndexingItemMixin, self).commit()
+        result = super(IndexingItemMixin, self).commit()
+        if rev._written is not None:
+            rev.update_text_index(''.join(rev._written))
+        else:
+            # too much data to keep it, read it back
+            try:
+                self.get_revision(rev.revno).update_text_index()
+            except AccessDeniedError:
+                # user may write, but not read the item
+                uuid = self.name # XXX
+                self._index.update_text(uuid, None)
+        return result
 
     def rollback(self):
         self.__unindexed_revision = None
@@ -119,14 +304,83 @@ class IndexingItemMixin(object):
         logging.debug("item %r update index:" % (self.name, ))
         for k, v in self.items():
             logging.debug(" * item meta %r: %r" % (k, v))
-        self._index.update_item(metas=self)
+        self._index.update_item(metas=self, name=self.name)
+
+    def rename(self, newname):
+        """
+        rename the item, keeping the index entry (and thus the history) of it
+        """
+        oldname = self.name
+        result = super(IndexingItemMixin, self).rename(newname)
+        uuid = oldname # XXX
+        self._index.rename_item(uuid, self.name)
+        return result
 
     def remove_index(self):
         """
         update the index, removing everything related to this item
         """
         logging.debug("item %r remove index!" % (self.name, ))
-        self._index.remove_item(metas=self)
+        self._index.remove_item(metas=self, name=self.name)
+
+
+class IndexedRevision(object, DictMixin):
+    """
+    A revision as recorded in the index (see IndexingBackendMixin.history).
+
+    Revision number, timestamp, size and metadata are taken from the index.
+    The storage item (and revision) is only fetched from the backend if
+    something needs it, e.g. for accessing the revision data via read().
+    """
+    __slots__ = ['_backend', '_item', '_revision', '_size', '_metadata',
+                 'item_name', 'revno', 'timestamp', 'history_key', ]
+
+    def __init__(self, backend, item_name, revno, rev_datetime, size, metadata, history_key):
+        self._backend = backend
+        self._item = None
+        self._revision = None
+        self._size = size
+        self._metadata = metadata
+        self.item_name = item_name # current name of the item
+        self.revno = revno
+        self.timestamp = calendar.timegm(rev_datetime.utctimetuple())
+        self.history_key = history_key
+
+    @property
+    def item(self):
+        if self._item is None:
+            self._item = self._backend.get_item(self.item_name)
+        return self._item
+
+    def _get_revision(self):
+        if self._revision is None:
+            self._revision = self.item.get_revision(self.revno)
+        return self._revision
+
+    @property
+    def size(self):
+        if self._size is None:
+            # not in the index (yet)
+            self._size = self._get_revision().size
+        return self._size
+
+    def __getitem__(self, key):
+        return self._metadata[key]
+
+    def __contains__(self, key):
+        return key in self._metadata
+
+    def keys(self):
+        return self._metadata.keys()
+
+    def read(self, chunksize=-1):
+        return self._get_revision().read(chunksize)
+
+    def seek(self, position, mode=0):
+        return self._get_revision().seek(position, mode)
+
+    def tell(self):
+        return self._get_revision().tell()
 
 
 class IndexingRevisionMixin(object):
@@ -136,6 +390,19 @@ class IndexingRevisionMixin(object):
     def __init__(self, item, *args, **kw):
         super(IndexingRevisionMixin, self).__init__(item, *args, **kw)
         self._index = item._index
+        # data written to a new revision (for the full text index), None if
+        # there was more than TEXT_BUFFER_SIZE of it
+        self._written = []
+        self._written_size = 0
+
+    def write(self, data):
+        if self._written is not None:
+            self._written_size += len(data)
+            if self._written_size <= TEXT_BUFFER_SIZE:
+                self._written.append(data)
+            else:
+                self._written = None
+        return super(IndexingRevisionMixin, self).write(data)
 
     def destroy(self):
         self.remove_index()
@@ -152,17 +419,42 @@ class IndexingRevisionMixin(object):
         revno = self.revno
         if self.timestamp is None:
             self.timestamp = time.time()
-        if NAME not in self:
-            self[NAME] = name
-        if UUID not in self:
-            self[UUID] = uuid
-        if MIMETYPE not in self:
-            self[MIMETYPE] = 'application/octet-stream'
-        metas = self
+        metas = {NAME: name, UUID: uuid, MIMETYPE: 'application/octet-stream', }
+        for key, value in metas.items():
+            if key not in self:
+                try:
+                    self[key] = value
+                except AttributeError:
+                    # stored revisions (e.g. when indexing an existing
+                    # backend) can't be changed, we just index the defaults
+                    pass
+        metas.update(self)
         logging.debug("item %r revno %d update index:" % (name, revno))
         for k, v in metas.items():
             logging.debug(" * rev meta %r: %r" % (k, v))
-        self._index.add_rev(uuid, revno, self.timestamp, metas)
+        self._index.add_rev(uuid, revno, self.timestamp, metas, self.size)
+
+    def update_text_index(self, data=None):
+        """
+        update the full text index with the data of this revision
+
+        only text items are indexed, the text of other items is removed from
+        the full text index. this should only be called for the current
+        revision of the item.
+
+        @param data: the revision data (if not given, it is read from this
+                     stored revision)
+        """
+        uuid = self.item.name # XXX
+        mimetype = self.get(MIMETYPE) or ''
+        if mimetype.startswith('text/'):
+            if data is None:
+                self.seek(0)
+                data = self.read()
+            text = data.decode(config.charset, 'replace')
+        else:
+            text = None
+        self._index.update_text(uuid, text)
 
     def remove_index(self):
         """
@@ -174,28 +466,492 @@ class IndexingRevisionMixin(object):
         logging.debug("item %r revno %d remove index!" % (name, revno))
         uuid = name # XXX
         self._index.remove_rev(uuid, revno)
+        # the full text index has the text of the current revision
+        revnos = [r for r in self.item.list_revisions() if r != revno]
+        if revnos:
+            self.item.get_revision(revnos[-1]).update_text_index()
+        else:
+            self._index.update_text(uuid, None)
 
     # TODO maybe use this class later for data indexing also,
     # TODO by intercepting write() to index data written to a revision
 
 from uuid import uuid4 as gen_uuid
 
-from MoinMoin.util.kvstore import KVStoreMeta, KVStore
+from MoinMoin.util.kvstore import KVStoreMeta, KVStore, escape_like
+from MoinMoin.search.textindex import TextIndex
+from MoinMoin.search.nameindex import NameIndex
+
+from sqlalchemy import Table, Column, Integer, Float, String, Unicode, Boolean, DateTime, PickleType, MetaData, ForeignKey
+from sqlalchemy import create_engine, select, func, null
+from sqlalchemy.sql import and_, or_, not_, exists, asc, desc
+
+
+class _NamedThing(object):
+    """
+    Stand-in for an item if just its name is needed to evaluate a term.
+    """
+    def __init__(self, name):
+        self.name = name
+
+
+def is_name_term(t):
+    """
+    check whether term t (and all its subterms) only looks at the item name
+    """
+    if isinstance(t, term.ListTerm):
+        return all(is_name_term(subterm) for subterm in t.terms)
+    if isinstance(t, term.UnaryTerm):
+        return is_name_term(t.term)
+    return isinstance(t, (term.NameRE, term.NameFn, term._BOOL))
+
+
+def name_prefix(needle_re):
+    """
+    analyze a compiled regex for a name search
+
+    @return: tuple (prefix, exact) - prefix is the literal string all matching
+             names start with (u'' if there is none), exact is True if every
+             name starting with prefix matches (and nothing else)
+    """
+    if needle_re.flags & (sre_constants.SRE_FLAG_IGNORECASE | sre_constants.SRE_FLAG_LOCALE):
+        return u'', False
+    try:
+        parsed = list(sre_parse.parse(needle_re.pattern, needle_re.flags))
+    except (sre_constants.error, TypeError), e:
+        return u'', False
+    if not parsed or parsed[0] != (sre_constants.AT, sre_constants.AT_BEGINNING):
+        return u'', False
+    chars = []
+    rest = parsed[1:]
+    while rest and rest[0][0] == sre_constants.LITERAL:
+        chars.append(unichr(rest[0][1]))
+        rest = rest[1:]
+    if len(rest) == 1 and rest[0][0] == sre_constants.MAX_REPEAT:
+        # a trailing .* matches anything (item names do not contain newlines)
+        min_count, max_count, repeated = rest[0][1]
+        if min_count == 0 and list(repeated) == [(sre_constants.ANY, None)]:
+            rest = []
+    exact = not rest and not needle_re.flags & sre_constants.SRE_FLAG_MULTILINE
+    return u''.join(chars), exact
+
+# kinds of links in the link_table
+LINK = 'link'
+TRANSCLUSION = 'transclusion'
+
+
+def _join(mountpoint, name):
+    """
+    fully qualified name of item <name> of the backend mounted at <mountpoint>
+    """
+    return mountpoint and mountpoint + u'/' + name or name
+
+
+class _BulkConnection(object):
+    """
+    Bind for the index tables while doing bulk updates.
+
+    All statements are run on the same connection, within one transaction.
+    Code that connects and closes "its own" connection gets (and does not
+    close) this one, transactions it begins are nested into the bulk one.
+    """
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, attr):
+        return getattr(self._conn, attr)
+
+    def connect(self):
+        return self
+
+    contextual_connect = connect
+
+    def close(self):
+        pass
+
+
+class UserIndex(object):
+    """
+    Index for the user profiles (see MoinMoin.user), for finding users by
+    name, email address or openid without loading all user profiles.
+
+    It has its own tables (not dropped by ItemIndex.index_rebuild), the user
+    profile code keeps it up to date.
+    """
+    # user profile metadata keys we can look up users by
+    KEYS = ('name', 'email', 'openid', )
+
+    def __init__(self, engine):
+        metadata = MetaData()
+        metadata.bind = engine
+        VALUE_LEN = KVStoreMeta.VALUE_LEN
+        self.user_table = Table('user_table', metadata,
+            Column('uid', Unicode(VALUE_LEN), primary_key=True), # user profile item name
+            Column('name', Unicode(VALUE_LEN), index=True),
+            Column('email', Unicode(VALUE_LEN), index=True),
+            Column('openid', Unicode(VALUE_LEN), index=True),
+            Column('disabled', Boolean),
+            Column('stamp', String(32)), # changes whenever the profile is updated
+        )
+        metadata.create_all()
+        self.metadata = metadata
+        self.synced = False # see MoinMoin.user.get_user_index
+
+    def _values(self, uid, metas):
+        values = dict(uid=uid, disabled=bool(metas.get('disabled')), stamp=gen_uuid().hex)
+        for key in self.KEYS:
+            value = metas.get(key) or None
+            if isinstance(value, str):
+                value = value.decode(config.charset)
+            values[key] = value
+        return values
+
+    def update_user(self, uid, metas):
+        """
+        update the index entry of user <uid> with the user profile metadata
+        <metas> (a dict)
+        """
+        user_table = self.user_table
+        conn = self.metadata.bind.connect()
+        trans = conn.begin()
+        try:
+            conn.execute(user_table.delete().where(user_table.c.uid == uid))
+            conn.execute(user_table.insert().values(**self._values(uid, metas)))
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def remove_user(self, uid):
+        """
+        remove the index entry of user <uid>
+        """
+        user_table = self.user_table
+        user_table.delete().where(user_table.c.uid == uid).execute()
+
+    def rebuild(self, profiles):
+        """
+        replace all index entries by the entries for <profiles>, an iterable
+        of (uid, metas) tuples
+        """
+        user_table = self.user_table
+        conn = self.metadata.bind.connect()
+        trans = conn.begin()
+        try:
+            conn.execute(user_table.delete())
+            for uid, metas in profiles:
+                conn.execute(user_table.insert().values(**self._values(uid, metas)))
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def get_stamp(self, uid):
+        """
+        return the stamp of user <uid> (None if the user is not in the index),
+        it changes whenever the user's index entry is updated.
+        """
+        user_table = self.user_table
+        result = select([user_table.c.stamp], user_table.c.uid == uid).execute().fetchone()
+        if result:
+            return result[0]
+
+    def count(self):
+        """
+        return the number of indexed users
+        """
+        return select([func.count(self.user_table.c.uid)]).execute().fetchone()[0]
+
+    def user_ids(self, key, value, prefix=False, disabled=True):
+        """
+        return a sorted list of the uids of the users with <value> as <key>
+        (one of KEYS) in their profile.
+
+        @param prefix: if True, find the users whose <key> starts with <value>
+        @param disabled: if False, skip disabled users
+        """
+        column = self.user_table.c[key]
+        if prefix:
+            condition = column.like(escape_like(value) + u'%', escape=u'\\')
+        else:
+            condition = column == value
+        if not disabled:
+            condition = and_(condition, not_(self.user_table.c.disabled))
+        result = select([self.user_table.c.uid, column], condition).execute()
+        # LIKE might be case insensitive
+        return sorted([uid for uid, found in result if found.startswith(value)])
+
+
+class GroupIndex(object):
+    """
+    Index for the wiki groups (items with a name matching the group name
+    regex, their current revision's USERGROUP metadata lists the members).
+
+    Besides the direct members, it keeps the transitive closure of the group
+    membership (all members of a group, including the members of its wiki
+    subgroups, recursively), so checking the membership in a nested group is
+    a single lookup. When a group changes, only the closures of the groups
+    containing it (and its own) are recomputed.
+    """
+    # max. number of parameters we put into one IN clause (sqlite has a limit)
+    IN_CHUNK_SIZE = 500
+
+    def __init__(self, item_index, group_re=None):
+        """
+        @param group_re: compiled regex matching the group names (None: all
+                         names are group names)
+        """
+        metadata = item_index.metadata
+        VALUE_LEN = KVStoreMeta.VALUE_LEN
+        self.group_table = Table('group_table', metadata,
+            Column('item_id', ForeignKey('item_table.id'), primary_key=True),
+            Column('name', Unicode(VALUE_LEN), index=True, unique=True),
+        )
+        # direct members of a group
+        self.member_table = Table('group_member_table', metadata,
+            Column('item_id', ForeignKey('item_table.id'), primary_key=True),
+            Column('member', Unicode(VALUE_LEN), primary_key=True),
+        )
+        # all members of a group (transitive closure)
+        self.closure_table = Table('group_closure_table', metadata,
+            Column('item_id', ForeignKey('item_table.id'), primary_key=True),
+            Column('member', Unicode(VALUE_LEN), primary_key=True, index=True),
+            Column('subgroup', Boolean), # member is a group name
+        )
+        self.metadata = metadata
+        self.group_re = group_re
+        # set of changed group names while closure updates are deferred (see ItemIndex._bulk)
+        self.deferred = None
+
+    def is_group_name(self, name):
+        return self.group_re is None or self.group_re.match(name) is not None
+
+    def _get(self, conn, item_id):
+        """
+        return (name, set of direct members) of group <item_id>, None if it is no group
+        """
+        group_table = self.group_table
+        member_table = self.member_table
+        result = conn.execute(select([group_table.c.name], group_table.c.item_id == item_id)).fetchone()
+        if result is None:
+            return None
+        members = conn.execute(select([member_table.c.member], member_table.c.item_id == item_id))
+        return result[0], set(member for member, in members)
+
+    def update_group(self, item_id, name, members=None):
+        """
+        update the group data of item <item_id>
+
+        @param name: the item's current name (None: item has no revisions any more)
+        @param members: the item's current USERGROUP metadata
+        """
+        if name is not None and not self.is_group_name(name):
+            name = None
+        if name is not None:
+            members = set(unicode(member) for member in members or [])
+        group_table = self.group_table
+        member_table = self.member_table
+        conn = self.metadata.bind.connect()
+        trans = conn.begin()
+        try:
+            old = self._get(conn, item_id)
+            if old == (name is not None and (name, members) or None):
+                trans.commit()
+                return
+            conn.execute(member_table.delete().where(member_table.c.item_id == item_id))
+            conn.execute(group_table.delete().where(group_table.c.item_id == item_id))
+            if name is not None:
+                conn.execute(group_table.insert().values(item_id=item_id, name=name))
+                if members:
+                    conn.execute(member_table.insert(),
+                                 [dict(item_id=item_id, member=member) for member in members])
+            else:
+                closure_table = self.closure_table
+                conn.execute(closure_table.delete().where(closure_table.c.item_id == item_id))
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+        changed = set()
+        if old is not None:
+            changed.add(old[0])
+        if name is not None:
+            changed.add(name)
+        if self.deferred is not None:
+            self.deferred.update(changed)
+        else:
+            self.update_closure(changed)
+
+    def update_closure(self, names):
+        """
+        recompute the closures of the groups <names> and of the groups containing them
+        """
+        group_table = self.group_table
+        closure_table = self.closure_table
+        group_ids = dict(select([group_table.c.name, group_table.c.item_id]).execute().fetchall())
+        affected = set(name for name in names if name in group_ids)
+        names = list(names)
+        for start in range(0, len(names), self.IN_CHUNK_SIZE):
+            chunk = names[start:start+self.IN_CHUNK_SIZE]
+            result = select([group_table.c.name],
+                            and_(closure_table.c.item_id == group_table.c.item_id,
+                                 closure_table.c.member.in_(chunk))).execute()
+            affected.update(name for name, in result)
+        members_cache = {}
+        conn = self.metadata.bind.connect()
+        trans = conn.begin()
+        try:
+            for name in affected:
+                self._update_closure(conn, group_ids, name, members_cache)
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _update_closure(self, conn, group_ids, name, members_cache):
+        member_table = self.member_table
+        closure_table = self.closure_table
+        item_id = group_ids[name]
+        closure = {} # member -> is a group name
+        todo = [name]
+        expanded = set(todo)
+        while todo:
+            group_id = group_ids[todo.pop()]
+            members = members_cache.get(group_id)
+            if members is None:
+                members = members_cache[group_id] = [member for member, in conn.execute(
+                    select([member_table.c.member], member_table.c.item_id == group_id))]
+            for member in members:
+                if member not in closure:
+                    closure[member] = self.is_group_name(member)
+                    if member in group_ids and member not in expanded:
+                        expanded.add(member)
+                        todo.append(member)
+        conn.execute(closure_table.delete().where(closure_table.c.item_id == item_id))
+        if closure:
+            conn.execute(closure_table.insert(),
+                         [dict(item_id=item_id, member=member, subgroup=subgroup)
+                          for member, subgroup in closure.iteritems()])
+
+    def group_names(self):
+        """
+        return a sorted list of the names of all wiki groups
+        """
+        group_table = self.group_table
+        return [name for name, in select([group_table.c.name]).order_by(group_table.c.name).execute()]
+
+    def has_group(self, name):
+        """
+        check if there is a wiki group <name>
+        """
+        group_table = self.group_table
+        return select([group_table.c.item_id], group_table.c.name == name).execute().fetchone() is not None
+
+    def has_member(self, name, member):
+        """
+        check if <member> is a (direct or indirect) member of wiki group <name>
+        """
+        group_table = self.group_table
+        closure_table = self.closure_table
+        return select([closure_table.c.item_id],
+                      and_(group_table.c.name == name,
+                           closure_table.c.item_id == group_table.c.item_id,
+                           closure_table.c.member == member)).execute().fetchone() is not None
+
+    def members(self, name):
+        """
+        return all (direct or indirect) members of wiki group <name>
+
+        @return: tuple (members, wiki_groups, other_groups) of sorted lists:
+                 the members which are no group names, the members which are
+                 wiki groups and the members which are group names, but no
+                 wiki groups (the members of both kinds of groups are not
+                 expanded, the former ones are already included in members).
+        """
+        group_table = self.group_table
+        closure_table = self.closure_table
+        subgroups = group_table.alias()
+        members, wiki_groups, other_groups = [], [], []
+        result = select([closure_table.c.member, closure_table.c.subgroup, subgroups.c.item_id],
+                        and_(group_table.c.name == name,
+                             closure_table.c.item_id == group_table.c.item_id),
+                        from_obj=[closure_table.outerjoin(subgroups, subgroups.c.name == closure_table.c.member)]
+                       ).order_by(closure_table.c.member).execute()
+        for member, subgroup, subgroup_id in result:
+            if not subgroup:
+                members.append(member)
+            elif subgroup_id is not None:
+                wiki_groups.append(member)
+            else:
+                other_groups.append(member)
+        return members, wiki_groups, other_groups
+
+    def _other_groups_condition(self):
+        """
+        condition for the closure rows of group names which are no wiki groups
+        """
+        group_table = self.group_table
+        closure_table = self.closure_table
+        return and_(closure_table.c.subgroup,
+                    not_(closure_table.c.member.in_(select([group_table.c.name]))))
+
+    def other_groups(self, name):
+        """
+        return a sorted list of the group names which are (direct or indirect)
+        members of wiki group <name>, but no wiki groups (see members)
+        """
+        group_table = self.group_table.alias()
+        closure_table = self.closure_table
+        return [member for member, in select([closure_table.c.member],
+                                             and_(group_table.c.name == name,
+                                                  closure_table.c.item_id == group_table.c.item_id,
+                                                  self._other_groups_condition())
+                                            ).order_by(closure_table.c.member).execute()]
+
+    def groups_with_member(self, member):
+        """
+        return a sorted list of the names of the wiki groups having <member>
+        as (direct or indirect) member
+        """
+        group_table = self.group_table
+        closure_table = self.closure_table
+        return [name for name, in select([group_table.c.name],
+                                         and_(closure_table.c.member == member,
+                                              closure_table.c.item_id == group_table.c.item_id)
+                                        ).order_by(group_table.c.name).execute()]
+
+    def other_group_names(self):
+        """
+        return a sorted list of the group names which are members of wiki
+        groups, but no wiki groups
+        """
+        closure_table = self.closure_table
+        return [name for name, in select([closure_table.c.member], self._other_groups_condition()
+                                        ).distinct().order_by(closure_table.c.member).execute()]
 
-from sqlalchemy import Table, Column, Integer, String, Unicode, DateTime, PickleType, MetaData, ForeignKey
-from sqlalchemy import create_engine, select
-from sqlalchemy.sql import and_, exists, asc, desc
 
 class ItemIndex(object):
     """
     Index for Items/Revisions
     """
-    def __init__(self, index_uri):
+    # max. number of parameters we put into one IN clause (sqlite has a limit)
+    IN_CHUNK_SIZE = 500
+
+    def __init__(self, index_uri, group_re=None):
         metadata = MetaData()
         metadata.bind = create_engine(index_uri, echo=False)
 
         # for sqlite, lengths are not needed, but for other SQL DBs:
         UUID_LEN = 32
+        KIND_LEN = 16
         VALUE_LEN = KVStoreMeta.VALUE_LEN # we duplicate values from there to our table
 
         # items have a persistent uuid
@@ -210,7 +966,7 @@ class ItemIndex(object):
             Column('name', Unicode(VALUE_LEN), index=True, unique=True),
             Column('mimetype', Unicode(VALUE_LEN), index=True),
             Column('acl', Unicode(VALUE_LEN)),
-            Column('tags', Unicode(VALUE_LEN)),
+            Column('sysitem', Boolean),
         )
 
         # revisions have a revno and a parent item
@@ -220,24 +976,243 @@ class ItemIndex(object):
             Column('revno', Integer),
             # some important stuff duplicated here for easy availability:
             Column('datetime', DateTime, index=True),
+            Column('size', Integer),
+        )
+
+        # outgoing links / transclusions of the items' current revisions
+        self.link_table = Table('link_table', metadata,
+            Column('item_id', ForeignKey('item_table.id'), primary_key=True), # linking item
+            Column('target', Unicode(VALUE_LEN), primary_key=True, index=True), # linked item name
+            Column('kind', String(KIND_LEN), primary_key=True), # LINK or TRANSCLUSION
+        )
+
+        # tags of the items' current revisions
+        self.tag_table = Table('item_tag', metadata,
+            Column('item_id', ForeignKey('item_table.id'), primary_key=True),
+            Column('tag', Unicode(VALUE_LEN), primary_key=True, index=True),
+        )
+
+        # high-water marks of the backends (see index_update)
+        self.sync_table = Table('sync_table', metadata,
+            Column('mountpoint', Unicode(VALUE_LEN), primary_key=True),
+            Column('timestamp', Float), # timestamp of newest indexed revision
         )
 
         item_kvmeta = KVStoreMeta('item', metadata, Integer)
         rev_kvmeta = KVStoreMeta('rev', metadata, Integer)
-        metadata.create_all()
         self.metadata = metadata
+        self.text_index = TextIndex(self)
+        self.name_index = NameIndex(self)
+        self.group_index = GroupIndex(self, group_re)
+        # create_all does not add columns to existing tables
+        self.outdated = self._outdated_tables()
+        if self.outdated:
+            logging.warning("index tables %s were created by an older version, the index needs a rebuild" %
+                            ', '.join(self.outdated))
+        metadata.create_all()
+        self.user_index = UserIndex(metadata.bind)
         self.item_kvstore = KVStore(item_kvmeta)
         self.rev_kvstore = KVStore(rev_kvmeta)
 
-    def index_rebuild(self, backend):
-        self.metadata.drop_all()
-        self.metadata.create_all()
-        for item in backend.iteritems():
+    def _outdated_tables(self):
+        """
+        return the names of the existing index tables lacking some of our
+        columns (e.g. item_table.sysitem, if an older version created it)
+        """
+        engine = self.metadata.bind
+        outdated = []
+        for table in self.metadata.sorted_tables:
+            if engine.has_table(table.name):
+                existing = Table(table.name, MetaData(), autoload=True, autoload_with=engine)
+                if [column.name for column in table.c if column.name not in existing.c]:
+                    outdated.append(table.name)
+        return outdated
+
+    def _clear_caches(self):
+        self.item_kvstore.clear_cache()
+        self.rev_kvstore.clear_cache()
+
+    def _bulk(self, fn, *args):
+        """
+        call fn(*args) with all index changes done within one transaction
+
+        note: while this runs, all index accesses use the bulk connection, so
+              only use it when nothing else is using the index (startup, scripts).
+        """
+        engine = self.metadata.bind
+        conn = engine.connect()
+        trans = conn.begin()
+        self.metadata.bind = _BulkConnection(conn)
+        group_index = self.group_index
+        group_index.deferred = set() # update the group closures only once
+        try:
+            result = fn(*args)
+            changed, group_index.deferred = group_index.deferred, None
+            group_index.update_closure(changed)
+            trans.commit()
+            return result
+        except:
+            trans.rollback()
+            self._clear_caches() # they might refer to rolled back rows
+            raise
+        finally:
+            group_index.deferred = None
+            self.metadata.bind = engine
+            conn.close()
+
+    def _sources(self, backend):
+        """
+        return the (mountpoint, backend) pairs the index is fed from
+        """
+        return getattr(backend, 'mapping', [(u'', backend)])
+
+    def get_sync_mark(self, mountpoint):
+        """
+        return the timestamp of the newest revision indexed by the last
+        rebuild / update for the backend at <mountpoint>, None if there was none.
+        """
+        sync_table = self.sync_table
+        result = select([sync_table.c.timestamp],
+                        sync_table.c.mountpoint == mountpoint
+                       ).execute().fetchone()
+        if result:
+            return result[0]
+
+    def set_sync_mark(self, mountpoint, timestamp):
+        sync_table = self.sync_table
+        sync_table.delete().where(sync_table.c.mountpoint == mountpoint).execute()
+        sync_table.insert().values(mountpoint=mountpoint, timestamp=timestamp).execute()
+
+    def _index_all(self, backend, mountpoint, sub_backend):
+        """
+        index all items / revisions of <sub_backend> (mounted at <mountpoint>
+        of <backend>)
+
+        @return: timestamp of the newest revision (None if there is none)
+        """
+        newest = None
+        for item in sub_backend.iteritems():
+            item = backend.get_item(_join(mountpoint, item.name))
             item.update_index()
+            rev = None
             for revno in item.list_revisions():
                 rev = item.get_revision(revno)
-                logging.debug("rebuild %s %d" % (rev[NAME], revno))
+                logging.debug("rebuild %s %d" % (item.name, revno))
                 rev.update_index()
+                newest = max(newest, rev.timestamp)
+            if rev is not None:
+                rev.update_text_index()
+        return newest
+
+    def _index_since(self, backend, mountpoint, sub_backend, mark):
+        """
+        index the revisions of <sub_backend> (mounted at <mountpoint> of
+        <backend>) that are not older than <mark> and not in the index yet.
+
+        @return: timestamp of the newest revision (None if there is none)
+        """
+        newest = None
+        recent_revs = []
+        for rev in sub_backend.history(reverse=True):
+            timestamp = rev.timestamp
+            if timestamp < mark:
+                break
+            newest = max(newest, timestamp)
+            recent_revs.append((_join(mountpoint, rev.item.name), rev.revno))
+        indexed = self._indexed_revnos(set(name for name, revno in recent_revs)) # XXX uuid is name
+        new_revs = [(name, revno) for name, revno in recent_revs
+                    if (name, revno) not in indexed]
+        # oldest first, so the current revision of an item gets indexed last
+        new_revs.reverse()
+        items = {}
+        for name, revno in new_revs:
+            try:
+                item = items.get(name)
+                if item is None:
+                    item = items[name] = backend.get_item(name)
+                    item.update_index()
+                rev = item.get_revision(revno)
+            except (NoSuchItemError, NoSuchRevisionError):
+                continue # gone meanwhile
+            logging.debug("update %s %d" % (name, revno))
+            rev.update_index()
+        for item in items.values():
+            revnos = item.list_revisions()
+            if revnos:
+                item.get_revision(revnos[-1]).update_text_index()
+        return newest
+
+    def _indexed_revnos(self, uuids):
+        """
+        return a set of (uuid, revno) of the indexed revisions of items <uuids>
+        """
+        item_table = self.item_table
+        rev_table = self.rev_table
+        uuids = list(uuids)
+        result = set()
+        for start in range(0, len(uuids), self.IN_CHUNK_SIZE):
+            chunk = uuids[start:start+self.IN_CHUNK_SIZE]
+            result.update((uuid, revno) for uuid, revno in select([item_table.c.uuid, rev_table.c.revno],
+                                  and_(item_table.c.uuid.in_(chunk),
+                                       rev_table.c.item_id == item_table.c.id)
+                                 ).execute())
+        return result
+
+    def _rebuild(self, backend):
+        for mountpoint, sub_backend in self._sources(backend):
+            newest = self._index_all(backend, mountpoint, sub_backend)
+            if newest is not None:
+                self.set_sync_mark(mountpoint, newest)
+
+    def _update(self, backend):
+        for mountpoint, sub_backend in self._sources(backend):
+            mark = self.get_sync_mark(mountpoint)
+            if mark is None:
+                newest = self._index_all(backend, mountpoint, sub_backend)
+            else:
+                newest = self._index_since(backend, mountpoint, sub_backend, mark)
+            if newest is not None and newest > mark:
+                self.set_sync_mark(mountpoint, newest)
+
+    def index_rebuild(self, backend):
+        """
+        rebuild the index for <backend> from scratch
+
+        all index updates are done within one transaction.
+        """
+        self.metadata.drop_all()
+        self._clear_caches()
+        self.metadata.create_all()
+        self.outdated = []
+        self._bulk(self._rebuild, backend)
+
+    def index_update(self, backend):
+        """
+        incrementally update the index for <backend>
+
+        For each backend (each mountpoint of a router backend), the timestamp
+        of the newest indexed revision is recorded as high-water mark. An update
+        only walks the backend's history back to that mark and indexes the
+        revisions not yet in the index (revisions committed through the indexing
+        backend are already there). Backends never indexed before get indexed
+        completely.
+
+        Note: changes done to a backend behind the index's back, other than adding
+              revisions (e.g. destroying or renaming items), are not noticed, use
+              index_rebuild then.
+
+        Note: this is only fast for backends with a native history() (e.g.
+              sqla, hg, memory). Others (e.g. fs, fs2) use the generic
+              Backend.history(), which loads all revisions to sort them by
+              timestamp, so the update is O(all revisions) there (but still
+              cheaper than a rebuild, as only new revisions get indexed).
+
+        Note: if the index tables were created by an older version (see
+              outdated), the index gets rebuilt instead.
+        """
+        if self.outdated:
+            return self.index_rebuild(backend)
+        self._bulk(self._update, backend)
 
     def get_item_id(self, uuid):
         """
@@ -251,58 +1226,156 @@ class ItemIndex(object):
         if result:
             return result[0]
 
-    def update_item(self, metas):
+    def get_rev_id(self, uuid, revno):
         """
-        update an item with item-level metadata <metas>
-
-        note: if item does not exist already, it is added
+        return the internal revision id for revision <revno> of item <uuid> or
+        None, if not found.
         """
-        name = metas.get(NAME, '') # item name (if revisioned: same as current revision's name) XXX not there yet
-        uuid = metas.get(UUID, name) # item uuid (never changes) XXX we use name as long we have no uuid
         item_table = self.item_table
+        rev_table = self.rev_table
+        result = select([rev_table.c.id],
+                        and_(item_table.c.uuid == uuid,
+                             rev_table.c.item_id == item_table.c.id,
+                             rev_table.c.revno == revno)
+                       ).execute().fetchone()
+        if result:
+            return result[0]
+
+    def _get_or_create_item_id(self, uuid, name):
+        """
+        return the internal item id for some item with uuid, create a new item
+        entry if there is none yet.
+        """
         item_id = self.get_item_id(uuid)
         if item_id is None:
-            res = item_table.insert().values(uuid=uuid, name=name).execute()
+            res = self.item_table.insert().values(uuid=uuid, name=name).execute()
             item_id = res.last_inserted_ids()[0]
+        return item_id
+
+    def update_item(self, metas, name=None):
+        """
+        update an item with item-level metadata <metas>
+
+        note: if item does not exist already, it is added
+        """
+        if name is None:
+            name = metas.get(NAME, '') # item name (if revisioned: same as current revision's name) XXX not there yet
+        uuid = metas.get(UUID, name) # item uuid (never changes) XXX we use name as long we have no uuid
+        item_id = self._get_or_create_item_id(uuid, name)
         self.item_kvstore.store_kv(item_id, metas)
         return item_id
 
+    def rename_item(self, uuid, name):
+        """
+        update the name of item <uuid> to <name>
+        """
+        item_table = self.item_table
+        item_id = self.get_item_id(uuid)
+        if item_id is not None:
+            new_uuid = name # XXX we use name as long we have no uuid
+            item_table.update().where(item_table.c.id == item_id).values(
+                uuid=new_uuid,
+                name=name,
+            ).execute()
+            self.name_index.update(item_id, name)
+            current = select([item_table.c.current], item_table.c.id == item_id).execute().fetchone()[0]
+            if current is not None:
+                rev_metas = self.rev_kvstore.retrieve_kv(current)
+                self.group_index.update_group(item_id, name, rev_metas.get(USERGROUP))
+
     def cache_in_item(self, item_id, rev_id, rev_metas):
         """
         cache some important values from current revision into item for easy availability
         """
         item_table = self.item_table
+        name = rev_metas[NAME]
+        old_current, old_name = select([item_table.c.current, item_table.c.name],
+                                       item_table.c.id == item_id).execute().fetchone()
         item_table.update().where(item_table.c.id == item_id).values(
             current=rev_id,
-            name=rev_metas[NAME],
+            name=name,
             mimetype=rev_metas[MIMETYPE],
-            acl=rev_metas.get(ACL, ''),
-            tags=u'|' + u'|'.join(rev_metas.get(TAGS, [])) + u'|',
+            acl=rev_metas.get(ACL), # None: no acl (an empty acl is a different thing)
+            sysitem=bool(rev_metas.get(IS_SYSITEM, False)),
         ).execute()
+        # new items (no current revision yet) have no indexed name
+        if old_current is None or name != old_name:
+            self.name_index.update(item_id, name)
 
-    def remove_item(self, metas):
+    def update_links(self, item_id, rev_metas):
+        """
+        replace the outgoing links / transclusions of an item by the ones of
+        the current revision's metadata <rev_metas>
+        """
+        link_table = self.link_table
+        links = []
+        for kind, key in [(LINK, ITEMLINKS), (TRANSCLUSION, ITEMTRANSCLUSIONS), ]:
+            for target in set(rev_metas.get(key, [])):
+                links.append(dict(item_id=item_id, target=target, kind=kind))
+        conn = self.metadata.bind.connect()
+        trans = conn.begin()
+        try:
+            conn.execute(link_table.delete().where(link_table.c.item_id == item_id))
+            if links:
+                conn.execute(link_table.insert(), links)
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def update_tags(self, item_id, rev_metas):
+        """
+        replace the tags of an item by the ones of the current revision's
+        metadata <rev_metas> (None: remove them)
+        """
+        tag_table = self.tag_table
+        tags = rev_metas and set(rev_metas.get(TAGS, [])) or set()
+        conn = self.metadata.bind.connect()
+        trans = conn.begin()
+        try:
+            conn.execute(tag_table.delete().where(tag_table.c.item_id == item_id))
+            if tags:
+                conn.execute(tag_table.insert(), [dict(item_id=item_id, tag=tag) for tag in tags])
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def remove_item(self, metas, name=None):
         """
         remove an item
 
         note: does not remove revisions, these should be removed first
         """
         item_table = self.item_table
-        name = metas.get(NAME, '') # item name (if revisioned: same as current revision's name) XXX not there yet
+        if name is None:
+            name = metas.get(NAME, '') # item name (if revisioned: same as current revision's name) XXX not there yet
         uuid = metas.get(UUID, name) # item uuid (never changes) XXX we use name as long we have no uuid
         item_id = self.get_item_id(uuid)
         if item_id is not None:
             self.item_kvstore.store_kv(item_id, {})
+            link_table = self.link_table
+            link_table.delete().where(link_table.c.item_id == item_id).execute()
+            self.update_tags(item_id, None)
+            self.text_index.remove(item_id)
+            self.name_index.remove(item_id)
+            self.group_index.update_group(item_id, None)
             item_table.delete().where(item_table.c.id == item_id).execute()
 
-    def add_rev(self, uuid, revno, timestamp, metas):
+    def add_rev(self, uuid, revno, timestamp, metas, size=None):
         """
-        add a new revision <revno> for item <uuid> with metadata <metas>
+        add a new revision <revno> for item <uuid> with metadata <metas> (and
+        data size <size>)
 
         currently assumes that added revision will be latest/current revision (not older/non-current)
         """
         rev_table = self.rev_table
-        item_metas = dict(uuid=uuid, name=metas[NAME])
-        item_id = self.update_item(item_metas)
+        # note: this must not touch the item-level metadata in the index
+        item_id = self._get_or_create_item_id(uuid, metas[NAME])
 
         # get (or create) the revision entry
         result = select([rev_table.c.id],
@@ -313,27 +1386,29 @@ class ItemIndex(object):
             rev_id = result[0]
         else:
             dt = datetime.datetime.utcfromtimestamp(timestamp)
-            res = rev_table.insert().values(revno=revno, item_id=item_id, datetime=dt).execute()
+            res = rev_table.insert().values(revno=revno, item_id=item_id, datetime=dt, size=size).execute()
             rev_id = res.last_inserted_ids()[0]
 
         self.rev_kvstore.store_kv(rev_id, metas)
 
         self.cache_in_item(item_id, rev_id, metas)
+        self.update_links(item_id, metas)
+        self.update_tags(item_id, metas)
+        self.group_index.update_group(item_id, metas[NAME], metas.get(USERGROUP))
         return rev_id
 
     def remove_rev(self, uuid, revno):
         """
         remove a revision <revno> of item <uuid>
 
-        Note:
-        * does not update metadata values cached in item (this is only a
-          problem if you delete latest revision AND you don't delete the
-          whole item anyway)
+        if it was the current revision, the values cached in the item are
+        taken from the latest remaining revision.
         """
         item_id = self.get_item_id(uuid)
         assert item_id is not None
 
         # get the revision entry
+        item_table = self.item_table
         rev_table = self.rev_table
         result = select([rev_table.c.id],
                         and_(rev_table.c.revno == revno,
@@ -343,6 +1418,66 @@ class ItemIndex(object):
             rev_id = result[0]
             self.rev_kvstore.store_kv(rev_id, {})
             rev_table.delete().where(rev_table.c.id == rev_id).execute()
+            current = select([item_table.c.current],
+                             item_table.c.id == item_id).execute().fetchone()[0]
+            if current == rev_id:
+                result = select([rev_table.c.id],
+                                rev_table.c.item_id == item_id
+                               ).order_by(desc(rev_table.c.revno)).limit(1).execute().fetchone()
+                if result:
+                    rev_id = result[0]
+                    rev_metas = self.rev_kvstore.retrieve_kv(rev_id)
+                    self.cache_in_item(item_id, rev_id, rev_metas)
+                    self.update_links(item_id, rev_metas)
+                    self.update_tags(item_id, rev_metas)
+                    self.group_index.update_group(item_id, rev_metas[NAME], rev_metas.get(USERGROUP))
+                else:
+                    item_table.update().where(item_table.c.id == item_id).values(
+                        current=None, acl=None,
+                    ).execute()
+                    self.link_table.delete().where(self.link_table.c.item_id == item_id).execute()
+                    self.update_tags(item_id, None)
+                    self.group_index.update_group(item_id, None)
+
+    def update_text(self, uuid, text):
+        """
+        replace the text of item <uuid> in the full text index by <text>
+        (None: remove it from the full text index)
+        """
+        item_id = self.get_item_id(uuid)
+        if item_id is not None:
+            self.text_index.update(item_id, text)
+
+    def search_text(self, query):
+        """
+        full text search for <query> (a search query parser expression)
+
+        @return: list of (item name, score) tuples, best matches first
+        """
+        return self.text_index.search(query)
+
+    def get_acl(self, name):
+        """
+        get the acl of item <name> (as given in its current revision's metadata,
+        None if there is none)
+
+        this is not cached here (other processes may change the index), but
+        it is a single select using the index on the name column. see
+        AclWrapperBackend._get_acl_strings for the per-request cache.
+
+        @raise KeyError: if the index does not know item <name>
+        """
+        item_table = self.item_table
+        result = select([item_table.c.current, item_table.c.acl],
+                        item_table.c.name == name
+                       ).execute().fetchone()
+        if result is None:
+            raise KeyError(name)
+        current, acl = result
+        if current is None:
+            # no revisions, thus no acl
+            acl = None
+        return acl
 
     def get_uuid_revno_name(self, rev_id):
         """
@@ -356,9 +1491,12 @@ class ItemIndex(object):
                        ).execute().fetchone()
         return result
 
-    def history(self, mountpoint=u'', item_name=u'', reverse=True, start=None, end=None):
+    def history(self, mountpoint=u'', item_name=u'', reverse=True, limit=None, after=None):
         """
         Yield ready-to-use history raw data for this backend.
+
+        The history is ordered by (datetime, rev_id), paging is done by giving
+        the (datetime, rev_id) of the last row seen as <after> (keyset paging).
         """
         if mountpoint:
             mountpoint += '/'
@@ -366,43 +1504,247 @@ class ItemIndex(object):
         item_table = self.item_table
         rev_table = self.rev_table
 
-        selection = [rev_table.c.datetime, item_table.c.name, rev_table.c.revno, rev_table.c.id, ]
+        selection = [rev_table.c.datetime, item_table.c.name, rev_table.c.revno, rev_table.c.id, rev_table.c.size, ]
 
         if reverse:
-            order_attr = desc(rev_table.c.datetime)
-        else:
-            order_attr = asc(rev_table.c.datetime)
-
-        if not item_name:
-            # empty item_name = all items
-            condition = item_table.c.id == rev_table.c.item_id
+            order_attrs = [desc(rev_table.c.datetime), desc(rev_table.c.id), ]
         else:
-            condition = and_(item_table.c.id == rev_table.c.item_id,
-                             item_table.c.name == item_name)
-
-        query = select(selection, condition).order_by(order_attr)
-        if start is not None:
-            query = query.offset(start)
-            if end is not None:
-                query = query.limit(end-start)
+            order_attrs = [asc(rev_table.c.datetime), asc(rev_table.c.id), ]
+
+        conditions = [item_table.c.id == rev_table.c.item_id, ]
+        if item_name:
+            # (empty item_name = all items)
+            conditions.append(item_table.c.name == item_name)
+        if after is not None:
+            after_datetime, after_id = after
+            if reverse:
+                conditions.append(or_(rev_table.c.datetime < after_datetime,
+                                      and_(rev_table.c.datetime == after_datetime,
+                                           rev_table.c.id < after_id)))
+            else:
+                conditions.append(or_(rev_table.c.datetime > after_datetime,
+                                      and_(rev_table.c.datetime == after_datetime,
+                                           rev_table.c.id > after_id)))
+
+        query = select(selection, and_(*conditions)).order_by(*order_attrs)
+        if limit is not None:
+            query = query.limit(limit)
+
+        rows = query.execute().fetchall()
+        # fetch the revision metadata for a batch of rows at once
+        batch_size = 100
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start+batch_size]
+            metas = self.rev_kvstore.retrieve_kv_many([row[3] for row in batch])
+            for rev_datetime, name, revno, rev_id, size in batch:
+                rev_metas = metas.get(rev_id, {})
+                yield (rev_datetime, mountpoint + name, revno, rev_id, size, rev_metas)
+
+    def current_items(self, offset=0, limit=None):
+        """
+        Yield (name, datetime, sysitem) of all items with a current revision,
+        ordered by name.
 
-        for rev_datetime, name, revno, rev_id in query.execute().fetchall():
-            rev_metas = self.rev_kvstore.retrieve_kv(rev_id)
-            yield (rev_datetime, mountpoint + name, revno, rev_metas)
+        The rows are fetched in batches (keyset paging by name), so no cursor
+        is kept open while the caller processes the rows.
+        """
+        item_table = self.item_table
+        rev_table = self.rev_table
+        batch_size = 1000
+        last_name = None
+        while limit is None or limit > 0:
+            conditions = [item_table.c.current == rev_table.c.id, ]
+            if last_name is not None:
+                conditions.append(item_table.c.name > last_name)
+            count = limit is None and batch_size or min(limit, batch_size)
+            query = select([item_table.c.name, rev_table.c.datetime, item_table.c.sysitem],
+                           and_(*conditions)).order_by(asc(item_table.c.name)).limit(count)
+            if last_name is None and offset:
+                query = query.offset(offset)
+            rows = query.execute().fetchall()
+            for name, rev_datetime, sysitem in rows:
+                yield name, rev_datetime, bool(sysitem)
+            if len(rows) < count:
+                break
+            last_name = rows[-1][0]
+            if limit is not None:
+                limit -= len(rows)
+
+    def count_current_items(self):
+        """
+        return the number of items with a current revision
+        """
+        item_table = self.item_table
+        return select([func.count(item_table.c.id)], item_table.c.current != null()).execute().scalar()
 
     def all_tags(self):
+        """
+        return a list of (count, tag, names of the tagged items) tuples
+        """
         item_table = self.item_table
-        result = select([item_table.c.name, item_table.c.tags],
-                        item_table.c.tags != u'||').execute().fetchall()
+        tag_table = self.tag_table
+        result = select([tag_table.c.tag, item_table.c.name],
+                        tag_table.c.item_id == item_table.c.id).execute()
         tags_names = {}
-        for name, tags in result:
-            for tag in tags.split(u'|')[1:-1]:
-                tags_names.setdefault(tag, []).append(name)
+        for tag, name in result:
+            tags_names.setdefault(tag, []).append(name)
         counts_tags_names = [(len(names), tag, names) for tag, names in tags_names.items()]
         return counts_tags_names
 
+    def tag_counts(self):
+        """
+        return a list of (count, tag) tuples (count: number of tagged items)
+        """
+        tag_table = self.tag_table
+        result = select([tag_table.c.tag, func.count(tag_table.c.item_id)]
+                       ).group_by(tag_table.c.tag).execute()
+        return [(count, tag) for tag, count in result]
+
+    def tags_starting_with(self, prefix, limit=None):
+        """
+        return a list of (tag, count) tuples of the tags starting with
+        <prefix>, most used tags first.
+        """
+        tag_table = self.tag_table
+        count = func.count(tag_table.c.item_id).label('count')
+        query = select([tag_table.c.tag, count])
+        if prefix:
+            # the tag column is indexed, so a range query is fast
+            query = query.where(and_(tag_table.c.tag >= prefix,
+                                     tag_table.c.tag < prefix[:-1] + unichr(ord(prefix[-1]) + 1)))
+        query = query.group_by(tag_table.c.tag).order_by(desc(count), tag_table.c.tag)
+        if limit is not None:
+            query = query.limit(limit)
+        return [(tag, count) for tag, count in query.execute()]
+
     def tagged_items(self, tag):
+        """
+        return a sorted list of the names of the items tagged with <tag>
+        """
+        item_table = self.item_table
+        tag_table = self.tag_table
+        result = select([item_table.c.name],
+                        and_(tag_table.c.tag == tag,
+                             tag_table.c.item_id == item_table.c.id)
+                       ).order_by(item_table.c.name).execute()
+        return [name for name, in result]
+
+    def compile_term(self, t):
+        """
+        Translate search term t into a query condition for item_table.
+
+        Only the terms the index is able to answer are translated, the
+        remaining ones are returned as residual term that still needs to be
+        evaluated for every item matching the condition.
+
+        @return: tuple (condition, residual) - condition may be None (no
+                 restriction), residual may be None (nothing to evaluate)
+        """
         item_table = self.item_table
+        if isinstance(t, term.AND):
+            conditions, residuals = [], []
+            for subterm in t.terms:
+                condition, residual = self.compile_term(subterm)
+                if condition is not None:
+                    conditions.append(condition)
+                if residual is not None:
+                    residuals.append(residual)
+            condition = None
+            if conditions:
+                condition = and_(*conditions)
+            if not residuals:
+                residual = None
+            elif len(residuals) == 1:
+                residual = residuals[0]
+            else:
+                residual = term.AND(*residuals)
+            return condition, residual
+        if isinstance(t, term.OR):
+            conditions = []
+            for subterm in t.terms:
+                condition, residual = self.compile_term(subterm)
+                if residual is not None:
+                    # can't answer that part, so we can't answer the OR
+                    return None, t
+                if condition is None:
+                    # subterm matches everything
+                    return None, None
+                conditions.append(condition)
+            return or_(*conditions), None
+        if isinstance(t, term.NOT):
+            condition, residual = self.compile_term(t.term)
+            if residual is None and condition is not None:
+                return not_(condition), None
+            return None, t
+        if isinstance(t, term.NameRE):
+            prefix, exact = name_prefix(t._needle_re)
+            residual = t
+            if exact:
+                residual = None
+            if not prefix:
+                return None, residual
+            # a range condition (instead of LIKE) is case sensitive and can use the name index
+            condition = item_table.c.name >= prefix
+            last = ord(prefix[-1])
+            if last < 0xffff:
+                condition = and_(condition, item_table.c.name < prefix[:-1] + unichr(last + 1))
+            return condition, residual
+        if isinstance(t, (term.ItemMetaDataMatch, term.LastRevisionMetaDataMatch)):
+            if isinstance(t, term.ItemMetaDataMatch):
+                kvstore, ref_column = self.item_kvstore, item_table.c.id
+            else:
+                kvstore, ref_column = self.rev_kvstore, item_table.c.current
+            condition = kvstore.has_value(ref_column, t.key, t.val)
+            if condition is None:
+                # value type not supported for querying
+                return None, t
+            return condition, None
+        if isinstance(t, term.ItemHasMetaDataKey):
+            return self.item_kvstore.has_key(item_table.c.id, t.key), None
+        if isinstance(t, term.LastRevisionHasMetaDataKey):
+            return self.rev_kvstore.has_key(item_table.c.current, t.key), None
+        return None, t
+
+    def item_names(self, condition=None):
+        """
+        return a list of the names of all items matching condition (or of all
+        items, if condition is None), sorted by name
+        """
+        item_table = self.item_table
+        query = select([item_table.c.name])
+        if condition is not None:
+            query = query.where(condition)
+        query = query.order_by(asc(item_table.c.name))
+        return [row[0] for row in query.execute().fetchall()]
+
+    def backrefs(self, item_name):
+        item_table = self.item_table
+        link_table = self.link_table
+        result = select([item_table.c.name],
+                        and_(link_table.c.target == item_name,
+                             link_table.c.item_id == item_table.c.id)
+                       ).distinct().order_by(asc(item_table.c.name)).execute().fetchall()
+        return [row[0] for row in result]
+
+    def wanteds(self):
+        item_table = self.item_table
+        link_table = self.link_table
+        target_items = item_table.alias('target_items')
+        result = select([link_table.c.target, item_table.c.name],
+                        and_(link_table.c.item_id == item_table.c.id,
+                             ~exists().where(target_items.c.name == link_table.c.target))
+                       ).distinct().order_by(asc(item_table.c.name)).execute().fetchall()
+        wanteds = {}
+        for target, name in result:
+            wanteds.setdefault(target, []).append(name)
+        return wanteds
+
+    def orphans(self):
+        item_table = self.item_table
+        link_table = self.link_table
+        rev_table = self.rev_table
         result = select([item_table.c.name],
-                        item_table.c.tags.like('%%|%s|%%' % tag)).execute().fetchall()
+                        and_(item_table.c.current == rev_table.c.id, # only items with revisions
+                             ~exists().where(link_table.c.target == item_table.c.name))
+                       ).order_by(asc(item_table.c.name)).execute().fetchall()
         return [row[0] for row in result]
@@ -90,6 +90,17 @@ class BareRouterBackend(BackendBase):
         """
         return self._get_backend(namespace)[0]
 
+    def _may(self, itemname, right):
+        """
+        Check whether <right> is granted for <itemname> by the backend the
+        item belongs to. Backends without ACL protection grant everything.
+        """
+        backend, itemname, mountpoint = self._get_backend(itemname)
+        may = getattr(backend, '_may', None)
+        if may is None:
+            return True
+        return may(itemname, right)
+
     def iteritems(self):
         """
         Iterate over all items. Necessary for traversal.
@@ -426,6 +437,10 @@ class BareStoredRouterRevision(StoredRevisionBase):
     def size(self):
         return self._revision.size
 
+    @property
+    def local_path(self):
+        return self._revision.local_path
+
     def __getitem__(self, key):
         return self._revision.__getitem__(key)
 
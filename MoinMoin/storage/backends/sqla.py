@@ -43,8 +43,6 @@
     ====
     The following is a list of things that need to be done before this backend can be used productively
     (not including beta tests):
-        * Data.read must be changed to operate on dynamically loaded chunks. I.e., the data._chunks must
-          be set to lazy='dynamic', which will then be a query instead of a collection.
         * Find a proper solution for methods that issue many SQL queries. Especially search_items is
           difficult, as we cannot know what data will be needed in the subsequent processing of the items
           returned, which will result in more queries being issued. Eager loading is only a partial solution.
@@ -69,16 +67,20 @@
 
 from threading import Lock
 
-from sqlalchemy import create_engine, Column, Unicode, Integer, Binary, PickleType, ForeignKey
+from sqlalchemy import create_engine, Column, Unicode, String, Integer, Binary, PickleType, ForeignKey
+from sqlalchemy import select, func, and_, not_, MetaData, Table
 from sqlalchemy.exc import IntegrityError, DataError
-from sqlalchemy.orm import sessionmaker, relation, backref
+from sqlalchemy.orm import sessionmaker, relation, backref, object_session, MapperExtension
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.schema import UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 # Only used/needed for development/testing:
 from sqlalchemy.pool import StaticPool
 
-from MoinMoin.storage import Backend, Item, Revision, NewRevision, StoredRevision
+from MoinMoin import log
+logging = log.getLogger(__name__)
+
+from MoinMoin.storage import Backend, Item, Revision, NewRevision, StoredRevision, HASH_ALGORITHM
 from MoinMoin.storage.error import ItemAlreadyExistsError, NoSuchItemError, NoSuchRevisionError, \
                                    RevisionAlreadyExistsError, StorageError
 
@@ -119,6 +121,7 @@ class SQLAlchemyBackend(Backend):
         # Create the database schema (for all tables)
         SQLAItem.metadata.bind = self.engine
         SQLAItem.metadata.create_all()
+        self._migrate_shared_data()
         # {id : Lockobject} -- lock registry for item metadata locks
         self._item_metadata_lock = {}
 
@@ -270,6 +273,7 @@ class SQLAlchemyBackend(Backend):
                                                   % (revision.revno))
             else:
                 # Flushing of revision succeeded as well. All is fine. We can now commit()
+                self._share_data(session, revision)
                 session.commit()
                 # After committing, the Item has an id and we can create a metadata lock for it
                 self._item_metadata_lock[item.id] = Lock()
@@ -277,6 +281,96 @@ class SQLAlchemyBackend(Backend):
             session.close()
 
 
+    def _migrate_shared_data(self):
+        """
+        Migrate a database created before revisions could share their Data
+        containers: there, each container referred to its revision (by
+        rev_data._revision_id), now the revisions refer to the containers
+        (revisions._data_id) and the containers have a digest and a reference
+        count.
+
+        The digest of the migrated containers stays NULL, as the revision
+        hashes stored back then are not reliable (SQLARevision.write did not
+        update them), so new revisions never share migrated containers.
+        """
+        old_metadata = MetaData()
+        revision_table = Table(SQLARevision.__tablename__, old_metadata, autoload=True, autoload_with=self.engine)
+        if '_data_id' in revision_table.c:
+            return
+        logging.info("migrating database schema: revisions share their data containers")
+        data_table = Table(Data.__tablename__, old_metadata, autoload=True, autoload_with=self.engine)
+        conn = self.engine.connect()
+        trans = conn.begin()
+        try:
+            # there is no ALTER TABLE support in sqlalchemy, these are simple
+            # enough to work on all DBMSs we support
+            conn.execute('ALTER TABLE revisions ADD COLUMN _data_id INTEGER')
+            conn.execute('ALTER TABLE rev_data ADD COLUMN digest VARCHAR(128)')
+            conn.execute('ALTER TABLE rev_data ADD COLUMN refs INTEGER')
+            revisions = SQLARevision.__table__
+            data = Data.__table__
+            conn.execute(revisions.update().values(
+                _data_id=select([data_table.c.id], data_table.c._revision_id == revisions.c.id).as_scalar()))
+            conn.execute(data.update().values(refs=1))
+            for table, column in [(revisions, '_data_id'), (data, 'digest'), ]:
+                for index in table.indexes:
+                    if column in index.columns:
+                        index.create(bind=conn)
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _share_data(self, session, revision):
+        """
+        Store the same content only once: if there already is a Data container
+        with the content hash of the (flushed) revision, let the revision use
+        it and delete the new one.
+        """
+        data = revision._data
+        data.digest = revision[HASH_ALGORITHM]
+        existing = session.query(Data).filter(and_(Data.digest == data.digest, Data.id != data.id)).first()
+        if existing is not None:
+            existing.refs = Data.refs + 1
+            revision._data = existing
+            session.delete(data)
+
+    def collect_garbage(self):
+        """
+        Mark and sweep: fix the reference counts of the Data containers, delete
+        the ones not used by any revision and chunks without a container.
+        Only use this while the backend is not in use.
+
+        @return: number of deleted Data containers
+        """
+        data_table = Data.__table__
+        chunk_table = Chunk.__table__
+        revision_table = SQLARevision.__table__
+        conn = self.engine.connect()
+        trans = conn.begin()
+        try:
+            counts = dict(conn.execute(select([revision_table.c._data_id, func.count(revision_table.c.id)])
+                                       .group_by(revision_table.c._data_id)).fetchall())
+            removed = 0
+            for data_id, refs in conn.execute(select([data_table.c.id, data_table.c.refs])).fetchall():
+                count = counts.get(data_id, 0)
+                if not count:
+                    conn.execute(chunk_table.delete().where(chunk_table.c._container_id == data_id))
+                    conn.execute(data_table.delete().where(data_table.c.id == data_id))
+                    removed += 1
+                elif count != refs:
+                    conn.execute(data_table.update().where(data_table.c.id == data_id).values(refs=count))
+            conn.execute(chunk_table.delete().where(not_(chunk_table.c._container_id.in_(select([data_table.c.id])))))
+            trans.commit()
+        except:
+            trans.rollback()
+            raise
+        finally:
+            conn.close()
+        return removed
+
     def _rollback_item(self, revision):
         """
         @see: Backend._rollback_item.__doc__
@@ -443,23 +537,40 @@ class Chunk(Base):
         return len(data)
 
 
+class DataExtension(MapperExtension):
+    def before_delete(self, mapper, connection, instance):
+        """
+        Delete the chunks of a Data container without loading them.
+        """
+        connection.execute(Chunk.__table__.delete().where(Chunk._container_id == instance.id))
+
+
 class Data(Base):
     """
     Data that is assembled from smaller chunks.
     Bookkeeping is done here.
+
+    Revisions with the same content share one Data container (see
+    SQLAlchemyBackend._share_data), it is deleted with the last of them.
     """
     __tablename__ = 'rev_data'
+    __mapper_args__ = {'extension': DataExtension()}
 
     id = Column(Integer, primary_key=True)
-    # We need to use the following cascade to add/delete the chunks from the database, if
-    # Data is added/deleted.
-    _chunks = relation(Chunk, order_by=Chunk.id, cascade='save-update, delete, delete-orphan')
-    _revision_id = Column(Integer, ForeignKey('revisions.id'))
+    # We need to use the following cascade to add the chunks to the database, if Data
+    # is added (DataExtension deletes them). The chunks are never loaded all at once,
+    # _chunks is a query.
+    _chunks = relation(Chunk, order_by=Chunk.chunkno, lazy='dynamic',
+                       cascade='save-update', passive_deletes='all')
     size = Column(Integer)
+    # content hash (HASH_ALGORITHM) and number of revisions using this container
+    digest = Column(String(128), index=True)
+    refs = Column(Integer)
 
     def __init__(self):
         self.setup()
         self.size = 0
+        self.refs = 1
 
     # XXX use sqla reconstructor
     def setup(self):
@@ -469,6 +580,8 @@ class Data(Base):
         self.chunkno = 0
         self._last_chunk = Chunk(self.chunkno)
         self.cursor_pos = 0
+        # the last chunk we read: (chunkno, data)
+        self._cached_chunk = (None, None)
 
     def write(self, data):
         """
@@ -477,22 +590,50 @@ class Data(Base):
         Only the last chunk may not be filled completely.
         This does *only* support sequential writing of data, because otherwise
         we'd need to re-order potentially all chunks after the cursor position.
+        Full chunks are flushed to the DB immediately (if we have a session), so
+        we never keep more than one chunk in memory.
 
         @type data: str
         @param data: The data we want to split and write to the DB in chunks.
         """
-        # XXX This currently relies on the autoflush feature of the session. It should ideally
-        #     flush after every chunk.
+        self._cached_chunk = (None, None)
         while data:
-            written = self._last_chunk.write(data)
-            if written:
-                self.size += written
-                data = data[written:]
-            else:
+            chunk = self._last_chunk
+            written = chunk.write(data)
+            self.size += written
+            data = data[written:]
+            if len(chunk._data) >= chunk.chunksize:
+                self._chunks.append(chunk)
+                session = object_session(self)
+                if session is not None:
+                    session.flush([self, chunk])
                 self.chunkno += 1
-                self._chunks.append(self._last_chunk)
                 self._last_chunk = Chunk(self.chunkno)
 
+    def _get_chunks(self, chunkno_first, chunkno_last):
+        """
+        Yield the data of the chunks chunkno_first .. chunkno_last (in that
+        order), fetching only those from the DB.
+        """
+        if chunkno_first > chunkno_last:
+            return
+        session = object_session(self)
+        if session is None:
+            # not stored, we only have the chunks in memory
+            chunks = [chunk for chunk in self._chunks
+                      if chunkno_first <= chunk.chunkno <= chunkno_last]
+            chunks.sort(key=lambda chunk: chunk.chunkno)
+            for chunk in chunks:
+                yield chunk.data
+        elif self.id is not None:
+            # otherwise, there are no chunks in the DB yet
+            query = session.query(Chunk._data).filter(Chunk._container_id == self.id)
+            query = query.filter(Chunk.chunkno.between(chunkno_first, chunkno_last))
+            # let the DB stream the rows (for DBs supporting server side cursors)
+            query = query.order_by(Chunk.chunkno).execution_options(stream_results=True)
+            for data, in query:
+                yield str(data)
+
     def read(self, amount=None):
         """
         The given amount of data is read from the smaller chunks that are contained in this
@@ -529,8 +670,14 @@ class Data(Base):
             chunkno_last -= 1
             tail_offset = chunksize
 
-        chunks = [chunk.data for chunk in self._chunks[chunkno_first:chunkno_last+1]]
+        cached_chunkno, cached_data = self._cached_chunk
+        if chunkno_first == cached_chunkno and chunkno_first <= chunkno_last:
+            # sequential reads often start in the chunk the last read ended in
+            chunks = [cached_data] + list(self._get_chunks(chunkno_first + 1, chunkno_last))
+        else:
+            chunks = list(self._get_chunks(chunkno_first, chunkno_last))
         if chunks:
+            self._cached_chunk = (chunkno_last, chunks[-1])
             # make sure that there is at least one chunk to operate on
             # if there is no chunk at all, we have empty data
             if chunkno_first != chunkno_last:
@@ -567,9 +714,24 @@ class Data(Base):
 
     def close(self):
         """
-        Close the Data container. Append the last chunk.
+        Close the Data container. Append the last chunk (if it has data).
+        """
+        if self._last_chunk._data:
+            self._chunks.append(self._last_chunk)
+
+
+class RevisionExtension(MapperExtension):
+    def after_delete(self, mapper, connection, instance):
+        """
+        Drop the reference of a deleted revision to its Data container,
+        delete the container (and its chunks) if that was the last one.
         """
-        self._chunks.append(self._last_chunk)
+        data_table = Data.__table__
+        data_id = instance._data_id
+        connection.execute(data_table.update().where(data_table.c.id == data_id).values(refs=data_table.c.refs - 1))
+        if connection.execute(select([data_table.c.refs], data_table.c.id == data_id)).scalar() <= 0:
+            connection.execute(Chunk.__table__.delete().where(Chunk._container_id == data_id))
+            connection.execute(data_table.delete().where(data_table.c.id == data_id))
 
 
 class SQLARevision(NewRevision, Base):
@@ -580,10 +742,13 @@ class SQLARevision(NewRevision, Base):
     __tablename__ = 'revisions'
     # Impose a UniqueConstraint so only one revision with a specific revno may exist on one item
     __table_args__ = (UniqueConstraint('_item_id', '_revno'), {})
+    __mapper_args__ = {'extension': RevisionExtension()}
 
     id = Column(Integer, primary_key=True)
-    # We need to add/delete the Data container of this revision when the revision is added/deleted
-    _data = relation(Data, uselist=False, lazy=False, cascade='save-update, delete, delete-orphan')
+    # We need to add the Data container of this revision when the revision is added,
+    # RevisionExtension deletes it (if no other revision uses it)
+    _data_id = Column(Integer, ForeignKey('rev_data.id'), index=True)
+    _data = relation(Data, uselist=False, lazy=False, cascade='save-update')
     _item_id = Column(Integer, ForeignKey('items.id'), index=True)
     # If the item is deleted, delete this revision as well.
     _item = relation(SQLAItem, backref=backref('_revisions', cascade='delete, delete-orphan', lazy=True), cascade='', uselist=False, lazy=False)
@@ -621,6 +786,7 @@ class SQLARevision(NewRevision, Base):
         """
         Write the given amount of data.
         """
+        self._rev_hash.update(data)
         self._data.write(data)
 
     def read(self, amount=None):
@@ -21,6 +21,7 @@ import time, base64
 import copy
 import hashlib
 import hmac
+import threading
 
 from MoinMoin.util import md5crypt
 
@@ -37,6 +38,7 @@ from flask import flaskg, session, request, url_for
 from MoinMoin import config, wikiutil
 from MoinMoin.i18n import _, L_, N_
 from MoinMoin.util import random_string
+from MoinMoin.util.lru import LRUDict
 from MoinMoin.util.interwiki import getInterwikiHome
 
 
@@ -99,6 +101,72 @@ def get_user_backend():
     return flaskg.unprotected_storage.get_backend(ns_user_profile)
 
 
+def get_user_index():
+    """
+    Return the user profile index (see MoinMoin.storage.backends.indexing.UserIndex).
+
+    If the index is empty, but there are user profiles (e.g. first run after
+    an upgrade), it gets rebuilt first.
+    """
+    index = flaskg.unprotected_storage.user_index
+    if not index.synced:
+        if not index.count():
+            rebuild_user_index(index)
+        index.synced = True
+    return index
+
+
+def rebuild_user_index(index=None):
+    """
+    Rebuild the user profile index from the user profiles.
+    """
+    if index is None:
+        index = flaskg.unprotected_storage.user_index
+    profiles = ((item.name, dict((key, item[key]) for key in item.keys()))
+                for item in get_user_backend().iteritems())
+    index.rebuild(profiles)
+    index.synced = True
+
+
+class ProfileCache(object):
+    """
+    Process-wide cache of user profile data (uid -> (stamp, profile dict)).
+
+    An entry is only valid as long as the user's stamp in the user profile
+    index did not change (see UserIndex.get_stamp), so we can skip loading
+    the user profile item for every request of a logged-in user.
+    """
+    def __init__(self, size=1000):
+        self.size = size
+        self._entries = LRUDict()
+        self._lock = threading.Lock()
+
+    def get(self, uid, stamp):
+        """
+        return a copy of the cached profile data of user <uid>, None if
+        there is none (for this stamp).
+        """
+        with self._lock:
+            entry = self._entries.pop(uid, None)
+            if entry is None or entry[0] != stamp:
+                return None
+            self._entries[uid] = entry # most recently used
+        return copy.deepcopy(entry[1])
+
+    def put(self, uid, stamp, data):
+        with self._lock:
+            self._entries.pop(uid, None)
+            self._entries[uid] = stamp, copy.deepcopy(data)
+            while len(self._entries) > self.size:
+                self._entries.popitem() # least recently used
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._entries.pop(uid, None)
+
+profile_cache = ProfileCache()
+
+
 def getUserList():
     """ Get a list of all (numerical) user IDs.
 
@@ -109,12 +177,24 @@ def getUserList():
     return [item.name for item in all_users]
 
 
-def get_by_filter(key, value):
-    """ Searches for an user with a given filter """
-    from MoinMoin.search import term
-    filter = term.ItemMetaDataMatch(key, value)
-    items = get_user_backend().search_items(filter)
-    users = [User(item.name) for item in items]
+def get_by_filter(key, value, prefix=False):
+    """ Searches for users with a given filter
+
+    @param key: user profile key ('name', 'email' or 'openid' are looked up in
+                the user profile index, others need loading all profiles)
+    @param value: the value to filter with
+    @param prefix: if True, find users whose <key> value starts with <value>
+                   (only for keys in the user profile index)
+    @rtype: list of user objects
+    """
+    index = get_user_index()
+    if key in index.KEYS:
+        uids = index.user_ids(key, value, prefix=prefix)
+    else:
+        from MoinMoin.search import term
+        filter = term.ItemMetaDataMatch(key, value)
+        uids = [item.name for item in get_user_backend().search_items(filter)]
+    users = [User(uid) for uid in uids]
     return users
 
 
@@ -144,14 +224,9 @@ def getUserId(searchName):
     @rtype: string
     @return: the corresponding user ID or None
     """
-    from MoinMoin.search import term
-    try:
-        backend = get_user_backend()
-        for user in backend.search_items(term.ItemMetaDataMatch('name', searchName)):
-            return user.name
-        return None
-    except IndexError:
-        return None
+    uids = get_user_index().user_ids('name', searchName)
+    if uids:
+        return uids[0]
 
 
 def get_editor(userid, addr, hostname):
@@ -355,14 +430,19 @@ class User(object):
         @param password: If not None, then the given password must match the
                          password in the user account file.
         """
-        if not self.exists():
-            return
+        stamp = get_user_index().get_stamp(self.id)
+        user_data = stamp and profile_cache.get(self.id, stamp)
+        if not user_data:
+            if not self.exists():
+                return
 
-        self._user = self._user_backend.get_item(self.id)
+            self._user = self._user_backend.get_item(self.id)
 
-        user_data = dict()
-        for metadata_key in self._user:
-            user_data[metadata_key] = self._user[metadata_key]
+            user_data = dict()
+            for metadata_key in self._user:
+                user_data[metadata_key] = self._user[metadata_key]
+            if stamp:
+                profile_cache.put(self.id, stamp, user_data)
 
         # Validate data from user file. In case we need to change some
         # values, we set 'changed' flag, and later save the user data.
@@ -499,6 +579,8 @@ class User(object):
             self._user[key] = value
 
         self._user.publish_metadata()
+        profile_cache.invalidate(self.id)
+        get_user_index().update_user(self.id, dict(attrs))
 
         if not self.disabled:
             self.valid = 1
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+    MoinMoin - MoinMoin.util.diff_engine Tests
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import random
+
+import py
+
+from MoinMoin.util.diff_engine import matching_blocks, opcodes, words, DiffLimitError
+from MoinMoin.util import diff_html
+
+
+def lcs_length(a, b):
+    """ length of the longest common subsequence (dynamic programming) """
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            if x == y:
+                current.append(previous[j] + 1)
+            else:
+                current.append(max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+class TestDiffEngine(object):
+    def test_minimal(self):
+        rnd = random.Random(42)
+        for i in range(500):
+            a = [rnd.choice('abc') for j in range(rnd.randint(0, 12))]
+            b = [rnd.choice('abc') for j in range(rnd.randint(0, 12))]
+            blocks = matching_blocks(a, b)
+            assert blocks[-1] == (len(a), len(b), 0)
+            last_i = last_j = 0
+            for i, j, n in blocks:
+                assert i >= last_i and j >= last_j
+                assert a[i:i+n] == b[j:j+n]
+                last_i, last_j = i + n, j + n
+            assert sum(n for i, j, n in blocks) == lcs_length(a, b)
+
+    def test_opcodes(self):
+        a = 'one two three four five'.split()
+        b = 'zero one three four 4 five six'.split()
+        assert opcodes(a, b) == [('insert', 0, 0, 0, 1),
+                                 ('equal', 0, 1, 1, 2),
+                                 ('delete', 1, 2, 2, 2),
+                                 ('equal', 2, 4, 2, 4),
+                                 ('insert', 4, 4, 4, 5),
+                                 ('equal', 4, 5, 5, 6),
+                                 ('insert', 5, 5, 6, 7),
+                                ]
+        assert opcodes(['a', 'b'], ['A', 'b'], key=lambda s: s.lower()) == [('equal', 0, 2, 0, 2)]
+
+    def test_work_limit(self):
+        a = [str(i) for i in range(1000)]
+        b = [str(i) for i in range(500, 1500)]
+        assert matching_blocks(a, b) == [(500, 0, 500), (1000, 1000, 0)]
+        # out of budget: common prefix / suffix only, the rest is changed
+        a = ['x'] + a + ['y']
+        b = ['x'] + b + ['y']
+        assert matching_blocks(a, b, work_limit=10) == [(0, 0, 1), (1001, 1001, 1), (1002, 1002, 0)]
+        py.test.raises(DiffLimitError, matching_blocks, a, b, work_limit=10, exact=True)
+
+    def test_words(self):
+        assert words(u'foo  bar, baz') == [u'foo', u'  ', u'bar', u',', u' ', u'baz']
+
+    def test_diff_html(self):
+        assert diff_html.diff(u'a\nb\nc', u'a\nb\nc') == []
+        result = diff_html.diff(u'a\nthe old text\nc', u'a\nthe new text\nc')
+        assert result == [(2, u'the <span>old</span> text', 2, u'the <span>new</span> text')]
+
+
+coverage_modules = ['MoinMoin.util.diff_engine']
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+    MoinMoin - MoinMoin.util.kvstore Tests
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import datetime
+
+import py
+
+from sqlalchemy import MetaData, Integer, create_engine
+
+from MoinMoin.util.kvstore import KVStoreMeta, KVStore, escape_like
+
+
+def test_escape_like():
+    assert escape_like(u'50%_a\\b') == u'50\\%\\_a\\\\b'
+    assert escape_like(u'plain') == u'plain'
+
+
+class TestKVStore(object):
+
+    def setup_method(self, method):
+        metadata = MetaData()
+        metadata.bind = create_engine('sqlite://')
+        self.kvstore = KVStore(KVStoreMeta('test', metadata, Integer))
+        metadata.create_all()
+
+    def test_store_retrieve_kv(self):
+        kvs = {u'unicode': u'\xe4\xf6\xfc', u'int': 42, u'datetime': datetime.datetime(2011, 1, 2, 3, 4, 5),
+               u'list': [1, u'two'], u'tuple': (u'a', ), u'same': u'\xe4\xf6\xfc', }
+        self.kvstore.store_kv(1, kvs)
+        self.kvstore.store_kv(2, {u'int': 23})
+        assert self.kvstore.retrieve_kv(1) == kvs
+        assert self.kvstore.retrieve_kv(2) == {u'int': 23}
+        assert self.kvstore.retrieve_kv(3) == {}
+        assert self.kvstore.retrieve(1, u'list') == [1, u'two']
+
+    def test_store_kv_replaces(self):
+        self.kvstore.store_kv(1, {u'a': u'1', u'b': u'2'})
+        self.kvstore.store_kv(1, {u'a': u'3'})
+        assert self.kvstore.retrieve_kv(1) == {u'a': u'3'}
+        self.kvstore.store_kv(1, {})
+        assert self.kvstore.retrieve_kv(1) == {}
+
+    def test_store_kv_wrong_type(self):
+        self.kvstore.store_kv(1, {u'a': u'1'})
+        py.test.raises(AssertionError, self.kvstore.store_kv, 1, {u'a': 1, u'b': u'2'})
+        # transaction was rolled back
+        assert self.kvstore.retrieve_kv(1) == {u'a': u'1'}
+        self.kvstore.store_kv(1, {u'b': u'2'})
+        assert self.kvstore.retrieve_kv(1) == {u'b': u'2'}
+
+    def test_retrieve_kv_many(self):
+        for ref_id in range(10):
+            self.kvstore.store_kv(ref_id, {u'ref': ref_id, u'even': u'%s' % (ref_id % 2 == 0)})
+        self.kvstore.IN_CHUNK_SIZE = 3 # make sure we need multiple chunks
+        result = self.kvstore.retrieve_kv_many(range(12))
+        assert sorted(result) == range(10)
+        for ref_id in range(10):
+            assert result[ref_id] == {u'ref': ref_id, u'even': u'%s' % (ref_id % 2 == 0)}
+
+    def test_key_cache(self):
+        self.kvstore.store_kv(1, {u'a': u'1'})
+        assert u'a' in self.kvstore._key_cache
+        self.kvstore.clear_cache()
+        assert self.kvstore._key_cache == {}
+        self.kvstore.store_kv(2, {u'a': u'2'})
+        assert self.kvstore.retrieve_kv(2) == {u'a': u'2'}
+
+
+coverage_modules = ['MoinMoin.util.kvstore']
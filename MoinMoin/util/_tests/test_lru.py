@@ -0,0 +1,44 @@
+# -*- coding: iso-8859-1 -*-
+"""
+    MoinMoin - MoinMoin.util.lru Tests
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import py
+
+from MoinMoin.util.lru import LRUDict
+
+
+class TestLRUDict(object):
+    def test_order(self):
+        lru = LRUDict()
+        for key in 'abc':
+            lru[key] = key.upper()
+        assert len(lru) == 3
+        assert 'a' in lru and lru['a'] == 'A' and lru.get('x') is None
+        lru['a'] = lru.pop('a') # most recently used
+        assert lru.pop('b') == 'B'
+        assert lru.pop('b', 'default') == 'default'
+        lru['d'] = 'D'
+        assert [lru.popitem() for i in range(3)] == [('c', 'C'), ('a', 'A'), ('d', 'D')]
+        py.test.raises(KeyError, lru.popitem)
+
+    def test_compaction(self):
+        lru = LRUDict()
+        for i in range(1000):
+            lru[i % 10] = i
+        assert len(lru) == 10
+        assert len(lru._queue) <= 2 * 10 + 100
+        assert [lru.popitem()[0] for i in range(10)] == range(10)
+
+    def test_clear(self):
+        lru = LRUDict()
+        lru['a'] = 'A'
+        lru.clear()
+        assert len(lru) == 0
+        py.test.raises(KeyError, lru.popitem)
+
+
+coverage_modules = ['MoinMoin.util.lru']
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+    MoinMoin - MoinMoin.util.send_file Tests
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import os
+import tempfile
+from StringIO import StringIO
+
+from MoinMoin.util.send_file import parse_range, send_file
+
+DATA = '0123456789' * 10
+
+
+def test_parse_range():
+    for value, expected in [
+        (None, None),
+        ('', None),
+        ('bytes=0-9', (0, 10)),
+        ('bytes=10-', (10, 100)),
+        ('bytes=-10', (90, 100)),
+        ('bytes=-1000', (0, 100)),
+        ('bytes=90-1000', (90, 100)),
+        ('bytes=100-', (100, 100)), # not satisfiable
+        ('bytes=200-300', (200, 200)), # not satisfiable
+        ('bytes=-0', (100, 100)), # not satisfiable
+        ('bytes=5-3', None),
+        ('bytes=0-1,5-6', None),
+        ('bytes=x-y', None),
+        ('items=0-9', None),
+       ]:
+        assert parse_range(value, len(DATA)) == expected
+
+
+class TestSendFile(object):
+    def _get(self, headers=None, **kw):
+        with self.app.test_request_context('/', headers=headers or {}):
+            rv = send_file(mimetype='text/plain', etag='abc', conditional=True, **kw)
+            status, headers = rv.status_code, rv.headers
+            if status == 304:
+                return status, headers, ''
+            return status, headers, ''.join(rv.response)
+
+    def test_full(self):
+        status, headers, data = self._get(file=StringIO(DATA), content_length=len(DATA))
+        assert status == 200
+        assert data == DATA
+        assert headers['Content-Length'] == str(len(DATA))
+        assert headers['Accept-Ranges'] == 'bytes'
+
+    def test_range(self):
+        status, headers, data = self._get({'Range': 'bytes=10-19'}, file=StringIO(DATA), content_length=len(DATA))
+        assert status == 206
+        assert data == DATA[10:20]
+        assert headers['Content-Range'] == 'bytes 10-19/100'
+        assert headers['Content-Length'] == '10'
+
+    def test_range_filename(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, DATA)
+            os.close(fd)
+            status, headers, data = self._get({'Range': 'bytes=-5'}, filename=path)
+            assert status == 206
+            assert data == DATA[-5:]
+            assert headers['Content-Range'] == 'bytes 95-99/100'
+        finally:
+            os.remove(path)
+
+    def test_range_not_satisfiable(self):
+        status, headers, data = self._get({'Range': 'bytes=200-'}, file=StringIO(DATA), content_length=len(DATA))
+        assert status == 416
+        assert headers['Content-Range'] == 'bytes */100'
+
+    def test_if_range(self):
+        status, headers, data = self._get({'Range': 'bytes=0-9', 'If-Range': '"abc"'}, file=StringIO(DATA), content_length=len(DATA))
+        assert status == 206
+        assert data == DATA[:10]
+        status, headers, data = self._get({'Range': 'bytes=0-9', 'If-Range': '"other"'}, file=StringIO(DATA), content_length=len(DATA))
+        assert status == 200
+        assert data == DATA
+
+    def test_not_modified(self):
+        status, headers, data = self._get({'If-None-Match': '"abc"', 'Range': 'bytes=0-9'}, file=StringIO(DATA), content_length=len(DATA))
+        assert status == 304
+
+    def test_unknown_length(self):
+        status, headers, data = self._get({'Range': 'bytes=0-9'}, file=StringIO(DATA))
+        assert status == 200
+        assert data == DATA
+        assert 'Accept-Ranges' not in headers
+
+
+coverage_modules = ['MoinMoin.util.send_file']
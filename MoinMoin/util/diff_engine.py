@@ -0,0 +1,217 @@
+# -*- coding: iso-8859-1 -*-
+"""
+    MoinMoin - diff engine
+
+    Computes the matching blocks of two sequences (like
+    difflib.SequenceMatcher.get_matching_blocks) using the linear space
+    variant of Myers' O(ND) difference algorithm, so the diff is minimal and
+    the time needed depends on the size of the changes, not on the size of
+    the sequences.
+
+    The sequence elements (e.g. lines) are interned to ints first, so the
+    algorithm only compares ints. Common prefixes and suffixes are matched
+    before running the algorithm.
+
+    To keep huge, very different inputs from taking ages, the work done is
+    limited (see DIFF_WORK_LIMIT). If the limit is reached, the remaining
+    differing parts are treated as completely changed - the diff is still
+    correct, just not minimal (or, if the caller asks for it, DiffLimitError
+    gets raised).
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+import re
+
+# max. number of steps (over all diagonals) the algorithm may do per diff
+DIFF_WORK_LIMIT = 2000000
+
+# splits text into words, whitespace and other chars (see words)
+WORDS_RE = re.compile(r'(\s+|\w+|[^\w\s])', re.U)
+
+
+class DiffLimitError(Exception):
+    """
+    the work limit was reached before the (minimal) diff was found
+    """
+
+
+def intern_sequences(a, b, key=None):
+    """
+    return a and b as lists of ints, equal elements (or elements with
+    equal key(element), if key is given) get the same int.
+    """
+    ids = {}
+    result = []
+    for seq in (a, b):
+        interned = []
+        for element in seq:
+            if key is not None:
+                element = key(element)
+            interned.append(ids.setdefault(element, len(ids)))
+        result.append(interned)
+    return result
+
+
+def words(text):
+    """
+    split <text> into a list of words, whitespace and other chars (joining
+    the list gives text again)
+    """
+    return [token for token in WORDS_RE.split(text) if token]
+
+
+class _Budget(object):
+    def __init__(self, work, exact=False):
+        self.work = work
+        self.exact = exact
+
+
+def _middle_snake(a, a0, a1, b, b0, b1, budget):
+    """
+    find the middle snake of the shortest edit script of a[a0:a1] and
+    b[b0:b1] (which must both be non-empty and differ in the first and
+    last elements).
+
+    @return: (x0, y0, x1, y1), the snake goes from a[x0], b[y0] to
+             a[x1], b[y1] (exclusive), or None if the budget is exhausted
+    """
+    n = a1 - a0
+    m = b1 - b0
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2
+    offset = max_d + 1
+    forward = [0] * (2 * max_d + 3)
+    backward = [0] * (2 * max_d + 3)
+    for d in xrange(max_d + 1):
+        budget.work -= d + 1
+        if budget.work < 0:
+            return None
+        # forward paths
+        for k in xrange(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            budget.work -= x - start_x
+            forward[offset + k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1):
+                if x + backward[offset + delta - k] >= n:
+                    return a0 + start_x, b0 + start_y, a0 + x, b0 + y
+        # backward paths (x, y are the distances from the ends)
+        for k in xrange(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            start_x, start_y = x, y
+            while x < n and y < m and a[a1 - 1 - x] == b[b1 - 1 - y]:
+                x += 1
+                y += 1
+            budget.work -= x - start_x
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d:
+                if x + forward[offset + delta - k] >= n:
+                    return a1 - x, b1 - y, a1 - start_x, b1 - start_y
+
+
+def _diff(a, a0, a1, b, b0, b1, blocks, budget):
+    """
+    append the matching blocks (i, j, n) of a[a0:a1] and b[b0:b1] to <blocks>
+    """
+    # common prefix
+    start = a0
+    while a0 < a1 and b0 < b1 and a[a0] == b[b0]:
+        a0 += 1
+        b0 += 1
+    if a0 > start:
+        blocks.append((start, b0 - (a0 - start), a0 - start))
+    # common suffix
+    end = a1
+    while a1 > a0 and b1 > b0 and a[a1 - 1] == b[b1 - 1]:
+        a1 -= 1
+        b1 -= 1
+    if a0 < a1 and b0 < b1:
+        snake = _middle_snake(a, a0, a1, b, b0, b1, budget)
+        if snake is not None:
+            x0, y0, x1, y1 = snake
+            _diff(a, a0, x0, b, b0, y0, blocks, budget)
+            if x1 > x0:
+                blocks.append((x0, y0, x1 - x0))
+            _diff(a, x1, a1, b, y1, b1, blocks, budget)
+        elif budget.exact:
+            raise DiffLimitError()
+        # else: out of budget, treat the rest as changed
+    if end > a1:
+        blocks.append((a1, b1, end - a1))
+
+
+def matching_blocks(a, b, key=None, work_limit=None, exact=False):
+    """
+    Find the matching blocks of sequences <a> and <b> (of hashable elements).
+
+    @param key: if given, compare key(element) instead of the elements
+    @param work_limit: max. work to do (default: DIFF_WORK_LIMIT)
+    @param exact: raise DiffLimitError if the work limit is reached (default:
+                  treat the rest as changed)
+    @return: list of (i, j, n) tuples meaning a[i:i+n] == b[j:j+n], ordered
+             and adjacent blocks merged, the last one is (len(a), len(b), 0)
+             (see difflib.SequenceMatcher.get_matching_blocks)
+    """
+    a, b = intern_sequences(a, b, key)
+    if work_limit is None:
+        work_limit = DIFF_WORK_LIMIT
+    blocks = []
+    _diff(a, 0, len(a), b, 0, len(b), blocks, _Budget(work_limit, exact))
+    merged = []
+    for i, j, n in blocks:
+        if merged:
+            last_i, last_j, last_n = merged[-1]
+            if last_i + last_n == i and last_j + last_n == j:
+                merged[-1] = (last_i, last_j, last_n + n)
+                continue
+        merged.append((i, j, n))
+    merged.append((len(a), len(b), 0))
+    return merged
+
+
+def opcodes(a, b, key=None, work_limit=None, exact=False):
+    """
+    Find the operations transforming <a> into <b> (see matching_blocks for
+    the parameters).
+
+    @return: list of (tag, i1, i2, j1, j2) tuples, tag is 'equal', 'replace',
+             'delete' or 'insert' (see difflib.SequenceMatcher.get_opcodes)
+    """
+    result = []
+    i = j = 0
+    for block_i, block_j, n in matching_blocks(a, b, key, work_limit, exact):
+        if i < block_i and j < block_j:
+            result.append(('replace', i, block_i, j, block_j))
+        elif i < block_i:
+            result.append(('delete', i, block_i, j, j))
+        elif j < block_j:
+            result.append(('insert', i, i, j, block_j))
+        if n:
+            result.append(('equal', block_i, block_i + n, block_j, block_j + n))
+        i, j = block_i + n, block_j + n
+    return result
+
+
+def ratio(blocks, length):
+    """
+    similarity of two sequences with total length <length> and matching
+    blocks <blocks>, as a float in [0, 1] (see difflib.SequenceMatcher.ratio)
+    """
+    if not length:
+        return 1.0
+    return 2.0 * sum(n for i, j, n in blocks) / length
+
@@ -7,11 +7,13 @@
     @license: GNU GPL, see COPYING for details.
 """
 
-import difflib
-
 from werkzeug import escape
 
 from MoinMoin.i18n import _, L_, N_
+from MoinMoin.util.diff_engine import matching_blocks, ratio, words
+
+# changed parts longer than this (in chars) are not compared word by word
+REFINE_MAX_SIZE = 10000
 
 def indent(line):
     eol = ''
@@ -36,8 +38,7 @@ def diff(old, new):
     seq1 = old.splitlines()
     seq2 = new.splitlines()
 
-    seqobj = difflib.SequenceMatcher(None, seq1, seq2)
-    linematch = seqobj.get_matching_blocks()
+    linematch = matching_blocks(seq1, seq2)
 
     result = []
 
@@ -66,10 +67,15 @@ def diff(old, new):
                     rightpane += '\n'
                 rightpane += seq2[lastmatch[1] + line]
 
-        charobj = difflib.SequenceMatcher(None, leftpane, rightpane)
-        charmatch = charobj.get_matching_blocks()
+        # compare the changed lines word by word (if they are not too big)
+        leftwords = words(leftpane)
+        rightwords = words(rightpane)
+        if len(leftpane) + len(rightpane) <= REFINE_MAX_SIZE:
+            charmatch = matching_blocks(leftwords, rightwords)
+        else:
+            charmatch = [(len(leftwords), len(rightwords), 0)]
 
-        if charobj.ratio() < 0.5:
+        if ratio(charmatch, len(leftwords) + len(rightwords)) < 0.5:
             # Insufficient similarity.
             if leftpane:
                 leftresult = """<span>%s</span>""" % indent(escape(leftpane))
@@ -89,12 +95,12 @@ def diff(old, new):
             for thismatch in charmatch:
                 if thismatch[0] - charlast[0] != 0:
                     leftresult += """<span>%s</span>""" % indent(
-                        escape(leftpane[charlast[0]:thismatch[0]]))
+                        escape(''.join(leftwords[charlast[0]:thismatch[0]])))
                 if thismatch[1] - charlast[1] != 0:
                     rightresult += """<span>%s</span>""" % indent(
-                        escape(rightpane[charlast[1]:thismatch[1]]))
-                leftresult += escape(leftpane[thismatch[0]:thismatch[0] + thismatch[2]])
-                rightresult += escape(rightpane[thismatch[1]:thismatch[1] + thismatch[2]])
+                        escape(''.join(rightwords[charlast[1]:thismatch[1]])))
+                leftresult += escape(''.join(leftwords[thismatch[0]:thismatch[0] + thismatch[2]]))
+                rightresult += escape(''.join(rightwords[thismatch[1]:thismatch[1] + thismatch[2]]))
                 charlast = (thismatch[0] + thismatch[2], thismatch[1] + thismatch[2])
 
         leftpane = '<br>'.join([indent(x) for x in leftresult.splitlines()])
@@ -1,12 +1,12 @@
 # -*- coding: iso-8859-1 -*-
 """
-    MoinMoin - simple text diff (uses difflib)
+    MoinMoin - simple text diff (uses MoinMoin.util.diff_engine)
 
     @copyright: 2006 MoinMoin:ThomasWaldmann
     @license: GNU GPL, see COPYING for details.
 """
 
-import difflib
+from MoinMoin.util.diff_engine import opcodes
 
 def diff(oldlines, newlines, **kw):
     """
@@ -18,13 +18,22 @@ def diff(oldlines, newlines, **kw):
     @rtype: list
     @return: lines like diff tool does output.
     """
-    false = lambda s: None
     if kw.get('ignorews', 0):
-        d = difflib.Differ(false)
+        key = lambda line: u' '.join(line.split())
     else:
-        d = difflib.Differ(false, false)
+        key = None
 
-    lines = list(d.compare(oldlines, newlines))
+    lines = []
+    for tag, i1, i2, j1, j2 in opcodes(oldlines, newlines, key=key):
+        removed = ['- ' + line for line in oldlines[i1:i2]]
+        added = ['+ ' + line for line in newlines[j1:j2]]
+        if tag == 'equal':
+            lines.extend(['  ' + line for line in oldlines[i1:i2]])
+        elif j2 - j1 < i2 - i1:
+            # like difflib.Differ: shorter block of a replacement first
+            lines.extend(added + removed)
+        else:
+            lines.extend(removed + added)
 
     # return empty list if there were no changes
     changed = 0
@@ -12,7 +12,16 @@ from UserDict import DictMixin
 from sqlalchemy import MetaData, Table, Column
 from sqlalchemy import Integer, String, Unicode, DateTime, PickleType, ForeignKey
 from sqlalchemy import select
-from sqlalchemy.sql import and_, exists
+from sqlalchemy.sql import and_, or_, exists, cast, null, union_all
+
+
+def escape_like(text):
+    """
+    escape the wildcards of a LIKE pattern (escape char: backslash)
+    """
+    for char in u'\\%_':
+        text = text.replace(char, u'\\' + char)
+    return text
 
 
 class KVStoreMeta(object):
@@ -112,7 +121,15 @@ class KVStore(object):
     When retrieving key/value pairs, you just give the same reference id
     (ref_id) that you used for storing those key/value pairs that belong to
     that reference id.
+
+    As key names are never removed from the key table (and their value type
+    never changes), the mapping key name -> (key_id, value_type) is cached
+    in the KVStore instance (a KVStore is bound to one engine). Call
+    clear_cache() if you drop the tables.
     """
+    # max. number of parameters we put into one IN clause (sqlite has a limit)
+    IN_CHUNK_SIZE = 500
+
     def __init__(self, meta):
         # note: for ease of use, we use implicit execution. it requires that
         # you have bound an engine to the metadata: metadata.bind = engine
@@ -121,6 +138,13 @@ class KVStore(object):
         self.value_tables = meta.value_tables
         self.supported_value_types = meta.supported_value_types
         self.PICKLE_VALUE_TYPE = meta.PICKLE_VALUE_TYPE
+        self.clear_cache()
+
+    def clear_cache(self):
+        """
+        forget all cached key ids (e.g. after the tables have been dropped)
+        """
+        self._key_cache = {} # key name -> (key_id, value_type)
 
     def _get_value_type(self, value):
         """
@@ -134,41 +158,77 @@ class KVStore(object):
             value_type = self.PICKLE_VALUE_TYPE
         return value_type
 
-    def _get_key_id(self, name, value):
+    def _get_key_id(self, name, value, conn=None):
         """
         get key_id for <name> (create new entry for <name> if there is none yet)
         """
         key_table = self.key_table
         name = unicode(name)
         value_type = self._get_value_type(value)
-        result = select([key_table.c.id, key_table.c.value_type],
-                        key_table.c.name == name
-                       ).execute().fetchone()
-        if result:
-            key_id, wanted_value_type = result
-            assert wanted_value_type == value_type, "wanted: %r have: %r name: %r value: %r" % (
-                   wanted_value_type, value_type, name, value)
-        else:
-            res = key_table.insert().values(name=name, value_type=value_type).execute()
-            key_id = res.last_inserted_ids()[0]
+        try:
+            key_id, wanted_value_type = self._key_cache[name]
+        except KeyError:
+            execute = conn is None and key_table.bind.execute or conn.execute
+            result = execute(select([key_table.c.id, key_table.c.value_type],
+                                    key_table.c.name == name)
+                            ).fetchone()
+            if result:
+                key_id, wanted_value_type = result
+            else:
+                res = execute(key_table.insert().values(name=name, value_type=value_type))
+                key_id, wanted_value_type = res.last_inserted_ids()[0], value_type
+            self._key_cache[name] = key_id, wanted_value_type
+        assert wanted_value_type == value_type, "wanted: %r have: %r name: %r value: %r" % (
+               wanted_value_type, value_type, name, value)
         return key_id
 
-    def _get_value_id(self, value):
+    def _get_value_id(self, value, conn=None):
         """
         get value_id for value (create new entry for <value> if there is none yet)
         """
         value_type = self._get_value_type(value)
         value_table = self.value_tables[value_type]
-        result = select([value_table.c.id],
-                        value_table.c.value == value
-                       ).execute().fetchone()
+        execute = conn is None and value_table.bind.execute or conn.execute
+        result = execute(select([value_table.c.id],
+                                value_table.c.value == value)
+                        ).fetchone()
         if result:
             value_id = result[0]
         else:
-            res = value_table.insert().values(value=value).execute()
+            res = execute(value_table.insert().values(value=value))
             value_id = res.last_inserted_ids()[0]
         return value_id
 
+    def _get_value_ids(self, conn, value_type, values):
+        """
+        get value_ids for a list of values of the same type (create new
+        entries for values that are not there yet).
+
+        @return: dict value -> value_id
+        """
+        value_table = self.value_tables[value_type]
+        value_ids = {}
+        if value_type == self.PICKLE_VALUE_TYPE:
+            # pickled values might be unhashable and can't be compared in bulk
+            for value in values:
+                value_ids[id(value)] = self._get_value_id(value, conn)
+            return value_ids
+        values = list(set(values))
+
+        def lookup(values):
+            for start in range(0, len(values), self.IN_CHUNK_SIZE):
+                chunk = values[start:start+self.IN_CHUNK_SIZE]
+                for value_id, value in conn.execute(select([value_table.c.id, value_table.c.value],
+                                                           value_table.c.value.in_(chunk))):
+                    value_ids[value] = value_id
+
+        lookup(values)
+        missing = [value for value in values if value not in value_ids]
+        if missing:
+            conn.execute(value_table.insert(), [dict(value=value) for value in missing])
+            lookup(missing)
+        return value_ids
+
     def _associate(self, ref_id, key_id, value_id):
         """
         associate a k/v pair identified by (key_id, value_id) with some entity identified by ref_id
@@ -223,29 +283,86 @@ class KVStore(object):
     def store_kv(self, ref_id, kvs):
         """
         store k/v pairs from kvs dict and associate them with ref_id
+
+        this replaces all k/v pairs associated with ref_id before and is done
+        in a single transaction.
         """
-        self._unassociate_all(ref_id)
-        for k, v in kvs.items():
-            self.store(ref_id, k, v)
+        fact_table = self.fact_table
+        conn = fact_table.bind.connect()
+        trans = conn.begin()
+        try:
+            conn.execute(fact_table.delete().where(fact_table.c.ref_id == ref_id))
+            key_ids = []
+            values_by_type = {}
+            for k, v in kvs.items():
+                key_ids.append((self._get_key_id(k, v, conn), v))
+                values_by_type.setdefault(self._get_value_type(v), []).append(v)
+            value_ids = {}
+            for value_type, values in values_by_type.items():
+                value_ids[value_type] = self._get_value_ids(conn, value_type, values)
+            facts = []
+            for key_id, v in key_ids:
+                value_type = self._get_value_type(v)
+                if value_type == self.PICKLE_VALUE_TYPE:
+                    value_id = value_ids[value_type][id(v)]
+                else:
+                    value_id = value_ids[value_type][v]
+                facts.append(dict(ref_id=ref_id, key_id=key_id, value_id=value_id))
+            if facts:
+                conn.execute(fact_table.insert(), facts)
+            trans.commit()
+        except:
+            trans.rollback()
+            # we don't know whether key table changes made it into the DB
+            self.clear_cache()
+            raise
+        finally:
+            conn.close()
 
     def retrieve_kv(self, ref_id):
         """
         get all k/v pairs associated with ref_id
         """
+        return self.retrieve_kv_many([ref_id]).get(ref_id, {})
+
+    def retrieve_kv_many(self, ref_ids):
+        """
+        get all k/v pairs associated with any of the given ref_ids
+
+        values are fetched from all value tables at once (UNION ALL), so this
+        needs only 1 query per IN_CHUNK_SIZE ref_ids.
+
+        @return: dict ref_id -> dict of k/v pairs (ref_ids without any k/v
+                 pairs are not contained)
+        """
         fact_table = self.fact_table
         key_table = self.key_table
         value_tables = self.value_tables
-        results = select([key_table.c.name, key_table.c.value_type, fact_table.c.value_id],
-                         and_(fact_table.c.ref_id == ref_id,
-                              fact_table.c.key_id == key_table.c.id)
-                        ).execute().fetchall()
+        value_types = sorted(value_tables)
+        ref_ids = list(ref_ids)
         result_dict = {}
-        for name, value_type, value_id in results:
-            value_table = value_tables[value_type]
-            value = select([value_table.c.value],
-                           value_table.c.id == value_id
-                          ).execute().fetchone()[0]
-            result_dict[name] = value
+        for start in range(0, len(ref_ids), self.IN_CHUNK_SIZE):
+            chunk = ref_ids[start:start+self.IN_CHUNK_SIZE]
+            selects = []
+            for value_type in value_types:
+                value_table = value_tables[value_type]
+                # every select has one column per value type, so the union
+                # keeps the value column types (and their result processing)
+                columns = [fact_table.c.ref_id, key_table.c.name, key_table.c.value_type]
+                for column_type in value_types:
+                    if column_type == value_type:
+                        column = value_table.c.value
+                    else:
+                        column = cast(null(), value_tables[column_type].c.value.type)
+                    columns.append(column.label('value_%s' % column_type))
+                selects.append(select(columns,
+                                      and_(fact_table.c.ref_id.in_(chunk),
+                                           fact_table.c.key_id == key_table.c.id,
+                                           key_table.c.value_type == value_type,
+                                           fact_table.c.value_id == value_table.c.id)))
+            for row in union_all(*selects).execute():
+                ref_id, name, value_type = row[0], row[1], row[2]
+                result_dict.setdefault(ref_id, {})[name] = row['value_%s' % value_type]
         return result_dict
 
     def has_kv(self, ref_table, **kvs):
@@ -270,6 +387,51 @@ class KVStore(object):
                   ref_table.c.id == fact_table.c.ref_id)))
         return and_(*terms)
 
+    def has_key(self, ref_column, name):
+        """
+        return a conditional that can be used to select entries (referenced
+        by ref_column) that have a value for key <name> associated with them
+        """
+        fact_table = self.fact_table
+        key_table = self.key_table
+        return exists().where(and_(
+                  key_table.c.name == unicode(name),
+                  fact_table.c.key_id == key_table.c.id,
+                  ref_column == fact_table.c.ref_id))
+
+    def has_value(self, ref_column, name, value):
+        """
+        return a conditional that can be used to select entries (referenced
+        by ref_column) that have the k/v pair name:value associated with them
+
+        returns None if value has a type that can't be compared by the DB.
+        """
+        fact_table = self.fact_table
+        key_table = self.key_table
+        value_type = self._get_value_type(value)
+        if value_type == self.PICKLE_VALUE_TYPE:
+            return None
+        values = [(value_type, value), ]
+        # python considers ascii str and unicode values equal, so we must look at both
+        try:
+            if value_type == 'str':
+                values.append(('unicode', value.decode('ascii')))
+            elif value_type == 'unicode':
+                values.append(('str', value.encode('ascii')))
+        except UnicodeError:
+            pass
+        terms = []
+        for value_type, value in values:
+            value_table = self.value_tables[value_type]
+            terms.append(exists().where(and_(
+                  key_table.c.name == unicode(name),
+                  key_table.c.value_type == value_type,
+                  value_table.c.value == value,
+                  fact_table.c.key_id == key_table.c.id,
+                  fact_table.c.value_id == value_table.c.id,
+                  ref_column == fact_table.c.ref_id)))
+        return or_(*terms)
+
 
 class KVItem(object, DictMixin):
     """
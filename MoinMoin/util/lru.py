@@ -0,0 +1,93 @@
+# -*- coding: iso-8859-1 -*-
+"""
+    MoinMoin - LRU mapping for caches
+
+    collections.OrderedDict needs Python 2.7, but we also support 2.6. The
+    caches only need a small part of it: setting a key makes it the most
+    recently used one, popitem() removes the least recently used one.
+
+    Usage (like an OrderedDict used as LRU):
+
+        value = lru.pop(key, None)
+        if value is not None:
+            lru[key] = value # most recently used
+        ...
+        while len(lru) > size:
+            lru.popitem() # least recently used
+
+    It is not thread-safe, callers need to do their own locking.
+
+    @copyright: 2011 MoinMoin:ThomasWaldmann
+    @license: GNU GPL, see COPYING for details.
+"""
+
+from collections import deque
+
+
+class LRUDict(object):
+    """
+    Mapping remembering the order in which its keys were set
+    """
+    def __init__(self):
+        self._entries = {} # key -> (tick, value)
+        # (tick, key), oldest first. Keys set again or popped leave stale
+        # entries behind (tick does not match), they are skipped / compacted.
+        self._queue = deque()
+        self._tick = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __getitem__(self, key):
+        return self._entries[key][1]
+
+    def __setitem__(self, key, value):
+        self._tick += 1
+        self._entries[key] = self._tick, value
+        self._queue.append((self._tick, key))
+        if len(self._queue) > 2 * len(self._entries) + 100:
+            self._compact()
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def pop(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def keys(self):
+        return self._entries.keys()
+
+    def clear(self):
+        self._entries.clear()
+        self._queue.clear()
+
+    def popitem(self):
+        """
+        remove and return (key, value) of the least recently set key
+        """
+        while self._queue:
+            tick, key = self._queue.popleft()
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == tick:
+                del self._entries[key]
+                return key, entry[1]
+        raise KeyError('popitem(): LRUDict is empty')
+
+    def _compact(self):
+        self._queue = deque(sorted((tick, key) for key, (tick, value) in self._entries.iteritems()))
+
@@ -22,15 +22,76 @@ import mimetypes
 from time import time
 from zlib import adler32
 
-from werkzeug import Headers, wrap_file
+from werkzeug import Headers, wrap_file, quote_etag
 from flask import current_app, request
 
 
+def parse_range(value, size):
+    """
+    Parse the value of a HTTP Range header.
+
+    Only a single byte range is supported, for everything else (no header,
+    invalid or multiple ranges) None is returned and the full content should
+    be sent.
+
+    @param value: Range header value (e.g. 'bytes=0-499', 'bytes=500-', 'bytes=-500')
+    @param size: size of the complete content in bytes
+    @return: None or (start, stop) tuple, stop is exclusive. If start >= size,
+             the range is not satisfiable.
+    """
+    if not value:
+        return None
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            # suffix range: the last N bytes
+            length = int(last)
+            if length == 0:
+                return size, size
+            return max(0, size - length), size
+        start = int(first)
+        stop = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if last and stop <= start:
+        return None
+    return start, max(start, min(stop, size))
+
+
+class FileRange(object):
+    """
+    Iterate over length bytes of file, starting at its current position.
+    """
+    def __init__(self, file, length, buffer_size=8192):
+        self.file = file
+        self.length = length
+        self.buffer_size = buffer_size
+
+    def close(self):
+        if hasattr(self.file, 'close'):
+            self.file.close()
+
+    def __iter__(self):
+        remaining = self.length
+        while remaining > 0:
+            data = self.file.read(min(remaining, self.buffer_size))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
 def send_file(filename=None, file=None,
               mimetype=None,
               as_attachment=False, attachment_filename=None,
               mtime=None, cache_timeout=60 * 60 * 12,
-              add_etags=True, etag=None, conditional=False):
+              add_etags=True, etag=None, conditional=False,
+              content_length=None):
     """Sends the contents of a file to the client.
 
     A file can be either a filesystem file or a file-like object (this code
@@ -38,7 +99,8 @@ def send_file(filename=None, file=None,
 
     This will use the most efficient method available, configured and possible
     (for filesystem files some more optimizations may be possible that for
-    file-like objects not having a filesystem filename).
+    file-like objects not having a filesystem filename, so give the filename
+    if there is one, even if you also give an open file).
     By default it will try to use the WSGI server's file_wrapper support.
     Alternatively you can set the application's :attr:`~Flask.use_x_sendfile`
     attribute to ``True`` to directly emit an `X-Sendfile` header.  This
@@ -49,6 +111,11 @@ def send_file(filename=None, file=None,
     * mimetype (based on filename / attachment_filename)
     * mtime (based on filesystem file's metadata)
     * etag (based on filename, mtime, filesystem file size)
+    * content_length (based on filesystem file size)
+
+    For conditional responses with a known content length, single byte range
+    requests (HTTP Range header, optionally with If-Range) are answered with
+    a partial (206) response.
 
     If you do not provide enough information, send_file might raise a
     TypeError.
@@ -90,6 +157,9 @@ def send_file(filename=None, file=None,
                  only works for filesystem files). If you do not give a
                  filename, but you use add_etags, you must explicitely provide
                  the etag as it can't compute it for that case.
+    :param content_length: the size of the file in bytes if provided,
+                           otherwise it will be determined automatically for
+                           filesystem files.
     """
     if filename and not os.path.isabs(filename):
         filename = os.path.join(current_app.root_path, filename)
@@ -107,18 +177,52 @@ def send_file(filename=None, file=None,
             attachment_filename = os.path.basename(filename)
         headers.add('Content-Disposition', 'attachment', filename=attachment_filename)
 
+    if filename:
+        if mtime is None:
+            mtime = os.path.getmtime(filename)
+        if content_length is None:
+            content_length = os.path.getsize(filename)
+
+    if add_etags:
+        if etag is None and filename:
+            etag = 'flask-%s-%s-%s' % (
+                mtime,
+                content_length,
+                adler32(filename) & 0xffffffff
+            )
+        if etag is None:
+            raise TypeError("can't determine etag - please give etag or filename")
+
+    byte_range = None
+    if conditional and content_length is not None:
+        headers['Accept-Ranges'] = 'bytes'
+        if_range = request.environ.get('HTTP_IF_RANGE')
+        if not if_range or etag is not None and if_range == quote_etag(etag):
+            byte_range = parse_range(request.environ.get('HTTP_RANGE'), content_length)
+
+    if byte_range is not None and byte_range[0] >= content_length:
+        if file:
+            file.close()
+        headers['Content-Range'] = 'bytes */%d' % content_length
+        return current_app.response_class(None, status=416, headers=headers)
+
     if current_app.use_x_sendfile and filename:
+        # the web server deals with ranges (if any) itself
         if file:
             file.close()
         headers['X-Sendfile'] = filename
+        byte_range = None
         data = None
     else:
-        if filename:
-            if not file:
-                file = open(filename, 'rb')
-            if mtime is None:
-                mtime = os.path.getmtime(filename)
-        data = wrap_file(request.environ, file)
+        if filename and not file:
+            file = open(filename, 'rb')
+        if byte_range is not None:
+            start, stop = byte_range
+            file.seek(start)
+            data = FileRange(file, stop - start)
+        else:
+            # this lets the WSGI server use its file_wrapper (e.g. sendfile)
+            data = wrap_file(request.environ, file)
 
     rv = current_app.response_class(data, mimetype=mimetype, headers=headers, direct_passthrough=True)
 
@@ -137,14 +241,6 @@ def send_file(filename=None, file=None,
         rv.expires = int(time() + cache_timeout)
 
     if add_etags:
-        if etag is None and filename:
-            etag = 'flask-%s-%s-%s' % (
-                mtime or os.path.getmtime(filename),
-                os.path.getsize(filename),
-                adler32(filename) & 0xffffffff
-            )
-        if etag is None:
-            raise TypeError("can't determine etag - please give etag or filename")
         rv.set_etag(etag)
         if conditional:
             rv = rv.make_conditional(request)
@@ -152,5 +248,17 @@ def send_file(filename=None, file=None,
             # ignore the 304 status code for x-sendfile.
             if rv.status_code == 304:
                 rv.headers.pop('x-sendfile', None)
-    return rv
+                if data is not None:
+                    data.close()
+                return rv
 
+    # set this only after make_conditional, it would read the whole
+    # (passthrough) response to compute the length otherwise.
+    if byte_range is not None:
+        start, stop = byte_range
+        rv.status_code = 206
+        rv.headers['Content-Range'] = 'bytes %d-%d/%d' % (start, stop - 1, content_length)
+        rv.headers['Content-Length'] = str(stop - start)
+    elif content_length is not None:
+        rv.headers['Content-Length'] = str(content_length)
+    return rv